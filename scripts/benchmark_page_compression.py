@@ -0,0 +1,107 @@
+"""
+Benchmark the storage formats and compression of register pages.
+
+Generates a register page in memory with a realistic history of edits
+by a few researchers, and prints the stored size of the page and the
+time to encode and decode it in each page format and compression.
+
+Run from the root of the repository:
+
+    PYTHONPATH=src/libraries/python python scripts/benchmark_page_compression.py
+"""
+
+import argparse
+import random
+import time
+import uuid
+
+from page_format import (
+    PAGE_FORMAT_COMPACT,
+    PAGE_FORMAT_JSON,
+    decode_page,
+    decompress_page,
+    encode_page,
+    page_object,
+)
+
+VALUES = {
+    "Sample ID": ["A1", "B2", "C3"],
+    "Host species": ["Vulpes vulpes", "Homo sapiens", "Myotis lucifugus", "Bat"],
+    "Host species NCBI tax ID": ["9627", "9606", "59463", ""],
+    "Latitude": ["40.0150", "-33.8688", "51.5072", ""],
+    "Longitude": ["-105.2705", "151.2093", "-0.1276", ""],
+    "Collection day": ["1", "15", "31"],
+    "Collection month": ["1", "6", "12"],
+    "Collection year": ["2019", "2020", "2021"],
+    "Detection method": ["PCR/sequencing", "ELISA", ""],
+    "Detection outcome": ["positive", "negative", "inconclusive"],
+    "Pathogen": ["SARS-CoV-2", "Rabies lyssavirus", ""],
+    "Organism sex": ["male", "female", ""],
+    "Dead or alive": ["alive", "dead", ""],
+}
+
+
+def create_datapoint(rng: random.Random, values: list[str], users: list[str]):
+    datapoint = None
+    version = 1672531200000
+    for _ in range(rng.choice([1, 1, 1, 2, 3])):
+        version += rng.randint(1000, 100000000)
+        datapoint = {
+            "dataValue": rng.choice(values),
+            "modifiedBy": rng.choice(users),
+            "version": str(version),
+            **({"previous": datapoint} if datapoint else {}),
+        }
+    return datapoint
+
+
+def create_register(record_count: int, user_count: int) -> dict:
+    rng = random.Random(0)
+    users = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(user_count)]
+    return {
+        "register": {
+            f"rec0|{index:08d}": {
+                **{
+                    column: create_datapoint(rng, values, users)
+                    for column, values in VALUES.items()
+                },
+                "_meta": {"order": index},
+            }
+            for index in range(record_count)
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    register_dict = create_register(args.records, args.users)
+
+    for page_format in (PAGE_FORMAT_JSON, PAGE_FORMAT_COMPACT):
+        for compression in ("none", "gzip"):
+            start = time.time()
+            for _ in range(args.repeat):
+                stored = page_object(
+                    encode_page(register_dict, page_format), compression
+                )
+            encode_seconds = (time.time() - start) / args.repeat
+
+            start = time.time()
+            for _ in range(args.repeat):
+                decoded = decode_page(decompress_page(stored["Body"]))
+            decode_seconds = (time.time() - start) / args.repeat
+
+            assert decoded == register_dict
+            print(
+                f"{page_format} {compression}: "
+                f"{len(stored['Body']) / 1e6:.2f}MB, "
+                f"encode {encode_seconds:.3f}s, decode {decode_seconds:.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark merging records as Record models and as plain dicts.
+
+Generates two diverging versions of a page of records with deep
+histories, and prints the time to merge every record by parsing both
+versions into the Record model, as save_records did, and by merging
+the decoded dicts with `record_merge.merge_records`.
+
+Run from the root of the repository:
+
+    PYTHONPATH=src/libraries/python python scripts/benchmark_record_merge.py
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from record_merge import merge_records
+from register import Record
+
+VALUES = {
+    "Sample ID": ["A1", "B2", "C3"],
+    "Host species": ["Vulpes vulpes", "Homo sapiens", "Myotis lucifugus"],
+    "Latitude": ["40.0150", "-33.8688", "51.5072"],
+    "Longitude": ["-105.2705", "151.2093", "-0.1276"],
+    "Collection day": ["1", "15", "28"],
+    "Collection month": ["1", "6", "12"],
+    "Collection year": ["2019", "2020", "2021"],
+    "Detection outcome": ["positive", "negative", "inconclusive"],
+    "Pathogen": ["SARS-CoV-2", "Rabies lyssavirus"],
+    "Unknown column": ["extra", "other"],
+}
+
+
+def create_history(rng: random.Random, values: list[str], versions: list[int]):
+    datapoint = None
+    for version in versions:
+        datapoint = {
+            "dataValue": rng.choice(values),
+            "modifiedBy": rng.choice(["dev", "researcher"]),
+            "version": str(version),
+            **({"previous": datapoint} if datapoint else {}),
+        }
+    return datapoint
+
+
+def create_records(record_count: int, depth: int, seed: int) -> dict:
+    """Both versions of each datapoint share their oldest versions,
+    and then each has its own newer versions."""
+    rng = random.Random(seed)
+    shared = [1672531200000 + version for version in range(depth)]
+    records = {}
+    for index in range(record_count):
+        own = sorted(rng.sample(range(shared[-1] + 1, shared[-1] + 4 * depth), depth))
+        records[f"rec0|{index:08d}"] = {
+            column: create_history(rng, values, shared + own)
+            for column, values in VALUES.items()
+        }
+    return records
+
+
+def merge_models(left: dict, right: dict) -> dict:
+    merged = {}
+    for record_id, record in right.items():
+        merge_result = Record.merge(Record(**left[record_id]), Record(**record))
+        merged[record_id] = json.loads(
+            merge_result.json(by_alias=True, exclude_none=True)
+        )
+    return merged
+
+
+def merge_dicts(left: dict, right: dict) -> dict:
+    return {
+        record_id: merge_records(left[record_id], record)
+        for record_id, record in right.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--records", type=int, default=100)
+    parser.add_argument("--depth", type=int, default=(10, 50, 100), nargs="+")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # parsing deep histories into the models recurses for every version
+    sys.setrecursionlimit(100000)
+
+    for depth in args.depth:
+        left = create_records(args.records, depth // 2, 0)
+        right = create_records(args.records, depth // 2, 1)
+
+        for name, merge in (("models", merge_models), ("dicts", merge_dicts)):
+            start = time.time()
+            for _ in range(args.repeat):
+                merge(left, right)
+            seconds = (time.time() - start) / args.repeat
+            print(f"depth {depth} {name}: {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
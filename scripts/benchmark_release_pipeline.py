@@ -0,0 +1,105 @@
+"""
+Benchmark the release validation pipeline on synthetic datasets.
+
+Generates a multi-page dataset in memory, simulates the S3 download
+latency of each page, and prints the wall-clock time to validate the
+dataset serially and with increasing numbers of threads and processes.
+
+Run from the root of the repository:
+
+    PYTHONPATH=src/libraries/python python scripts/benchmark_release_pipeline.py
+"""
+
+import argparse
+import json
+import random
+import time
+from functools import partial
+
+from columnar_register import ValidationEngine, get_release_report
+from register import DatasetReleaseStatus, ReleaseReport
+from release_pipeline import get_pipelined_release_report
+
+VALUES = {
+    "Sample ID": ["A1", "B2", "C3"],
+    "Host species": ["Vulpes vulpes", "Homo sapiens", "HUMAN", "", "Bat"],
+    "Host species NCBI tax ID": ["9606", "0", "pears", ""],
+    "Latitude": ["40.0150", "-90", "90.1", "plum", ""],
+    "Longitude": ["105.2705", "-180", "-1105.2705", ""],
+    "Collection day": ["1", "31", "0", ""],
+    "Collection month": ["1", "2", "13", ""],
+    "Collection year": ["2019", "2020", "19", ""],
+    "Detection outcome": ["positive", "NEG", "maybe", ""],
+    "Pathogen": ["SARS-CoV-2", ""],
+    "Organism sex": ["m", "Female", "?", ""],
+    "Dead or alive": ["alive", "D", "zombie", ""],
+}
+
+
+def create_page(page: int, record_count: int) -> bytes:
+    rng = random.Random(page)
+    register = {
+        "register": {
+            f"rec{page}-{index}": {
+                column: {
+                    "dataValue": rng.choice(values),
+                    "modifiedBy": "dev",
+                    "version": "1",
+                }
+                for column, values in VALUES.items()
+            }
+            for index in range(record_count)
+        }
+    }
+    return json.dumps(register).encode("UTF-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, default=16)
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument(
+        "--engine", type=ValidationEngine, default=ValidationEngine.COLUMNAR
+    )
+    args = parser.parse_args()
+
+    pages = {
+        f"dataset/data_{page}.json": create_page(page, args.records)
+        for page in range(args.pages)
+    }
+    keys = list(pages)
+    validate_page = partial(get_release_report, engine=args.engine)
+
+    def fetch_page(key: str) -> bytes:
+        time.sleep(args.latency)
+        return pages[key]
+
+    start = time.time()
+    serial_report = ReleaseReport()
+    serial_report.release_status = DatasetReleaseStatus.RELEASED
+    for key in keys:
+        serial_report = ReleaseReport.merge(
+            serial_report, validate_page(fetch_page(key))
+        )
+    print(f"serial: {time.time() - start:.2f}s")
+
+    for workers in args.workers:
+        for processes in (0, workers):
+            start = time.time()
+            release_report = get_pipelined_release_report(
+                keys,
+                fetch_page,
+                validate_page,
+                threads=workers,
+                processes=processes,
+            )
+            elapsed = time.time() - start
+
+            assert release_report == serial_report
+            print(f"threads={workers} processes={processes}: {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
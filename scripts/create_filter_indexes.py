@@ -0,0 +1,35 @@
+"""
+Create the indexes of the filters of published records.
+
+The indexes are declared in models.py and created with the tables,
+so this is only needed once for a database whose tables were created
+before the indexes were added. The indexes are built CONCURRENTLY so
+that publishing is not blocked while they are built, and indexes which
+already exist are skipped. If a build fails, the invalid index it
+leaves must be dropped before the script is run again.
+
+Run from the root of the repository, with credentials for the
+database secret:
+
+    DATABASE=<stack>-database PYTHONPATH=src/libraries/python \
+        python scripts/create_filter_indexes.py
+"""
+
+from engine import get_engine
+from models import Base
+
+
+def create_filter_indexes() -> None:
+    engine = get_engine()
+
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.dialect_options["postgresql"]["concurrently"] = True
+                print(f"Create index {index.name}")
+                index.create(connection, checkfirst=True)
+
+
+if __name__ == "__main__":
+    create_filter_indexes()
@@ -0,0 +1,110 @@
+"""
+Profile the import time of each lambda handler.
+
+Imports the app module of each lambda in a fresh interpreter with
+python -X importtime, like a cold start, and prints the total import
+time of each handler with the modules which took longest to import.
+Environment variables read by the handlers are set to dummy values,
+so handlers which call AWS or the database at import time will fail
+or include the network time in their total.
+
+Run from the root of the repository:
+
+    python scripts/profile_imports.py
+"""
+
+import argparse
+import glob
+import os
+import re
+import subprocess
+import sys
+
+LAMBDA_DIRECTORY = "src/lambda"
+LIBRARY_DIRECTORY = "src/libraries/python"
+
+ENVIRON_PATTERN = re.compile(r"os\.environ\[\"(\w+)\"\]")
+
+# import time: self [us] | cumulative | imported package
+IMPORTTIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def get_environ() -> dict[str, str]:
+    """Dummy values for every environment variable read by the lambdas"""
+    environ = dict(os.environ)
+    environ["PYTHONPATH"] = os.path.abspath(LIBRARY_DIRECTORY)
+    environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+
+    sources = glob.glob(f"{LAMBDA_DIRECTORY}/*/app.py")
+    sources += glob.glob(f"{LIBRARY_DIRECTORY}/*.py")
+    for source in sources:
+        with open(source, encoding="utf-8") as file:
+            for name in ENVIRON_PATTERN.findall(file.read()):
+                environ.setdefault(name, name.lower())
+
+    return environ
+
+
+def profile_handler(handler: str, environ: dict[str, str]):
+    """Return the total import time of the handler in seconds and
+    the cumulative import time of each module it imports, or None
+    and the error if the handler failed to import."""
+    if not os.path.exists(os.path.join(LAMBDA_DIRECTORY, handler, "app.py")):
+        return None, "no such lambda"
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=os.path.join(LAMBDA_DIRECTORY, handler),
+        env=environ,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+
+    # Modules are listed after the modules they import, indented by
+    # two spaces for each level, so the modules imported directly by
+    # the handler are the ones indented by three spaces before it.
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if not match:
+            continue
+        (_, cumulative, indent, module) = match.groups()
+        if len(indent) == 3:
+            modules[module] = int(cumulative) / 1e6
+        elif len(indent) == 1:
+            if module == "app":
+                return int(cumulative) / 1e6, modules
+            modules = {}
+
+    return None, "app was not imported"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("handlers", nargs="*", help="default: every lambda")
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    handlers = args.handlers or sorted(
+        os.path.basename(os.path.dirname(path))
+        for path in glob.glob(f"{LAMBDA_DIRECTORY}/*/app.py")
+    )
+    environ = get_environ()
+
+    for handler in handlers:
+        total, modules = profile_handler(handler, environ)
+        if total is None:
+            print(f"{handler}: failed, {modules}")
+            continue
+
+        print(f"{handler}: {total:.3f}s")
+        slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)
+        for module, seconds in slowest[: args.top]:
+            print(f"    {module}: {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
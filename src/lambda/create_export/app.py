@@ -1,7 +1,7 @@
 import os
 from datetime import datetime
 
-import boto3
+from clients import lazy_client, lazy_table
 from data_downloads import (
     CreateExportDataEvent,
     DataDownloadMetadata,
@@ -22,10 +22,9 @@ CORS_ALLOW = os.environ["CORS_ALLOW"]
 REGION = os.environ["REGION"]
 DATA_DOWNLOAD_BUCKET_NAME = os.environ["DATA_DOWNLOAD_BUCKET_NAME"]
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
-SES_CLIENT = boto3.client("ses", region_name=REGION)
+SES_CLIENT = lazy_client("ses", region_name=REGION)
 
 
 def lambda_handler(event, _):
@@ -1,15 +1,14 @@
 import json
 import os
 
-import boto3
 from auth import check_auth
 from botocore.exceptions import ClientError
+from clients import lazy_table
 from format import format_response
 from pydantic import BaseModel, Extra, ValidationError
 from register import Project
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
 
 class CreateProjectBody(BaseModel):
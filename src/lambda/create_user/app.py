@@ -9,16 +9,15 @@ NOTE:
 import os
 import json
 
-import boto3
 from botocore.exceptions import ClientError
 from pydantic import ValidationError
 from auth import Claims
 
+from clients import lazy_table
 from format import format_response
 from register import User
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
 
 def lambda_handler(event, _):
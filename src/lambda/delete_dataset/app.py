@@ -1,23 +1,27 @@
 import os
 
-import boto3
 from botocore.client import ClientError
 
 from pydantic import BaseModel, Extra, ValidationError
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 from auth import check_auth
+from clients import lazy_client, lazy_table
 from engine import get_engine
 from format import format_response
 from models import PublishedDataset
+from publish_fanout import invoke_refresh_published_records
 from register import Dataset, DatasetReleaseStatus
+from release_pipeline import get_page_reports_key
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
-S3CLIENT = boto3.client("s3")
+S3CLIENT = lazy_client("s3")
 DATASETS_S3_BUCKET = os.environ["DATASETS_S3_BUCKET"]
 
+LAMBDACLIENT = lazy_client("lambda")
+REFRESH_PUBLISHED_RECORDS_LAMBDA = os.environ["REFRESH_PUBLISHED_RECORDS_LAMBDA"]
+
 
 class DeleteDatasetBody(BaseModel):
     """Event data payload to upload a dataset."""
@@ -44,6 +48,8 @@ def delete_published_dataset(dataset: Dataset):
         session.delete(published_dataset)
         session.commit()
 
+    invoke_refresh_published_records(LAMBDACLIENT, REFRESH_PUBLISHED_RECORDS_LAMBDA)
+
 
 def lambda_handler(event, _):
 
@@ -70,14 +76,6 @@ def lambda_handler(event, _):
             403, "Cannot delete dataset while it is being published."
         )
 
-    try:
-        if validated.dataset.release_status == DatasetReleaseStatus.PUBLISHED:
-            delete_published_dataset(validated.dataset)
-
-    except ValueError as e:
-        print(e)
-        return format_response(403, "Error unpublishing dataset")
-
     try:
 
         METADATA_TABLE.delete_item(
@@ -89,8 +87,25 @@ def lambda_handler(event, _):
             Key=f"{validated.dataset.dataset_id}/data.json",
         )
 
-        return format_response(200, "Dataset deleted.")
+        S3CLIENT.delete_object(
+            Bucket=DATASETS_S3_BUCKET,
+            Key=get_page_reports_key(validated.dataset.dataset_id),
+        )
 
     except ClientError as e:
         print(e)
         return format_response(403, "Error deleting dataset")
+
+    # The published records are deleted after the metadata, so that a
+    # dataset is never left marked as published without its records;
+    # the possible filters and map tiles are then refreshed by another
+    # lambda, so that the request doesn't wait for them.
+    try:
+        if validated.dataset.release_status == DatasetReleaseStatus.PUBLISHED:
+            delete_published_dataset(validated.dataset)
+
+    except ValueError as e:
+        # the dataset has no published records to delete
+        print(e)
+
+    return format_response(200, "Dataset deleted.")
@@ -1,7 +1,7 @@
 import os
 
-import boto3
 from auth import check_auth
+from clients import lazy_client
 from data_downloads import CreateExportDataEvent
 
 # from auth import check_auth
@@ -9,7 +9,7 @@ from format import format_response
 from published_records import get_multi_value_query_string_parameters
 from pydantic import ValidationError
 
-LAMBDACLIENT = boto3.client("lambda")
+LAMBDACLIENT = lazy_client("lambda")
 CREATE_CSV_EXPORT_LAMBDA = os.environ["CREATE_CSV_EXPORT_LAMBDA"]
 
 # DYNAMODB = boto3.resource("dynamodb")
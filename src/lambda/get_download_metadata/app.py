@@ -1,16 +1,15 @@
 import os
 
-import boto3
 from pydantic import BaseModel, Extra, Field, ValidationError
+from clients import lazy_client, lazy_table
 from data_downloads import DataDownloadMetadata
 
 from format import format_response
 
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
-S3CLIENT = boto3.client("s3")
+S3CLIENT = lazy_client("s3")
 DATA_DOWNLOAD_BUCKET_NAME = os.environ["DATA_DOWNLOAD_BUCKET_NAME"]
 
 
@@ -2,21 +2,22 @@ import base64
 import os
 from typing import Optional
 
+from botocore.exceptions import BotoCoreError, ClientError
 from engine import get_engine
 from format import format_response
-from models import PublishedDataset, PublishedProject, PublishedRecord
+from map_tiles import get_tile
 from published_records import (
     FiltersQueryStringParameters,
-    get_compound_filter,
     get_multi_value_query_string_parameters,
 )
 from pydantic import BaseModel, Field, ValidationError, validator
-from sqlalchemy import select
 from sqlalchemy.orm import Session
-from sqlalchemy.sql import func
+from tile_cache import get_filters_hash, get_tile_cache, get_tile_key
 
 CORS_ALLOW = os.environ["CORS_ALLOW"]
 
+TILE_CACHE = get_tile_cache()
+
 
 class PathParameters(BaseModel):
 
@@ -83,6 +84,18 @@ class GetMapTileEvent(BaseModel):
     )
 
 
+def format_tile_response(tile_bytes: bytes):
+    return {
+        "statusCode": 200,
+        "headers": {
+            "Access-Control-Allow-Origin": CORS_ALLOW,
+            "Content-Type": "application/octet-stream",
+        },
+        "body": base64.b64encode(tile_bytes).decode("utf-8"),
+        "isBase64Encoded": True,
+    }
+
+
 def lambda_handler(event, _):
 
     multivalue_params = get_multi_value_query_string_parameters(event)
@@ -94,59 +107,42 @@ def lambda_handler(event, _):
     except ValidationError as e:
         return format_response(400, e.json(), preformatted=True)
 
-    engine = get_engine()
+    z = validated.path_parameters.z
+    x = validated.path_parameters.x
+    y = validated.path_parameters.y
 
-    with Session(engine) as session:
+    # Errors of the tile cache are printed, and the tile is rendered
+    # from the database without caching it, so that requests don't
+    # fail when the cache is unavailable
+    tile_key = None
+    if TILE_CACHE:
+        try:
+            version = TILE_CACHE.get_version()
+            if version:
+                tile_key = get_tile_key(
+                    version,
+                    get_filters_hash(validated.query_string_parameters),
+                    z,
+                    x,
+                    y,
+                )
+                tile_bytes = TILE_CACHE.read(tile_key)
+                if tile_bytes is not None:
+                    return format_tile_response(tile_bytes)
 
-        (compound_filter, _) = get_compound_filter(validated.query_string_parameters)
+        except (BotoCoreError, ClientError, OSError) as e:
+            print(e)
+            tile_key = None
 
-        layer_name = "pharos-points"
+    engine = get_engine()
 
-        tile_bounds = func.ST_TileEnvelope(
-            validated.path_parameters.z,
-            validated.path_parameters.x,
-            validated.path_parameters.y,
-        )
+    with Session(engine) as session:
+        tile_bytes = get_tile(session, z, x, y, validated.query_string_parameters)
 
-        mvt_geom = (
-            select(
-                func.ST_AsMVTGeom(
-                    func.ST_Transform(PublishedRecord.geom, 3857),
-                    tile_bounds,
-                ),
-                PublishedRecord.pharos_id,
-                PublishedProject.name.label("project_name"),
-            )
-            .select_from(PublishedRecord)
-            .join(PublishedDataset)
-            .join(PublishedProject)
-            .where(compound_filter)
-            .where(
-                func.ST_Intersects(
-                    PublishedRecord.geom, func.ST_Transform(tile_bounds, 4326)
-                )
-            )
-            .limit(50000)
-            .cte("mvt_geom")
-        )
-
-        query = select(
-            func.ST_AsMVT(mvt_geom.table_valued(), layer_name),
-        ).select_from(mvt_geom)
-
-        memory = session.scalar(query)
-
-        if not memory:
-            tile_bytes = bytes()
-        else:
-            tile_bytes = bytes(memory)
-
-        return {
-            "statusCode": 200,
-            "headers": {
-                "Access-Control-Allow-Origin": CORS_ALLOW,
-                "Content-Type": "application/octet-stream",
-            },
-            "body": base64.b64encode(tile_bytes).decode("utf-8"),
-            "isBase64Encoded": True,
-        }
+    if TILE_CACHE and tile_key:
+        try:
+            TILE_CACHE.write(tile_key, tile_bytes)
+        except (BotoCoreError, ClientError, OSError) as e:
+            print(e)
+
+    return format_tile_response(tile_bytes)
@@ -1,20 +1,28 @@
+import json
+
 from column_alias import API_NAME_TO_UI_NAME_MAP
 from engine import get_engine
 from format import format_response
-from published_records_metadata import get_possible_filters, sortable_fields
-
+from published_records_metadata import get_cached_possible_filters, sortable_fields
 
-def lambda_handler(_, __):
-    engine = get_engine()
-    possible_filters = get_possible_filters(engine)
-    ui_names_of_sortable_fields = [
+UI_NAMES_OF_SORTABLE_FIELDS = json.dumps(
+    [
         API_NAME_TO_UI_NAME_MAP.get(field_name, field_name)
         for field_name in sortable_fields
     ]
+)
+
+
+def lambda_handler(_, __):
+    engine = get_engine()
+    possible_filters, version = get_cached_possible_filters(engine)
+
+    # the cached possible filters are already json,
+    # so the response is formatted without parsing them.
     return format_response(
         200,
-        {
-            "possibleFilters": possible_filters,
-            "sortableFields": ui_names_of_sortable_fields,
-        },
+        f'{{"possibleFilters": {possible_filters}, '
+        f'"sortableFields": {UI_NAMES_OF_SORTABLE_FIELDS}, '
+        f'"version": {json.dumps(version)}}}',
+        preformatted=True,
     )
@@ -1,16 +1,15 @@
 import os
-import boto3
 from boto3.dynamodb.conditions import Key
 from botocore.utils import ClientError
 from pydantic import BaseModel, Extra, Field, ValidationError
 
 from auth import check_auth
+from clients import lazy_table
 from format import format_response
 from register import Dataset
 
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
 
 class ListDatasetsBody(BaseModel):
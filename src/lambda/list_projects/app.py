@@ -1,11 +1,10 @@
 import os
-import boto3
 from botocore.utils import ClientError
 from pydantic import ValidationError
 from auth import check_auth
+from clients import DYNAMODB
 from format import format_response
 
-DYNAMODB = boto3.resource("dynamodb")
 METADATA_TABLE = os.environ["METADATA_TABLE_NAME"]
 
 
@@ -1,18 +1,21 @@
+import json
 import os
 from datetime import datetime
 from typing import Optional
 
-import boto3
-from auth import check_auth
+from auth import check_auth, check_project_auth
 from botocore.utils import ClientError
+from clients import lazy_client, lazy_table
 from format import format_response
+from page_format import decode_page, to_register_json
+from page_log import read_page
 from pydantic import BaseModel, Extra, Field, ValidationError
-from register import Dataset
+from register import Dataset, PageSummary
+from release_pipeline import get_page_summary_key, get_record_versions
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
-S3CLIENT = boto3.client("s3")
+S3CLIENT = lazy_client("s3")
 DATASETS_S3_BUCKET = os.environ["DATASETS_S3_BUCKET"]
 
 
@@ -21,15 +24,42 @@ class LoadRecordsEventBody(BaseModel):
     dataset_id: str = Field(alias="datasetID")
     register_page: str = Field(alias="registerPage")
     last_updated: Optional[str] = Field(alias="lastUpdated")
+    # The newest datapoint version which the client has in this page;
+    # if it is given, only the records with newer versions are sent
+    since_version: Optional[int] = Field(alias="sinceVersion")
 
     class Config:
         extra = Extra.forbid
 
 
+def load_record_versions(key: str, etag: str) -> Optional[dict[str, int]]:
+    """Return the newest version of each record of the page from the
+    summary which save_records maintains, or None if the summary is
+    missing or describes a different version of the page."""
+    try:
+        page_summary_response = S3CLIENT.get_object(
+            Bucket=DATASETS_S3_BUCKET, Key=get_page_summary_key(key)
+        )
+        page_summary = PageSummary.parse_raw(page_summary_response["Body"].read())
+
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "NoSuchKey":
+            print(e)
+        return None
+    except ValidationError as e:
+        print(e)
+        return None
+
+    if page_summary.etag != etag or not page_summary.versions:
+        return None
+
+    return page_summary.versions
+
+
 def lambda_handler(event, _):
 
     try:
-        user = check_auth(event)
+        user = check_auth(event, cache=True)
     except ValidationError:
         return format_response(403, "Not Authorized")
 
@@ -44,7 +74,7 @@ def lambda_handler(event, _):
         print(e.json(indent=2))
         return {"statusCode": 400, "body": e.json()}
 
-    if validated.project_id not in user.project_ids:
+    if not check_project_auth(event, user, validated.project_id):
         return format_response(403, "Researcher does not have access to this project")
 
     if validated.last_updated:
@@ -96,30 +126,43 @@ def lambda_handler(event, _):
 
     # If the server has a newer version of the page, send that.
 
-    # There is a potential optimization here to only send records
-    # which contain datapoints with versions newer than the
-    # client_last_updated timestamp, which would cost more
-    # server time but potentially save a lot of network time.
-    # At the moment users are not likely to hit the case where
-    # they need to sync just a few records, because not many
-    # (or maybe any) users users are currently using multiple
-    # devices for data entry simultaneously so I'm leaving
-    # things simple here. The main use-case where users will
-    # hit this is if they log out and log back in or log in
-    # to a new device, and in those cases they need the whole
-    # page anyway.
-
-    print("SEND FULL REGISTER")
-
     key = f"{validated.dataset_id}/data_{validated.register_page}.json"
 
     try:
-        register_json = (
-            S3CLIENT.get_object(Bucket=DATASETS_S3_BUCKET, Key=key)["Body"]
-            .read()
-            .decode("utf-8")
-        )
-        return format_response(200, register_json, preformatted=True)
+        page, etag = read_page(S3CLIENT, DATASETS_S3_BUCKET, key)
 
     except ClientError as e:
         return format_response(500, e)
+
+    # Clients which already have some version of the page, such as
+    # users entering data on multiple devices, only need the records
+    # which changed since the newest version they have. The versions
+    # of the records are read from the page summary, and only the
+    # changed records are decoded; if the summary is not current,
+    # the versions are read from the page instead.
+    if validated.since_version is not None:
+        print("SEND RECORDS SINCE VERSION")
+
+        versions = load_record_versions(key, etag)
+        if versions is None:
+            versions = get_record_versions(decode_page(page, False)["register"])
+
+        record_ids = {
+            record_id
+            for record_id, version in versions.items()
+            if version > validated.since_version
+        }
+        if not record_ids:
+            return format_response(200, {"register": {}})
+
+        register_json = json.dumps(decode_page(page, record_ids=record_ids))
+        return format_response(200, register_json, preformatted=True)
+
+    # The main use-case for the whole page is if the user logs out
+    # and logs back in or logs in to a new device, and in those
+    # cases they need the whole page anyway.
+
+    print("SEND FULL REGISTER")
+
+    register_json = to_register_json(page).decode("utf-8")
+    return format_response(200, register_json, preformatted=True)
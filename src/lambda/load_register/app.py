@@ -1,15 +1,16 @@
 import os
 
-import boto3
 from auth import check_auth
 from botocore.utils import ClientError
+from clients import lazy_client, lazy_table
 from format import format_response
+from page_format import to_register_json
+from page_log import read_page
 from pydantic import BaseModel, Extra, Field, ValidationError
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
-S3CLIENT = boto3.client("s3")
+S3CLIENT = lazy_client("s3")
 DATASETS_S3_BUCKET = os.environ["DATASETS_S3_BUCKET"]
 
 
@@ -46,11 +47,8 @@ def lambda_handler(event, _):
 
     try:
         key = f"{validated.dataset_id}/data.json"
-        register_json = (
-            S3CLIENT.get_object(Bucket=DATASETS_S3_BUCKET, Key=key)["Body"]
-            .read()
-            .decode("utf-8")
-        )
+        page, _ = read_page(S3CLIENT, DATASETS_S3_BUCKET, key)
+        register_json = to_register_json(page).decode("utf-8")
         return format_response(200, register_json, preformatted=True)
 
     except ClientError as e:
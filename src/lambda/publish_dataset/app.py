@@ -0,0 +1,51 @@
+import os
+
+from clients import lazy_client, lazy_table
+from engine import get_engine
+from publish_fanout import (
+    PublishShard,
+    finish_publish_job,
+    invalidate_api_cache,
+    publish_shard,
+    refresh_published_records,
+)
+
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
+
+S3CLIENT = lazy_client("s3")
+DATASETS_S3_BUCKET = os.environ["DATASETS_S3_BUCKET"]
+
+CF_CLIENT = lazy_client("cloudfront")
+CF_CACHE_POLICY_ID = os.environ["CF_CACHE_POLICY_ID"]
+
+# Insert records with COPY instead of the ORM
+COPY_RECORDS = os.environ.get("COPY_RECORDS", "false") == "true"
+
+
+def lambda_handler(event: dict, _):
+    shard = PublishShard.parse_obj(event)
+
+    engine = get_engine()
+
+    job = publish_shard(
+        shard,
+        engine,
+        S3CLIENT,
+        DATASETS_S3_BUCKET,
+        METADATA_TABLE,
+        COPY_RECORDS,
+    )
+
+    # the worker which records the last dataset finishes the job, and the
+    # project is finished before the published records are refreshed, so
+    # that a failed refresh can't leave the project publishing
+    if job:
+        project = finish_publish_job(METADATA_TABLE, shard.project, job)
+        refresh_published_records(engine)
+        invalidate_api_cache(
+            CF_CLIENT,
+            CF_CACHE_POLICY_ID,
+            f"{project.project_id}_{project.last_updated}",
+        )
+
+    return True
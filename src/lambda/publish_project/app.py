@@ -2,23 +2,22 @@ from datetime import datetime
 import os
 from typing import Union
 
-import boto3
 from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 from pydantic import BaseModel, Extra, Field, ValidationError
 
 from auth import check_auth
+from clients import DYNAMODB, lazy_client, lazy_table
 from format import format_response
 from register import Dataset, DatasetReleaseStatus, Project, ProjectPublishStatus, User
 
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
-S3CLIENT = boto3.client("s3")
+S3CLIENT = lazy_client("s3")
 DATASETS_S3_BUCKET = os.environ["DATASETS_S3_BUCKET"]
 
-LAMBDACLIENT = boto3.client("lambda")
+LAMBDACLIENT = lazy_client("lambda")
 
 PUBLISH_REGISTERS_LAMBDA = os.environ["PUBLISH_REGISTERS_LAMBDA"]
 
@@ -2,30 +2,43 @@ import os
 import time
 from datetime import datetime
 
-import boto3
 from botocore.exceptions import ClientError
+from clients import lazy_client, lazy_table
 from engine import get_engine
-from models import Base, PublishedDataset, PublishedProject, PublishedRecord
-from publish_register import (
-    create_published_dataset,
-    create_published_project,
-    create_published_records,
-    upsert_project_users,
+from models import Base
+from publish_fanout import (
+    PublishShard,
+    invalidate_api_cache,
+    publish_dataset,
+    refresh_published_records,
+    run_shards_locally,
+    start_publish_job,
 )
+from publish_register import create_published_project, upsert_project_users
 from pydantic import BaseModel, Extra
 from register import Dataset, DatasetReleaseStatus, Project, ProjectPublishStatus, User
-from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
-S3CLIENT = boto3.client("s3")
+S3CLIENT = lazy_client("s3")
 DATASETS_S3_BUCKET = os.environ["DATASETS_S3_BUCKET"]
 
-CF_CLIENT = boto3.client("cloudfront")
+CF_CLIENT = lazy_client("cloudfront")
 CF_CACHE_POLICY_ID = os.environ["CF_CACHE_POLICY_ID"]
 
+LAMBDACLIENT = lazy_client("lambda")
+
+# Publish each dataset in a separate invocation of this lambda
+PUBLISH_DATASET_LAMBDA = os.environ.get("PUBLISH_DATASET_LAMBDA")
+
+# Publish each dataset on a local process pool
+# standing in for the publish dataset lambda
+PUBLISH_PROCESSES = int(os.environ.get("PUBLISH_PROCESSES", "0"))
+
+# Insert records with COPY instead of the ORM
+COPY_RECORDS = os.environ.get("COPY_RECORDS", "false") == "true"
+
 
 class PublishRegistersData(BaseModel):
     """Event data payload to publish the registers of the project."""
@@ -38,35 +51,27 @@ class PublishRegistersData(BaseModel):
         extra = Extra.forbid
 
 
-def download_and_create_published_records(
-    published_dataset: PublishedDataset, dataset: Dataset, key: str
-) -> list[PublishedRecord]:
-
-    start = time.time()
-    try:
-        register_json = (
-            S3CLIENT.get_object(Bucket=DATASETS_S3_BUCKET, Key=key)["Body"]
-            .read()
-            .decode("utf-8")
-        )
-
-        start = time.time()
-
-        records = create_published_records(
-            register_json=register_json,
-            project_id=published_dataset.project_id,
-            dataset_id=dataset.dataset_id,
-        )
-
-        print("Load register and create records", time.time() - start)
-
-        return records
-
-    except ClientError as e:
-        dataset.release_status = DatasetReleaseStatus.UNRELEASED
-        dataset.last_updated = datetime.utcnow().isoformat() + "Z"
-        METADATA_TABLE.put_item(Item=dataset.table_item())
-        raise e
+def fan_out_datasets(metadata: PublishRegistersData) -> None:
+    """Start a publish job and a worker for each released dataset;
+    the last worker to finish updates the project publish status."""
+    job = start_publish_job(
+        METADATA_TABLE, metadata.project, metadata.released_datasets
+    )
+
+    shards = [
+        PublishShard(jobID=job.job_id, project=metadata.project, dataset=dataset)
+        for dataset in metadata.released_datasets
+    ]
+
+    if PUBLISH_DATASET_LAMBDA:
+        for shard in shards:
+            LAMBDACLIENT.invoke(
+                FunctionName=PUBLISH_DATASET_LAMBDA,
+                InvocationType="Event",
+                Payload=shard.json(by_alias=True),
+            )
+    else:
+        run_shards_locally(shards, PUBLISH_PROCESSES)
 
 
 def lambda_handler(event: dict, _):
@@ -91,47 +96,31 @@ def lambda_handler(event: dict, _):
             session.add(published_project)
             session.commit()
 
-        # This loop could be moved to multiple parallel lambdas
+        # a job without datasets would have no worker to finish it, so
+        # the project is published on the serial path instead
+        if (PUBLISH_DATASET_LAMBDA or PUBLISH_PROCESSES) and metadata.released_datasets:
+            fan_out_datasets(metadata)
+            return True
+
         for dataset in metadata.released_datasets:
             print("Publishing Dataset", dataset.dataset_id)
             start = time.time()
 
-            with Session(engine) as session:
-                published_project = session.scalar(
-                    select(PublishedProject).where(
-                        PublishedProject.project_id == metadata.project.project_id
-                    )
+            try:
+                publish_dataset(
+                    engine,
+                    S3CLIENT,
+                    DATASETS_S3_BUCKET,
+                    metadata.project.project_id,
+                    dataset,
+                    COPY_RECORDS,
                 )
 
-                if not published_project:
-                    raise Exception("Project not found")
-
-                published_dataset = create_published_dataset(dataset=dataset)
-                published_project.datasets.append(published_dataset)
-
-                try:
-                    item_list = S3CLIENT.list_objects_v2(
-                        Bucket=DATASETS_S3_BUCKET, Prefix=f"{dataset.dataset_id}/"
-                    )["Contents"]
-
-                except ClientError as e:
-                    dataset.release_status = DatasetReleaseStatus.UNRELEASED
-                    dataset.last_updated = datetime.utcnow().isoformat() + "Z"
-                    METADATA_TABLE.put_item(Item=dataset.table_item())
-                    raise e
-
-                for item in item_list:
-                    published_dataset.records.extend(
-                        download_and_create_published_records(
-                            published_dataset=published_dataset,
-                            dataset=dataset,
-                            key=item["Key"],  # type: ignore
-                        )
-                    )
-
-                    session.commit()
-
-                print(f"Published dataset {dataset.name}", time.time() - start)
+            except ClientError as e:
+                dataset.release_status = DatasetReleaseStatus.UNRELEASED
+                dataset.last_updated = datetime.utcnow().isoformat() + "Z"
+                METADATA_TABLE.put_item(Item=dataset.table_item())
+                raise e
 
             dataset.release_status = DatasetReleaseStatus.PUBLISHED
             dataset.last_updated = datetime.utcnow().isoformat() + "Z"
@@ -142,23 +131,15 @@ def lambda_handler(event: dict, _):
         metadata.project.publish_status = ProjectPublishStatus.PUBLISHED
         METADATA_TABLE.put_item(Item=metadata.project.table_item())
 
-        distributions = CF_CLIENT.list_distributions_by_cache_policy_id(
-            CachePolicyId=CF_CACHE_POLICY_ID
-        )
-
-        cf_id = distributions.get("DistributionIdList", {}).get("Items")[0]
+        # the records are published at this point, so
+        # refresh errors are printed instead of raised
+        refresh_published_records(engine)
 
-        if cf_id:
-            invalidation = CF_CLIENT.create_invalidation(
-                DistributionId=cf_id,
-                InvalidationBatch={
-                    "Paths": {"Quantity": 1, "Items": ["/*"]},
-                    "CallerReference": f"{metadata.project.project_id}"
-                    f"_{metadata.project.last_updated}",
-                },
-            )
-
-            print(invalidation)
+        invalidate_api_cache(
+            CF_CLIENT,
+            CF_CACHE_POLICY_ID,
+            f"{metadata.project.project_id}_{metadata.project.last_updated}",
+        )
 
     except Exception as e:  # pylint: disable=broad-except
         print(e)
@@ -0,0 +1,10 @@
+from engine import get_engine
+from publish_fanout import refresh_published_records
+
+
+def lambda_handler(_, __):
+    """Rebuild the possible filters and the map tiles after published
+    records are deleted; API lambdas invoke this asynchronously so that
+    their requests don't wait for the refresh."""
+    refresh_published_records(get_engine())
+    return True
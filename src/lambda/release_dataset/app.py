@@ -1,21 +1,20 @@
 """Lambda function to check if a stored register is valid and ready to release."""
 import os
 
-import boto3
 from auth import check_auth
 from botocore.exceptions import ClientError
+from clients import lazy_client, lazy_table
 from format import format_response
 from pydantic import BaseModel, Field
 from pydantic.error_wrappers import ValidationError
 from register import Dataset, DatasetReleaseStatus
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
-S3CLIENT = boto3.client("s3")
+S3CLIENT = lazy_client("s3")
 DATASETS_S3_BUCKET = os.environ["DATASETS_S3_BUCKET"]
 
-LAMBDACLIENT = boto3.client("lambda")
+LAMBDACLIENT = lazy_client("lambda")
 RELEASE_REGISTERS_LAMBDA = os.environ["RELEASE_REGISTERS_LAMBDA"]
 
 
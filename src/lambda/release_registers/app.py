@@ -1,17 +1,151 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from time import time
+from typing import Optional
 
-import boto3
 from botocore.exceptions import ClientError
+from clients import lazy_client, lazy_table
+from columnar_register import ValidationEngine, get_release_report
+from page_format import decompress_chunks
+from page_log import get_dataset_log_prefix, get_page_version, list_page_logs, read_page
 from pydantic import BaseModel, Field, ValidationError
-from register import Dataset, DatasetReleaseStatus, Register, ReleaseReport
+from register import (
+    Dataset,
+    DatasetReleaseStatus,
+    PageReleaseReports,
+    PageSummary,
+    ReleaseReport,
+)
+from register_stream import STREAM_CHUNK_SIZE, get_streamed_release_report
+from release_pipeline import (
+    get_incremental_release_report,
+    get_page_reports_key,
+    get_page_summary_key,
+    get_valid_page_reports,
+    update_page_reports,
+)
+
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
+
+S3CLIENT = lazy_client("s3")
+DATASETS_S3_BUCKET = os.environ["DATASETS_S3_BUCKET"]
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+# Engine used to validate each page, either the
+# Record model or the columnar validation engine
+VALIDATION_ENGINE = ValidationEngine(
+    os.environ.get("VALIDATION_ENGINE", ValidationEngine.RECORD.value)
+)
 
-S3CLIENT = boto3.client("s3")
-DATASETS_S3_BUCKET = os.environ["DATASETS_S3_BUCKET"]
+# Parse each page incrementally from the S3 object body
+# instead of loading the whole page into memory at once
+STREAM_PAGES = os.environ.get("STREAM_PAGES", "false") == "true"
+
+# Number of pages to download at the same time, and number of
+# processes to validate pages in parallel; with no processes the
+# pages are validated on the download threads.
+DOWNLOAD_THREADS = int(os.environ.get("DOWNLOAD_THREADS", "4"))
+VALIDATION_PROCESSES = int(os.environ.get("VALIDATION_PROCESSES", "0"))
+
+# Cache the release report of each page, and only validate the
+# pages which have changed since the previous release
+INCREMENTAL_RELEASE = os.environ.get("INCREMENTAL_RELEASE", "true") == "true"
+
+
+def fetch_page(key: str, logs: dict[str, list[str]]) -> bytes:
+    return read_page(S3CLIENT, DATASETS_S3_BUCKET, key, logs.get(key, []))[0]
+
+
+def fetch_page_chunks(key: str, logs: dict[str, list[str]]):
+    # pages with a change log are folded in memory
+    if key in logs:
+        return [fetch_page(key, logs)]
+
+    register_response = S3CLIENT.get_object(Bucket=DATASETS_S3_BUCKET, Key=key)
+    return decompress_chunks(register_response["Body"].iter_chunks(STREAM_CHUNK_SIZE))
+
+
+def load_page_reports(dataset_id: str) -> PageReleaseReports:
+    if not INCREMENTAL_RELEASE:
+        return PageReleaseReports()
+
+    try:
+        page_reports_response = S3CLIENT.get_object(
+            Bucket=DATASETS_S3_BUCKET, Key=get_page_reports_key(dataset_id)
+        )
+        return PageReleaseReports.parse_raw(page_reports_response["Body"].read())
+
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "NoSuchKey":
+            print(e)
+    except ValidationError as e:
+        # validate every page if the cache can't be read
+        print(e)
+
+    return PageReleaseReports()
+
+
+def load_summary_report(key: str, etag: str) -> Optional[ReleaseReport]:
+    """Return the release report of the page from the summary which
+    save_records maintains, or None if the page must be validated
+    because its summary is missing or describes a different version."""
+    try:
+        page_summary_response = S3CLIENT.get_object(
+            Bucket=DATASETS_S3_BUCKET, Key=get_page_summary_key(key)
+        )
+        page_summary = PageSummary.parse_raw(page_summary_response["Body"].read())
+
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "NoSuchKey":
+            print(e)
+        return None
+    except ValidationError as e:
+        print(e)
+        return None
+
+    if page_summary.etag != etag:
+        return None
+
+    return page_summary.get_release_report()
+
+
+def load_summary_reports(
+    etags: dict[str, str], valid_reports: dict[str, ReleaseReport]
+) -> dict[str, ReleaseReport]:
+    """Load the release reports of the pages without a valid cached
+    report from their summaries, which is much cheaper than
+    downloading and validating the pages."""
+    if not INCREMENTAL_RELEASE:
+        return {}
+
+    keys = [key for key in etags if key not in valid_reports]
+    with ThreadPoolExecutor(DOWNLOAD_THREADS) as thread_pool:
+        summary_reports = thread_pool.map(
+            lambda key: load_summary_report(key, etags[key]), keys
+        )
+
+    return {
+        key: summary_report
+        for key, summary_report in zip(keys, summary_reports)
+        if summary_report is not None
+    }
+
+
+def save_page_reports(dataset_id: str, page_reports: PageReleaseReports) -> None:
+    """Cache the page reports for the next release; errors are
+    printed but not raised, because the release report is valid."""
+    if not INCREMENTAL_RELEASE:
+        return
+
+    try:
+        S3CLIENT.put_object(
+            Bucket=DATASETS_S3_BUCKET,
+            Key=get_page_reports_key(dataset_id),
+            Body=page_reports.json(by_alias=True).encode("utf-8"),
+        )
+    except ClientError as e:
+        print(e)
 
 
 class ReleaseRegistersData(BaseModel):
@@ -36,30 +170,62 @@ def lambda_handler(event, _):
     )
 
     try:
+        # pages which were only saved to their change logs don't exist yet
         item_list = S3CLIENT.list_objects_v2(
             Bucket=DATASETS_S3_BUCKET, Prefix=f"{validated.dataset_id}/"
-        )["Contents"]
+        ).get("Contents", [])
 
-        release_report = ReleaseReport()
-        # start the release report as "released" so that the merge
-        # of a successful report with the blank report will return
-        # released status.
-        release_report.release_status = DatasetReleaseStatus.RELEASED
+        etags = {item["Key"]: item["ETag"] for item in item_list}  # type: ignore
 
-        for item in item_list:
-            start = time()
-            key = item["Key"]  # type: ignore
+        # pages with change log entries are versioned by their log too,
+        # so their cached reports are only valid until the log changes
+        logs = list_page_logs(
+            S3CLIENT,
+            DATASETS_S3_BUCKET,
+            get_dataset_log_prefix(validated.dataset_id),
+        )
+        for key, log_keys in logs.items():
+            etags[key] = get_page_version(etags.get(key), log_keys)
+
+        # cached reports of the pages which haven't changed, and
+        # reports of changed pages from the summaries of their records
+        page_reports = load_page_reports(validated.dataset_id)
+        valid_reports = get_valid_page_reports(
+            etags, dataset.register_pages, page_reports
+        )
+        valid_reports.update(load_summary_reports(etags, valid_reports))
+
+        start = time()
+        if STREAM_PAGES:
+            # streamed pages are read while they are validated,
+            # so they are validated on the download threads.
+            release_report, new_reports = get_incremental_release_report(
+                etags,
+                partial(fetch_page_chunks, logs=logs),
+                partial(get_streamed_release_report, engine=VALIDATION_ENGINE),
+                valid_reports,
+                threads=DOWNLOAD_THREADS,
+            )
+        else:
+            release_report, new_reports = get_incremental_release_report(
+                etags,
+                partial(fetch_page, logs=logs),
+                partial(get_release_report, engine=VALIDATION_ENGINE),
+                valid_reports,
+                threads=DOWNLOAD_THREADS,
+                processes=VALIDATION_PROCESSES,
+            )
 
-            register_response = S3CLIENT.get_object(Bucket=DATASETS_S3_BUCKET, Key=key)
-            register_json = register_response["Body"].read().decode("UTF-8")
-            register = Register.parse_raw(register_json)
+        print(f"Validate {len(new_reports)} of {len(etags)} pages: {time() - start}")
 
-            release_report = ReleaseReport.merge(
-                release_report, register.get_release_report()
+        if new_reports or page_reports.pages.keys() != etags.keys():
+            save_page_reports(
+                validated.dataset_id,
+                update_page_reports(
+                    etags, dataset.register_pages, valid_reports, new_reports
+                ),
             )
 
-            print(f"Validate {key}: {time() - start}")
-
         # re-load the dataset to make sure this report will still be valid
         post_validation_dataset_response = METADATA_TABLE.get_item(
             Key={"pk": validated.project_id, "sk": validated.dataset_id},
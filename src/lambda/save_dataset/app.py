@@ -1,9 +1,9 @@
 import os
 from datetime import datetime
 
-import boto3
 from auth import check_auth
 from botocore.exceptions import ClientError
+from clients import lazy_table
 from engine import get_engine
 from format import format_response
 from models import PublishedDataset
@@ -12,8 +12,7 @@ from register import Dataset, DatasetReleaseStatus
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
 
 class UploadDatasetBody(BaseModel):
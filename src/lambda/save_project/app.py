@@ -3,21 +3,20 @@ import os
 import copy
 from datetime import datetime
 
-import boto3
 from botocore.exceptions import ClientError
 from pydantic import BaseModel, Extra, ValidationError
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from auth import check_auth
+from clients import lazy_table
 from engine import get_engine
 from format import format_response
 from models import PublishedProject
 from register import Project, ProjectPublishStatus
 
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
 
 class SaveProjectBody(BaseModel):
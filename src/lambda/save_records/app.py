@@ -1,17 +1,303 @@
 import json
 import os
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable
 
-import boto3
-from auth import check_auth
+from auth import check_auth, check_project_auth
 from botocore.exceptions import ClientError
+from clients import lazy_client
+from datapoint_history import (
+    archive_history,
+    compact_history,
+    get_history_archive_key,
+)
 from format import format_response
+from page_format import decode_page, decompress_page, encode_page, page_object
+from page_log import (
+    PAGE_LOG,
+    PAGE_LOG_COMPACT_ENTRIES,
+    get_log_entry_key,
+    list_page_log,
+    read_page,
+)
 from pydantic import BaseModel, Extra, Field, ValidationError
-from register import Record, Register
+from record_merge import merge_register
+from register import PageSummary, Record
+from release_pipeline import (
+    get_page_summary_key,
+    get_register_page,
+    update_page_summary,
+)
 
-S3CLIENT = boto3.client("s3")
+S3CLIENT = lazy_client("s3")
 DATASETS_S3_BUCKET = os.environ["DATASETS_S3_BUCKET"]
 
+# Number of times the page is read, merged, and conditionally written
+# before a save which keeps conflicting with other saves fails
+SAVE_ATTEMPTS = int(os.environ.get("SAVE_ATTEMPTS", "5"))
+
+# Errors of conditional writes when the object has changed,
+# or is being written by another request at the same time
+CONFLICT_ERROR_CODES = {"PreconditionFailed", "ConditionalRequestConflict"}
+
+# Number of pages saved at the same time by requests with records in many pages
+SAVE_THREADS = int(os.environ.get("SAVE_THREADS", "4"))
+
+
+def load_page_summary(key: str) -> PageSummary | None:
+    try:
+        page_summary_response = S3CLIENT.get_object(
+            Bucket=DATASETS_S3_BUCKET, Key=get_page_summary_key(key)
+        )
+        return PageSummary.parse_raw(page_summary_response["Body"].read())
+
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "NoSuchKey":
+            print(e)
+    except ValidationError as e:
+        print(e)
+
+    return None
+
+
+def save_page_summary(
+    key: str,
+    previous_etag: str | None,
+    etag: str,
+    register_dict: dict,
+    record_ids: Iterable[str],
+) -> None:
+    """Update the release reports of the saved records in the summary
+    of the page; errors are printed but not raised because the records
+    have already been saved, and release_registers validates the pages
+    which don't have a current summary."""
+    try:
+        page_summary = update_page_summary(
+            load_page_summary(key), previous_etag, register_dict, record_ids
+        )
+        page_summary.etag = etag
+
+        S3CLIENT.put_object(
+            Bucket=DATASETS_S3_BUCKET,
+            Key=get_page_summary_key(key),
+            Body=page_summary.json(by_alias=True, exclude_defaults=True).encode(
+                "utf-8"
+            ),
+        )
+    except (ClientError, ValidationError) as e:
+        print(e)
+
+
+class RecordMergeError(Exception):
+    """Raised when a saved record can't be merged into the page"""
+
+
+class SaveConflictError(Exception):
+    """Raised when an object was changed by other saves
+    on every attempt to update it"""
+
+
+def put_if_unchanged(key: str, etag: str | None, **kwargs) -> dict | None:
+    """Write the object only if it still has the ETag which was read,
+    or if it still doesn't exist if etag is None. Return the put_object
+    response, or None if the object was changed by another request."""
+    if etag is None:
+        condition = {"IfNoneMatch": "*"}
+    else:
+        condition = {"IfMatch": etag}
+
+    try:
+        return S3CLIENT.put_object(
+            Bucket=DATASETS_S3_BUCKET, Key=key, **condition, **kwargs
+        )
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in CONFLICT_ERROR_CODES:
+            print(f"Save of {key} conflicted with another save")
+            return None
+        raise
+
+
+def read_object(key: str) -> tuple[bytes | None, str | None]:
+    """Return the decompressed object and its ETag,
+    or None and None if the object doesn't exist yet."""
+    try:
+        response = S3CLIENT.get_object(Bucket=DATASETS_S3_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "NoSuchKey":
+            raise
+        return None, None
+
+    return decompress_page(response["Body"].read()), response["ETag"]
+
+
+def save_history_archive(
+    key: str, register_dict: Dict[str, dict], record_ids: Iterable[str]
+) -> None:
+    """Move the oldest versions of the datapoints of the saved records
+    to the history archive of the page; this must succeed before the
+    page is saved, so that no version is lost."""
+    archived = compact_history(register_dict, record_ids)
+    if not archived:
+        return
+
+    archive_key = get_history_archive_key(key)
+    for _ in range(SAVE_ATTEMPTS):
+        archive_json, etag = read_object(archive_key)
+        archive = json.loads(archive_json) if archive_json else {}
+
+        archive_history(archive, archived)
+
+        archive_object = page_object(json.dumps(archive).encode("utf-8"))
+        if put_if_unchanged(archive_key, etag, **archive_object):
+            return
+
+    raise SaveConflictError(archive_key)
+
+
+def get_log_entry(records: Dict[str, Record]) -> bytes:
+    """Return the saved records as json in the structure of
+    the Register model, which is how they are merged."""
+    return json.dumps(
+        {
+            "register": {
+                record_id: json.loads(record.json(by_alias=True, exclude_none=True))
+                for record_id, record in records.items()
+            }
+        }
+    ).encode("utf-8")
+
+
+def save_page(key: str, entries: list[bytes]) -> tuple[dict, str | None, str]:
+    """Merge the records of the entries into the page, and write the
+    page only if it hasn't been changed by another save since it was
+    read. If it has, the page is read and the records are merged again,
+    up to SAVE_ATTEMPTS times, so that concurrent saves to the same page
+    don't overwrite each other's records. Return the saved register,
+    the ETag of the page which was read and the ETag of the saved page."""
+    for _ in range(SAVE_ATTEMPTS):
+        previous_register_json, previous_etag = read_object(key)
+        previous = decode_page(previous_register_json or """{"register":{}}""")
+
+        # the entries are parsed again on each attempt, because
+        # the merged records share their histories with them
+        record_ids = set()
+        for entry in entries:
+            records = json.loads(entry)["register"]
+            try:
+                merge_register(previous["register"], records)
+            except ValueError as e:
+                raise RecordMergeError(e) from e
+            record_ids.update(records)
+
+        save_history_archive(key, previous["register"], record_ids)
+
+        put_response = put_if_unchanged(
+            key, previous_etag, **page_object(encode_page(previous))
+        )
+        if put_response:
+            return previous["register"], previous_etag, put_response["ETag"]
+
+    raise SaveConflictError(key)
+
+
+def compact_page_log(key: str, log_keys: list[str]) -> None:
+    """Merge the entries of the page's log into the page and delete
+    them; errors are printed but not raised because the records have
+    already been saved, and the log is compacted again by the next save."""
+    try:
+        # entries which are missing were compacted by another save
+        entries = [
+            entry for entry, _ in map(read_object, log_keys) if entry is not None
+        ]
+        register_dict, previous_etag, etag = save_page(key, entries)
+
+        S3CLIENT.delete_objects(
+            Bucket=DATASETS_S3_BUCKET,
+            Delete={"Objects": [{"Key": log_key} for log_key in log_keys]},
+        )
+
+        record_ids = set()
+        for entry in entries:
+            record_ids.update(json.loads(entry)["register"])
+        save_page_summary(key, previous_etag, etag, register_dict, record_ids)
+
+    except (ClientError, RecordMergeError, SaveConflictError) as e:
+        print(e)
+
+
+def save_log_entry(key: str, entry: bytes) -> list[str]:
+    """Append the entry to the change log of the page, and compact
+    the log when it has PAGE_LOG_COMPACT_ENTRIES entries. Return
+    the keys of the page's log after the entry was saved."""
+    S3CLIENT.put_object(
+        Bucket=DATASETS_S3_BUCKET, Key=get_log_entry_key(key), **page_object(entry)
+    )
+
+    log_keys = list_page_log(S3CLIENT, DATASETS_S3_BUCKET, key)
+    if len(log_keys) >= PAGE_LOG_COMPACT_ENTRIES:
+        compact_page_log(key, log_keys)
+        return list_page_log(S3CLIENT, DATASETS_S3_BUCKET, key)
+
+    return log_keys
+
+
+def save_records_page(key: str, records: Dict[str, Record]) -> tuple[int, Any]:
+    """Save the records of one page, and return the status code of the
+    response and the saved records, or an error message."""
+    entry = get_log_entry(records)
+
+    # With the change log, the saved records are read back from the page
+    # with its log folded into them, because a saved datapoint is merged
+    # with the versions of it which are already stored: the response has
+    # the merged histories, the same as when the page is saved. Reading
+    # the page and its entries is still needed for that, but the listed
+    # log is reused and only the saved records are decoded and merged.
+    if PAGE_LOG:
+        record_ids = set(records)
+        try:
+            log_keys = save_log_entry(key, entry)
+            page, _ = read_page(S3CLIENT, DATASETS_S3_BUCKET, key, log_keys, record_ids)
+        except ClientError as e:
+            return 500, str(e)
+
+        register_dict = decode_page(page, record_ids=record_ids)["register"]
+        return 200, {record_id: register_dict[record_id] for record_id in records}
+
+    try:
+        register_dict, previous_etag, etag = save_page(key, [entry])
+    except RecordMergeError:
+        return 400, "Record merge failed"
+    except SaveConflictError:
+        return 409, "Page was changed by other saves, try again"
+    except ClientError as e:
+        return 500, str(e)
+    except Exception as e:  # pylint: disable=broad-except
+        return 403, str(e)
+
+    save_page_summary(key, previous_etag, etag, register_dict, records)
+
+    return 200, {record_id: register_dict[record_id] for record_id in records}
+
+
+def get_page_key(dataset_id: str, record_id: str) -> str:
+    """Return the key of the page in which the record is stored"""
+    # record_id format is 'recXX|YYYYYY'
+    # where XX is a page number of any
+    # length and YYYYYY is a randomly
+    # generated string generated by
+    # nanoID (with an alphabet excluding
+    # the '|' character).
+    parts = record_id.split("|")
+
+    # Legacy (pre-pagination) record_ids
+    # do not include the '|' character,
+    # and are stored in the legacy page.
+    if len(parts) != 2:
+        return f"{dataset_id}/data.json"
+
+    page = int(parts[0].replace("rec", ""))
+    return f"{dataset_id}/data_{page}.json"
+
 
 class SaveRecordsData(BaseModel):
     """Data model for the save records request"""
@@ -26,7 +312,7 @@ class SaveRecordsData(BaseModel):
 
 def lambda_handler(event, _):
     try:
-        user = check_auth(event)
+        user = check_auth(event, cache=True)
     except ValidationError:
         return format_response(400, "Not Authorized")
 
@@ -41,90 +327,41 @@ def lambda_handler(event, _):
     except ValidationError as e:
         return format_response(400, e.json())
 
-    if validated.project_id not in user.project_ids:
+    if not check_project_auth(event, user, validated.project_id):
         return format_response(400, "Researcher does not have access to this project")
 
-    previous_register_json = """{"register":{}}"""
-
-    # check to make sure all records are in the same page
-    page: int | None = None
-    for record_id in validated.records:
-        # record_id format is 'recXX|YYYYYY'
-        # where XX is a page number of any
-        # length and YYYYYY is a randomly
-        # generated string generated by
-        # nanoID (with an alphabet excluding
-        # the '|' character).
-        parts = record_id.split("|")
-
-        # Legacy (pre-pagination) record_ids
-        # do not include the '|' character.
-
-        # simply skip legacy (pre-pagination)
-        # record_ids and leave 'page' as None
-        if len(parts) == 2:
-            record_page = int(parts[0].replace("rec", ""))
-            if page is None:
-                page = record_page
-            elif page != record_page:
-                return format_response(
-                    400, "All records in each request must be stored in the same page"
-                )
-
-    if page is None:
-        key = f"{validated.dataset_id}/data.json"
-    else:
-        key = f"{validated.dataset_id}/data_{page}.json"
-
-    # Check for previous records
-    try:
-        previous_register_json = (
-            S3CLIENT.get_object(Bucket=DATASETS_S3_BUCKET, Key=key)["Body"]
-            .read()
-            .decode("utf-8")
-        )
-
-    except ClientError as e:
-        if e.response.get("Error", {}).get("Code") == "NoSuchKey":
-            pass
-        else:
-            return format_response(500, e)
-
-    previous = json.loads(previous_register_json)
-    response_register = Register.parse_obj({"register": validated.records})
-
+    # group the records by the page in which they are stored
+    pages: dict[str, Dict[str, Record]] = {}
     for record_id, record in validated.records.items():
-        if previous["register"].get(record_id):
-            previous_record = Record(**previous["register"][record_id])
-            merge_result = Record.merge(previous_record, record)
+        key = get_page_key(validated.dataset_id, record_id)
+        pages.setdefault(key, {})[record_id] = record
 
-            if merge_result is None:
-                return format_response(400, "Record merge failed")
+    if len(pages) == 1:
+        ((key, records),) = pages.items()
+        status, body = save_records_page(key, records)
+        if status != 200:
+            return format_response(status, body)
 
-            response_register.register_data[record_id] = merge_result
-            previous["register"][record_id] = json.loads(
-                merge_result.json(by_alias=True, exclude_none=True)
-            )
+        return format_response(200, json.dumps({"register": body}), preformatted=True)
 
-        else:
-            previous["register"][record_id] = json.loads(
-                validated.records[record_id].json(by_alias=True, exclude_none=True)
-            )
+    # Records in many pages, such as records imported from a file, are
+    # saved in one request; the pages are saved concurrently, and each
+    # page is saved or fails independently of the others.
+    with ThreadPoolExecutor(max(1, min(SAVE_THREADS, len(pages)))) as executor:
+        results = list(executor.map(save_records_page, pages, pages.values()))
 
-    try:
-        # Dump the modified register to JSON
-        previous_register_json = json.dumps(previous)
-        # Create a unique key by combining the datasetID and the register hash
-        encoded_data = bytes(previous_register_json.encode("utf-8"))
-
-        # Save new register object to S3 bucket
-        S3CLIENT.put_object(Bucket=DATASETS_S3_BUCKET, Body=(encoded_data), Key=key)
-
-        return format_response(
-            200,
-            response_register.json(by_alias=True, exclude_none=True),
-            preformatted=True,
-        )
+    response: dict = {"register": {}, "pages": []}
+    for key, (status, body) in zip(pages, results):
+        page_result = {
+            "registerPage": get_register_page(key),
+            "statusCode": status,
+            "recordIDs": list(pages[key]),
+        }
+        if status == 200:
+            response["register"].update(body)
+        else:
+            page_result["message"] = body
+        response["pages"].append(page_result)
 
-    except Exception as e:  # pylint: disable=broad-except
-        return format_response(403, e)
+    all_saved = all(status == 200 for status, _ in results)
+    return format_response(200 if all_saved else 207, response)
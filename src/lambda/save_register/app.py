@@ -3,13 +3,14 @@
 import os
 from typing import Dict
 
-import boto3
 from auth import check_auth
+from clients import lazy_client
 from format import format_response
+from page_format import page_object
 from pydantic import BaseModel, Extra, Field, ValidationError
 from register import Record
 
-S3CLIENT = boto3.client("s3")
+S3CLIENT = lazy_client("s3")
 DATASETS_S3_BUCKET = os.environ["DATASETS_S3_BUCKET"]
 
 
@@ -57,7 +58,9 @@ def lambda_handler(event, _):
         key = f"{validated.dataset_id}/data.json"
 
         # Save new register object to S3 bucket
-        S3CLIENT.put_object(Bucket=DATASETS_S3_BUCKET, Body=(encoded_data), Key=key)
+        S3CLIENT.put_object(
+            Bucket=DATASETS_S3_BUCKET, Key=key, **page_object(encoded_data)
+        )
 
         return format_response(200, register_json, preformatted=True)
 
@@ -2,26 +2,29 @@ import os
 from datetime import datetime
 from typing import Union
 
-import boto3
 from auth import check_auth
 from boto3.dynamodb.conditions import Key
 from botocore.client import ClientError
+from clients import lazy_client, lazy_table
 from engine import get_engine
 from format import format_response
 from models import PublishedProject
+from publish_fanout import invoke_refresh_published_records
 from pydantic import BaseModel, Extra, Field, ValidationError
 from register import Dataset, DatasetReleaseStatus, Project, ProjectPublishStatus
 from sqlalchemy.orm import Session
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
 
-S3CLIENT = boto3.client("s3")
+S3CLIENT = lazy_client("s3")
 DATASETS_S3_BUCKET = os.environ["DATASETS_S3_BUCKET"]
 
-CF_CLIENT = boto3.client("cloudfront")
+CF_CLIENT = lazy_client("cloudfront")
 CF_CACHE_POLICY_ID = os.environ["CF_CACHE_POLICY_ID"]
 
+LAMBDACLIENT = lazy_client("lambda")
+REFRESH_PUBLISHED_RECORDS_LAMBDA = os.environ["REFRESH_PUBLISHED_RECORDS_LAMBDA"]
+
 
 class UnpublishProjectData(BaseModel):
     project_id: str = Field(alias="projectID")
@@ -63,6 +66,10 @@ def lambda_handler(event, _):
 
             session.commit()
 
+        # the possible filters and map tiles are refreshed by another
+        # lambda, so that the request doesn't wait for them
+        invoke_refresh_published_records(LAMBDACLIENT, REFRESH_PUBLISHED_RECORDS_LAMBDA)
+
     ## passing over this exception to go on to "reset"
     ## the metadata objects as well even if something is
     ## wrong with the database records
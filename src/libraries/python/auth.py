@@ -1,12 +1,22 @@
 import os
-import boto3
+import time
 from botocore.exceptions import ClientError
 from pydantic import BaseModel, Field
 
+from clients import lazy_table
 from register import User
 
-DYNAMODB = boto3.resource("dynamodb")
-METADATA_TABLE = DYNAMODB.Table(os.environ["METADATA_TABLE_NAME"])
+METADATA_TABLE = lazy_table(os.environ["METADATA_TABLE_NAME"])
+
+# Seconds for which the users read by check_auth with cache=True are
+# reused by later requests to the same container. The cache is per
+# container and is never invalidated, so users changed by other
+# functions can be this stale; check_project_auth reads the user again
+# before denying access, so projects added to a user are never denied.
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+
+USERS: dict[str, tuple[float, User]] = {}
+USER_CACHE_STATS = {"hits": 0, "misses": 0}
 
 
 class Claims(BaseModel):
@@ -25,7 +35,13 @@ class Claims(BaseModel):
     email: str
 
 
-def check_auth(lambda_event):
+def check_auth(lambda_event, cache: bool = False):
+    """Return the user who made the request, or False if the user
+    doesn't exist. With cache, a user read by an earlier request
+    within USER_CACHE_TTL seconds is returned without reading the
+    metadata table; users are always read and cached without it.
+    Users without projects are always read, because they are
+    usually about to create or be added to their first project."""
 
     claims = Claims.parse_obj(
         lambda_event.get("requestContext", {}).get("authorizer", {}).get("claims", {})
@@ -33,6 +49,14 @@ def check_auth(lambda_event):
 
     researcher_id = f"res{claims.sub}"
 
+    if cache:
+        cached = USERS.get(researcher_id)
+        if cached and cached[1].project_ids and time.monotonic() < cached[0]:
+            USER_CACHE_STATS["hits"] += 1
+            # handlers may modify the user, so the cached user is copied
+            return cached[1].copy(deep=True)
+        USER_CACHE_STATS["misses"] += 1
+
     try:
         users_response = METADATA_TABLE.get_item(
             Key={"pk": researcher_id, "sk": "_meta"}
@@ -45,4 +69,19 @@ def check_auth(lambda_event):
         return False
 
     user = User.parse_table_item(users_response["Item"])
+    USERS[researcher_id] = (time.monotonic() + USER_CACHE_TTL, user.copy(deep=True))
+    return user
+
+
+def check_project_auth(lambda_event, user: User, project_id: str):
+    """Return the user if they have access to the project, or False.
+    Projects may have been added to a cached user by another function,
+    so the user is read again before access is denied."""
+    if user.project_ids and project_id in user.project_ids:
+        return user
+
+    user = check_auth(lambda_event)
+    if not user or not user.project_ids or project_id not in user.project_ids:
+        return False
+
     return user
@@ -0,0 +1,81 @@
+"""
+Lazily created AWS clients and cached secrets.
+
+Lambdas declare their clients at module level, but creating a boto3
+client or resource takes tens of milliseconds, and many code paths of
+a lambda never use some of its clients. The objects returned here are
+proxies which create the client on first use, so the cost is only paid
+by invocations which need it, and not during the cold start.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Callable
+
+import boto3
+
+# Secrets are fetched again after this many seconds,
+# so that rotated secrets are picked up by warm lambdas
+SECRET_TTL = int(os.environ.get("SECRET_TTL", "300"))
+
+
+class Lazy:
+    """Proxy for the object returned by the factory, which
+    is called the first time an attribute is accessed."""
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        """Return the object, creating it if necessary"""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, name):
+        if name in ("_factory", "_instance", "_lock"):
+            # not initialized, e.g. while unpickling
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+
+def lazy_client(service_name: str, **kwargs) -> Any:
+    """Lazily created boto3.client(service_name, **kwargs)"""
+    return Lazy(lambda: boto3.client(service_name, **kwargs))
+
+
+def lazy_resource(service_name: str, **kwargs) -> Any:
+    """Lazily created boto3.resource(service_name, **kwargs)"""
+    return Lazy(lambda: boto3.resource(service_name, **kwargs))
+
+
+DYNAMODB = lazy_resource("dynamodb")
+
+
+def lazy_table(table_name: str) -> Any:
+    """Lazily created DynamoDB table"""
+    return Lazy(lambda: DYNAMODB.Table(table_name))
+
+
+SECRETS_MANAGER = lazy_client("secretsmanager", region_name="us-east-2")
+
+SECRETS: dict[str, tuple[float, dict]] = {}
+
+
+def get_secret(secret_id: str, ttl: float = SECRET_TTL) -> dict:
+    """Return the json secret, fetching it from Secrets Manager
+    if it hasn't been fetched in the last ttl seconds."""
+    cached = SECRETS.get(secret_id)
+    if cached and time.monotonic() < cached[0]:
+        return cached[1]
+
+    response = SECRETS_MANAGER.get_secret_value(SecretId=secret_id)
+    secret = json.loads(response["SecretString"])
+    SECRETS[secret_id] = (time.monotonic() + ttl, secret)
+    return secret
@@ -0,0 +1,581 @@
+"""
+Columnar validation engine for register pages.
+
+`Register.parse_raw` validates a page one record at a time, building
+a pydantic `Record` for every row and a `DefaultPassDatapoint` for
+every cell, and running each validator once per cell. This module
+validates the same page by first pivoting it into one column per
+field, and then applying each validation rule to a whole column.
+
+Columns in real datasets are very repetitive (the same host species,
+detection outcome, or collection date is repeated for thousands of
+rows), so each rule is evaluated once per distinct value in a column
+and the resulting report is shared by every cell with that value.
+
+The datapoint reports and the release report produced by this engine
+are identical to the ones produced by the `Record` model, so the two
+engines can be used interchangeably and compared in tests. Any record
+or datapoint which is not in the canonical stored format (for example
+a number where a string is expected) is handed to the pydantic models
+so that coercion and validation errors behave exactly the same way.
+"""
+
+import json
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from column_alias import get_ui_name
+from page_format import decode_page, is_compact_page
+from register import (
+    REQUIRED_FIELDS,
+    DatasetReleaseStatus,
+    DefaultPassDatapoint,
+    Record,
+    Register,
+    ReleaseReport,
+    Report,
+    ReportScore,
+)
+from value_alias import (
+    DEAD_OR_ALIVE_VALUES_MAP,
+    DETECTION_OUTCOME_VALUES_MAP,
+    ORGANISM_SEX_VALUES_MAP,
+)
+
+
+class ValidationEngine(str, Enum):
+    """The engine used to validate register pages."""
+
+    RECORD = "record"
+    """Validate each record using the pydantic `Record` model."""
+
+    COLUMNAR = "columnar"
+    """Validate each column using the `ColumnarRegister`."""
+
+
+# Map from the UI name used as the key in stored records to
+# the name of the field in the Record model, including "_meta"
+FIELD_NAMES_BY_ALIAS = {field.alias: name for name, field in Record.__fields__.items()}
+
+# Datapoint fields in the order the Record model declares them
+DATAPOINT_FIELDS = [name for name in Record.__fields__ if name != "meta"]
+
+# Fields which get a passing report by default
+DEFAULT_PASS_FIELDS = {
+    name
+    for name, field in Record.__fields__.items()
+    if field.type_ is DefaultPassDatapoint
+}
+
+DATAPOINT_KEYS = {"dataValue", "modifiedBy", "version", "report", "previous"}
+REPORT_KEYS = {"status", "message", "data"}
+REPORT_STATUSES = {score.value for score in ReportScore}
+
+SKIP_STATUSES = (ReportScore.FAIL, ReportScore.WARNING)
+
+READY_TO_RELEASE = Report(status=ReportScore.SUCCESS, message="Ready to release.")
+UNRECOGNIZED_COLUMN = Report(
+    status=ReportScore.FAIL, message="Column is not recognized."
+)
+
+
+class Column:
+    """One field of a register page; the value and the report
+    of every non-null datapoint in the field, and the row
+    (index into `ColumnarRegister.record_ids`) it belongs to.
+    """
+
+    __slots__ = ("rows", "values", "reports")
+
+    def __init__(self) -> None:
+        self.rows: list[int] = []
+        self.values: list[str] = []
+        self.reports: list[Optional[Report]] = []
+
+    def append(self, row: int, value: str, report: Optional[Report]):
+        self.rows.append(row)
+        self.values.append(value)
+        self.reports.append(report)
+
+
+Rule = Callable[[str], Optional[Report]]
+"""A validation rule takes the data_value of a datapoint and returns
+a report to replace the current one, or None if the value is valid."""
+
+
+def fail(message: str) -> Report:
+    return Report(status=ReportScore.FAIL, message=message)
+
+
+def check_host_species(value: str) -> Optional[Report]:
+    if value.lower() in ("homo sapiens", "homo sapien", "human"):
+        return fail("Please do not upload data on human infections to Pharos.")
+    return None
+
+
+def check_ncbi(value: str) -> Optional[Report]:
+    try:
+        if int(value) and not 0 < len(value) < 8:
+            return fail("A NCBI taxonomic identifier consists of one to seven digits.")
+    except ValueError:
+        return fail("Value must be an integer")
+    return None
+
+
+def check_float(value: str) -> Optional[Report]:
+    try:
+        float(value)
+    except ValueError:
+        return fail(
+            "Must be a number, units can be configured "
+            "in dataset settings (coming soon)."
+        )
+    return None
+
+
+def range_rule(low: float, high: float, message: str) -> Rule:
+    """Create a rule checking that a value is a number within [low, high]."""
+
+    def check_range(value: str) -> Optional[Report]:
+        try:
+            number = float(value)
+        except ValueError:
+            return fail("Value must be a number")
+        if not low <= number <= high:
+            return fail(message)
+        return None
+
+    return check_range
+
+
+def alias_rule(values_map: dict[str, Any], message: str) -> Rule:
+    """Create a rule checking that a value is one of the
+    case-insensitive keys of a value alias map."""
+
+    def check_alias(value: str) -> Optional[Report]:
+        if value.lower() not in values_map:
+            return fail(message)
+        return None
+
+    return check_alias
+
+
+# The column-wise equivalent of each validator on the Record model;
+# collection_year is validated separately because it depends on the
+# day and month columns.
+COLUMN_RULES: dict[str, Rule] = {
+    "host_species": check_host_species,
+    "host_species_ncbi_tax_id": check_ncbi,
+    "detection_target_ncbi_tax_id": check_ncbi,
+    "pathogen_ncbi_tax_id": check_ncbi,
+    "detection_outcome": alias_rule(
+        DETECTION_OUTCOME_VALUES_MAP,
+        "Detection outcome must be an unambiguous value such as "
+        "'positive', 'negative', or 'inconclusive'.",
+    ),
+    "organism_sex": alias_rule(
+        ORGANISM_SEX_VALUES_MAP,
+        "Organism sex must be an unambiguous value such as "
+        "male, female, or unknown.",
+    ),
+    "dead_or_alive": alias_rule(
+        DEAD_OR_ALIVE_VALUES_MAP,
+        "Dead or alive must be an unambiguous value such as "
+        "dead, alive, or unknown.",
+    ),
+    "latitude": range_rule(-90, 90, "Latitude must be between -90 and 90."),
+    "longitude": range_rule(-180, 180, "Longitude must be between -180 and 180."),
+    "age": check_float,
+    "mass": check_float,
+    "length": check_float,
+    "spatial_uncertainty": check_float,
+}
+
+
+def apply_rule(rule: Rule, column: Column) -> None:
+    """Apply a rule to every datapoint in the column, skipping
+    datapoints which already failed or have a warning and clearing
+    the report of empty datapoints, evaluating the rule only once
+    for each distinct value."""
+    results: dict[str, Optional[Report]] = {}
+    reports = column.reports
+
+    for index, value in enumerate(column.values):
+        report = reports[index]
+        if report is not None and report.status in SKIP_STATUSES:
+            continue
+
+        if value == "":
+            reports[index] = None
+            continue
+
+        if value not in results:
+            results[value] = rule(value)
+
+        result = results[value]
+        if result is not None:
+            reports[index] = result
+
+
+def date_report(year: str, month: str, day: str) -> Report:
+    try:
+        date = datetime(int(year), int(month), int(day))
+        return Report(
+            status=ReportScore.SUCCESS,
+            message=f"Date {date.strftime('%Y-%m-%d')} is ready to release",
+        )
+
+    except ValueError as e:
+        try:
+            return fail(f"Date {int(year)}-{int(month)}-{int(day)} is invalid, {e}.")
+        except ValueError:
+            return fail("All of day, month, and year must be numbers.")
+
+
+def apply_date_rule(day: Column, month: Column, year: Column) -> None:
+    """Validate the collection date of each row; like the Record
+    validator, the day, month, and year reports are only replaced
+    once all three parts of the date have been filled out."""
+    day_index = {row: index for index, row in enumerate(day.rows)}
+    month_index = {row: index for index, row in enumerate(month.rows)}
+    results: dict[tuple[str, str, str], Report] = {}
+
+    for year_index, row in enumerate(year.rows):
+        year_value = year.values[year_index]
+        if year_value == "":
+            year.reports[year_index] = None
+            continue
+
+        day_at = day_index.get(row)
+        month_at = month_index.get(row)
+        if (
+            day_at is None
+            or month_at is None
+            or day.values[day_at] == ""
+            or month.values[month_at] == ""
+        ):
+            continue
+
+        if len(year_value) < 4:
+            year.reports[year_index] = fail("Year must be a four-digit year")
+            continue
+
+        key = (year_value, month.values[month_at], day.values[day_at])
+        if key not in results:
+            results[key] = date_report(*key)
+
+        report = results[key]
+        day.reports[day_at] = report
+        month.reports[month_at] = report
+        year.reports[year_index] = report
+
+
+def is_canonical_report(report: Any) -> bool:
+    # pylint: disable=unidiomatic-typecheck
+    return (
+        type(report) is dict
+        and report.keys() <= REPORT_KEYS
+        and report.get("status") in REPORT_STATUSES
+        and type(report.get("message")) is str
+        and (report.get("data") is None or type(report["data"]) is dict)
+    )
+
+
+def is_canonical_datapoint(datapoint: Any) -> bool:
+    """Check that a datapoint and its entire history are stored in
+    exactly the types the Datapoint model expects, so that they can
+    be read without any coercion; this walks the history iteratively
+    instead of recursing into each previous version."""
+    # pylint: disable=unidiomatic-typecheck
+    while True:
+        if type(datapoint) is not dict or not datapoint.keys() <= DATAPOINT_KEYS:
+            return False
+
+        if (
+            type(datapoint.get("dataValue")) is not str
+            or type(datapoint.get("modifiedBy")) is not str
+        ):
+            return False
+
+        version = datapoint.get("version")
+        if type(version) is str:
+            try:
+                int(version)
+            except ValueError:
+                return False
+        elif type(version) is not int:
+            return False
+
+        report = datapoint.get("report")
+        if report is not None and not is_canonical_report(report):
+            return False
+
+        datapoint = datapoint.get("previous")
+        if datapoint is None:
+            return True
+
+
+def is_canonical_record(record_dict: Any) -> bool:
+    """Check that every datapoint in a record can be read without
+    coercion, and that the record only uses UI names for fields."""
+    # pylint: disable=unidiomatic-typecheck
+    if type(record_dict) is not dict:
+        return False
+
+    for key, value in record_dict.items():
+        name = FIELD_NAMES_BY_ALIAS.get(key)
+        if name == "meta":
+            if value is not None and not (
+                type(value) is dict and type(value.get("order")) is int
+            ):
+                return False
+        elif name is None and key in Record.__fields__:
+            return False
+        elif name is None or value is not None:
+            if not is_canonical_datapoint(value):
+                return False
+
+    return True
+
+
+class ColumnarRegister:
+    """A register page pivoted into columns.
+
+    Rows are stored in the same order as the records in the page,
+    and columns are keyed by the Record field name. Unrecognized
+    columns are kept per row, in the order the Record model would
+    put them, because they are not validated other than being
+    marked as failing.
+    """
+
+    def __init__(self) -> None:
+        self.record_ids: list[str] = []
+        self.columns: dict[str, Column] = {name: Column() for name in DATAPOINT_FIELDS}
+        self.extra_columns: list[list[tuple[str, str, Report]]] = []
+        self._report_cache: dict[tuple, Report] = {}
+
+    @classmethod
+    def parse_raw(cls, register_json: str | bytes) -> "ColumnarRegister":
+        """Parse and validate a register page from a json string."""
+        return cls.parse_obj(json.loads(register_json))
+
+    @classmethod
+    def parse_obj(cls, register_dict: Any) -> "ColumnarRegister":
+        """Parse and validate a register page from a dict
+        in the same format as the `Register` model."""
+        # pylint: disable=unidiomatic-typecheck
+        if (
+            type(register_dict) is not dict
+            or type(register_dict.get("register")) is not dict
+        ):
+            # let the Register model coerce the page or raise the error
+            register = Register.parse_obj(register_dict)
+            columnar = cls()
+            for record_id, record in register.register_data.items():
+                columnar.add_parsed_record(record_id, record)
+            columnar.validate()
+            return columnar
+
+        return cls.from_records(register_dict["register"].items())
+
+    @classmethod
+    def from_records(cls, records: Iterable[tuple[str, Any]]) -> "ColumnarRegister":
+        """Validate an iterable of (record_id, record_dict) pairs."""
+        columnar = cls()
+        for record_id, record_dict in records:
+            columnar.add_record(record_id, record_dict)
+        columnar.validate()
+        return columnar
+
+    def parse_report(self, report_dict: dict) -> Report:
+        """Parse a stored report, sharing Report objects between
+        datapoints which have the same stored report."""
+        if report_dict.get("data") is not None:
+            return Report.parse_obj(report_dict)
+
+        key = tuple(report_dict.items())
+        report = self._report_cache.get(key)
+        if report is None:
+            report = Report.parse_obj(report_dict)
+            self._report_cache[key] = report
+        return report
+
+    def add_record(self, record_id: str, record_dict: Any) -> None:
+        """Pivot one record into the columns, without validating it."""
+        if not is_canonical_record(record_dict):
+            # Anything which would need coercion or which raises a
+            # validation error is handled by the Register model, so
+            # that both engines behave the same for invalid pages.
+            register = Register.parse_obj({"register": {record_id: record_dict}})
+            self.add_parsed_record(record_id, register.register_data[record_id])
+            return
+
+        row = len(self.record_ids)
+        self.record_ids.append(record_id)
+
+        for key, datapoint in record_dict.items():
+            name = FIELD_NAMES_BY_ALIAS.get(key)
+            if name is None or name == "meta" or datapoint is None:
+                continue
+
+            value = datapoint["dataValue"]
+            report_dict = datapoint.get("report")
+            report = self.parse_report(report_dict) if report_dict else None
+
+            if report is None and name in DEFAULT_PASS_FIELDS and value != "":
+                report = READY_TO_RELEASE
+
+            self.columns[name].append(row, value, report)
+
+        # The Record model stores unrecognized columns in the order of
+        # this set difference, so it is recreated here to keep the
+        # fields in the release report in the same order.
+        names_used = {key for key in record_dict if key in FIELD_NAMES_BY_ALIAS}
+        self.extra_columns.append(
+            [
+                (key, record_dict[key]["dataValue"], UNRECOGNIZED_COLUMN)
+                for key in record_dict.keys() - names_used
+            ]
+        )
+
+    def add_parsed_record(self, record_id: str, record: Record) -> None:
+        """Pivot a record which was already parsed by the Record model."""
+        row = len(self.record_ids)
+        self.record_ids.append(record_id)
+
+        extras = []
+        for field, datapoint in record:
+            if field == "meta" or datapoint is None:
+                continue
+            if field in self.columns:
+                self.columns[field].append(row, datapoint.data_value, datapoint.report)
+            else:
+                extras.append((field, datapoint.data_value, datapoint.report))
+        self.extra_columns.append(extras)
+
+    def validate(self) -> None:
+        """Apply every validation rule to its column. Records added
+        by `add_parsed_record` were already validated by the Record
+        model, and applying the same rules again leaves their reports
+        unchanged."""
+        for name, rule in COLUMN_RULES.items():
+            apply_rule(rule, self.columns[name])
+
+        apply_date_rule(
+            self.columns["collection_day"],
+            self.columns["collection_month"],
+            self.columns["collection_year"],
+        )
+
+    def get_reports(self) -> dict[str, dict[str, Optional[Report]]]:
+        """Return the report of every datapoint, keyed by record_id
+        and then by the name of the column in the stored record."""
+        reports: dict[str, dict[str, Optional[Report]]] = {
+            record_id: {} for record_id in self.record_ids
+        }
+        for name in DATAPOINT_FIELDS:
+            alias = Record.__fields__[name].alias
+            column = self.columns[name]
+            for row, report in zip(column.rows, column.reports):
+                reports[self.record_ids[row]][alias] = report
+
+        for row, extras in enumerate(self.extra_columns):
+            for key, _, report in extras:
+                reports[self.record_ids[row]][key] = report
+
+        return reports
+
+    def iter_cells(self) -> Iterator[tuple[str, int, str, Optional[Report]]]:
+        """Iterate (field, row, data_value, report) for every datapoint,
+        with the columns in the same order as the fields of a Record."""
+        for name in DATAPOINT_FIELDS:
+            column = self.columns[name]
+            for row, value, report in zip(column.rows, column.values, column.reports):
+                yield name, row, value, report
+
+        for row, extras in enumerate(self.extra_columns):
+            for key, value, report in extras:
+                yield key, row, value, report
+
+    def get_missing_fields(self) -> list[list[str]]:
+        """Return the UI names of the required fields which are
+        missing or empty in each row."""
+        row_count = len(self.record_ids)
+        missing: list[list[str]] = [[] for _ in range(row_count)]
+
+        for field in REQUIRED_FIELDS:
+            column = self.columns[field]
+            present = [False] * row_count
+            for row, value in zip(column.rows, column.values):
+                if value != "":
+                    present[row] = True
+            ui_name = get_ui_name(field)
+            for row in range(row_count):
+                if not present[row]:
+                    missing[row].append(ui_name)
+
+        return missing
+
+    def get_release_report(self) -> ReleaseReport:
+        """Summarize the page in the same way as
+        `Register.get_release_report`, one column at a time."""
+        statuses: dict[ReportScore, list[list[str]]] = {
+            ReportScore.WARNING: [[] for _ in self.record_ids],
+            ReportScore.FAIL: [[] for _ in self.record_ids],
+        }
+        success_count = 0
+
+        for field, row, value, report in self.iter_cells():
+            if report is None or value == "":
+                continue
+            if report.status == ReportScore.SUCCESS:
+                success_count += 1
+            else:
+                statuses[report.status][row].append(get_ui_name(field))
+
+        report = ReleaseReport()
+        for attribute, field_lists in (
+            ("missing", self.get_missing_fields()),
+            ("warning", statuses[ReportScore.WARNING]),
+            ("fail", statuses[ReportScore.FAIL]),
+        ):
+            fields = {
+                self.record_ids[row]: field_list
+                for row, field_list in enumerate(field_lists)
+                if field_list
+            }
+            field_count = sum(len(field_list) for field_list in fields.values())
+            if field_count:
+                setattr(report, f"{attribute}_count", field_count)
+            # updated in place, like the dicts in Register.get_release_report
+            getattr(report, f"{attribute}_fields").update(fields)
+
+        if success_count:
+            report.success_count = success_count
+
+        if (
+            report.missing_count == 0
+            and report.fail_count == 0
+            and report.warning_count == 0
+        ):
+            report.release_status = DatasetReleaseStatus.RELEASED
+
+        return report
+
+
+def get_release_report(
+    register_json: str | bytes, engine: ValidationEngine = ValidationEngine.RECORD
+) -> ReleaseReport:
+    """Validate a register page using the selected engine
+    and return its release report."""
+    if is_compact_page(register_json):
+        register_dict = decode_page(register_json)
+        if engine == ValidationEngine.COLUMNAR:
+            return ColumnarRegister.parse_obj(register_dict).get_release_report()
+        return Register.parse_obj(register_dict).get_release_report()
+
+    if engine == ValidationEngine.COLUMNAR:
+        return ColumnarRegister.parse_raw(register_json).get_release_report()
+
+    return Register.parse_raw(register_json).get_release_report()
@@ -0,0 +1,98 @@
+"""
+Compaction of the history of the datapoints in register pages.
+
+Each datapoint stores every previous version of itself, so every edit
+makes the page larger. When a record is saved, the history of each of
+its datapoints is truncated to the newest MAX_HISTORY_VERSIONS versions
+and the older versions are moved to the history archive of the page,
+a separate object which is only read and written when a datapoint's
+history is compacted.
+
+The archive stores the archived versions of each datapoint as a list
+ordered from newest to oldest, without their previous links:
+
+    {"register": {record_id: {column: [version, ...]}}}
+"""
+
+import os
+from typing import Any, Iterable
+
+# Number of versions of each datapoint, including the current version,
+# which are kept in the page; zero keeps the whole history in the page
+MAX_HISTORY_VERSIONS = int(os.environ.get("MAX_HISTORY_VERSIONS", "0"))
+
+HISTORY_ARCHIVE_PREFIX = "history_archive"
+
+ArchivedVersions = dict[str, dict[str, list[dict[str, Any]]]]
+
+
+def get_history_archive_key(key: str) -> str:
+    return f"{HISTORY_ARCHIVE_PREFIX}/{key}"
+
+
+def truncate_history(datapoint: dict[str, Any], max_versions: int) -> list[dict]:
+    """Keep the newest max_versions versions of the datapoint, and
+    return the versions which were removed from newest to oldest."""
+    last = datapoint
+    for _ in range(max_versions - 1):
+        last = last.get("previous")
+        if not isinstance(last, dict):
+            return []
+
+    archived = []
+    version = last.pop("previous", None)
+    while isinstance(version, dict):
+        archived.append(version)
+        version = version.pop("previous", None)
+
+    return archived
+
+
+def compact_history(
+    register_dict: dict[str, Any],
+    record_ids: Iterable[str],
+    max_versions: int = MAX_HISTORY_VERSIONS,
+) -> ArchivedVersions:
+    """Truncate the history of each datapoint of the records in place,
+    and return the versions which were removed from each datapoint."""
+    archived: ArchivedVersions = {}
+    if max_versions < 1:
+        return archived
+
+    for record_id in record_ids:
+        record = register_dict[record_id]
+        if not isinstance(record, dict):
+            continue
+
+        for column, datapoint in record.items():
+            if not isinstance(datapoint, dict) or "previous" not in datapoint:
+                continue
+
+            versions = truncate_history(datapoint, max_versions)
+            if versions:
+                archived.setdefault(record_id, {})[column] = versions
+
+    return archived
+
+
+def archive_history(archive: dict[str, Any], archived: ArchivedVersions) -> None:
+    """Add the archived versions to the archive of the page. Versions
+    which were archived before, which a client which still had them
+    can add back to the page, are only archived once."""
+    archive_register = archive.setdefault("register", {})
+
+    for record_id, columns in archived.items():
+        archive_record = archive_register.setdefault(record_id, {})
+
+        for column, versions in columns.items():
+            archived_versions = {str(version["version"]) for version in versions}
+            archive_record[column] = sorted(
+                versions
+                + [
+                    version
+                    for version in archive_record.get(column, [])
+                    if str(version["version"]) not in archived_versions
+                ],
+                key=lambda version: int(version["version"]),
+                reverse=True,
+            )
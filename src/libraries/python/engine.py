@@ -1,31 +1,144 @@
 import os
-import json
-import boto3
+import threading
+import time
+from typing import Optional
 import sqlalchemy
-from sqlalchemy import URL
+from sqlalchemy import URL, Engine, event
+from sqlalchemy.pool import QueuePool
+from clients import get_secret
 
 
 DATABASE = os.environ["DATABASE"]
 
-SECRETS_MANAGER = boto3.client("secretsmanager", region_name="us-east-2")
-response = SECRETS_MANAGER.get_secret_value(SecretId="pharos-database-DBAdminSecret")
-CREDENTIALS = json.loads(response["SecretString"])
+# The credentials are read when the first connection is
+# opened rather than at import, and again for each new
+# connection once the cached secret has expired.
+DATABASE_SECRET_ID = "pharos-database-DBAdminSecret"
 
+# A lambda handles one request at a time, so each execution
+# environment only needs one connection, with a little overflow
+# for code which opens a second session while the first is open.
+POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", "1"))
+POOL_MAX_OVERFLOW = int(os.environ.get("DATABASE_POOL_MAX_OVERFLOW", "2"))
+# Connections are checked before they are used, because the
+# proxy closes connections of execution environments which have
+# been frozen between invocations, and replaced after this many
+# seconds, before the proxy's idle client timeout.
+POOL_RECYCLE = int(os.environ.get("DATABASE_POOL_RECYCLE", "600"))
 
-def get_engine():
+ENGINES: dict[str, Engine] = {}
+ENGINES_LOCK = threading.Lock()
+
+
+class PoolMetrics:
+    """Counts of the connections checked out of an engine's pool
+    and of the new connections opened for them, with the time
+    spent opening the new connections.
+
+    The pool's events are only sent once a connection has been checked
+    out, so the time spent waiting for a connection to be returned to a
+    full pool is not included in the connect time. Instead, the most
+    connections checked out at once is recorded; checkouts waited for
+    the pool if it reached POOL_SIZE + POOL_MAX_OVERFLOW."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.max_checked_out = 0
+        self.connections = 0
+        self.connect_seconds = 0.0
+        self.max_connect_seconds = 0.0
+        self.connect_start = threading.local()
+        self.engine: Optional[Engine] = None
+
+    def listen(self, engine: Engine):
+        self.engine = engine
+        event.listen(engine, "do_connect", self.on_do_connect)
+        event.listen(engine.pool, "connect", self.on_connect)
+        event.listen(engine.pool, "checkout", self.on_checkout)
+
+    def on_do_connect(self, *_):
+        self.connect_start.time = time.perf_counter()
+
+    def on_connect(self, *_):
+        seconds = time.perf_counter() - getattr(
+            self.connect_start, "time", time.perf_counter()
+        )
+        self.connections += 1
+        self.connect_seconds += seconds
+        self.max_connect_seconds = max(self.max_connect_seconds, seconds)
+        print(f"Opened database connection in {seconds:.3f}s, {self}")
+
+    def on_checkout(self, *_):
+        self.checkouts += 1
+        # the pool is replaced when the engine is disposed
+        pool = self.engine.pool if self.engine else None
+        if isinstance(pool, QueuePool):
+            self.max_checked_out = max(self.max_checked_out, pool.checkedout())
+
+    def __str__(self):
+        return (
+            f"{self.checkouts} checkouts, {self.max_checked_out} most checked out, "
+            f"{self.connections} connections, {self.connect_seconds:.3f}s connecting"
+        )
+
+
+POOL_METRICS: dict[str, PoolMetrics] = {}
+
+
+def set_credentials(_, __, ___, cparams):
+    """Set the credentials of a new connection from the database secret"""
+    credentials = get_secret(DATABASE_SECRET_ID)
+    cparams["user"] = credentials["username"]
+    cparams["password"] = credentials["password"]
+
+
+def create_engine(database: str) -> Engine:
 
     database_url = URL.create(
         drivername="postgresql+psycopg2",
         # host=CREDENTIALS["host"],
         host="pharos-database-proxy.proxy-c3ngc0ulwwgm.us-east-2.rds.amazonaws.com",
-        database=DATABASE,
-        username=CREDENTIALS["username"],
+        database=database,
         # port=CREDENTIALS["port"],
         port=5432,
-        password=CREDENTIALS["password"],
         query={"sslmode": "verify-full", "sslrootcert": "./AmazonRootCA1.pem"},
     )
 
-    engine = sqlalchemy.create_engine(database_url)
+    engine = sqlalchemy.create_engine(
+        database_url,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_pre_ping=True,
+        pool_recycle=POOL_RECYCLE,
+    )
+    event.listen(engine, "do_connect", set_credentials)
 
     return engine
+
+
+def get_engine(database: str = DATABASE) -> Engine:
+    """Return the engine of the database, creating it on first use
+    so that warm invocations of a lambda reuse its connections."""
+    engine = ENGINES.get(database)
+    if engine is not None:
+        return engine
+
+    with ENGINES_LOCK:
+        if database not in ENGINES:
+            engine = create_engine(database)
+            POOL_METRICS[database] = PoolMetrics()
+            POOL_METRICS[database].listen(engine)
+            ENGINES[database] = engine
+
+        return ENGINES[database]
+
+
+def dispose_engines_after_fork():
+    """Connections can't be shared with a forked process, so the
+    child process replaces the pools without closing the parent's
+    connections."""
+    for engine in ENGINES.values():
+        engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=dispose_engines_after_fork)
@@ -2,10 +2,17 @@ import json
 import os
 import pytest
 
-from sqlalchemy import URL, create_engine
+from sqlalchemy import URL, create_engine, select
 from sqlalchemy.orm import Session
 
-from models import PublishedProject, PublishedRecord, PublishedDataset, Researcher, Base
+from models import (
+    PossibleFiltersCache,
+    PublishedProject,
+    PublishedRecord,
+    PublishedDataset,
+    Researcher,
+    Base,
+)
 from register import (
     Dataset,
     Project,
@@ -103,6 +110,30 @@ def create_mock_register(record_count: int) -> str:
 # pylint: enable=too-many-branches
 
 
+# The records of the mock data are outside of the map,
+# so these records are published in their own dataset
+OUTCOMES = ["positive", "negative", "inconclusive", "pos"]
+MAP_REGISTER = json.dumps(
+    {
+        "register": {
+            f"rec{index}": {
+                "Host species": {"dataValue": "host1", "version": "1"},
+                "Latitude": {"dataValue": str(40 + index % 3), "version": "1"},
+                "Longitude": {"dataValue": str(-105 + index % 7), "version": "1"},
+                "Collection day": {"dataValue": "1", "version": "1"},
+                "Collection month": {"dataValue": "1", "version": "1"},
+                "Collection year": {"dataValue": "2023", "version": "1"},
+                "Detection outcome": {
+                    "dataValue": OUTCOMES[index % len(OUTCOMES)],
+                    "version": "1",
+                },
+            }
+            for index in range(100)
+        }
+    }
+)
+
+
 @pytest.fixture
 def mock_data():
     Base.metadata.create_all(ENGINE)
@@ -275,9 +306,41 @@ def mock_data():
         cleanup(session)
 
 
+@pytest.fixture
+def map_data(mock_data):  # pylint: disable=redefined-outer-name,unused-argument
+    with Session(ENGINE) as session:
+        project = session.scalar(
+            select(PublishedProject).where(PublishedProject.project_id == "project0")
+        )
+        assert project
+
+        dataset = create_published_dataset(
+            Dataset.parse_table_item(
+                {
+                    "pk": "project0",
+                    "sk": "mapSet",
+                    "name": "Map",
+                    "releaseStatus": "Released",
+                }
+            )
+        )
+        dataset.records = create_published_records(
+            register_json=MAP_REGISTER, project_id="project0", dataset_id="mapSet"
+        )
+        project.datasets.append(dataset)
+        session.commit()
+
+    yield
+
+    with Session(ENGINE) as session:
+        session.delete(session.get(PublishedDataset, "mapSet"))
+        session.commit()
+
+
 def cleanup(session):
     session.query(PublishedProject).delete()
     session.query(PublishedDataset).delete()
     session.query(PublishedRecord).delete()
     session.query(Researcher).delete()
+    session.query(PossibleFiltersCache).delete()
     session.commit()
@@ -0,0 +1,128 @@
+import os
+from typing import Optional
+
+from models import PublishedDataset, PublishedProject, PublishedRecord
+from published_records import FiltersQueryStringParameters, get_compound_filter
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+from value_alias import DetectionOutcome
+
+LAYER_NAME = "pharos-points"
+
+# Tiles with a zoom level below this are rendered as clusters
+# of points instead of individual points. The tile cache is
+# seeded by the publishing lambdas, so this must be the same
+# in every lambda which renders tiles.
+CLUSTER_ZOOM = int(os.environ.get("MAP_CLUSTER_ZOOM", "6"))
+
+# Clustered tiles are divided into a grid of this
+# many cells on each side, with one cluster per cell
+CLUSTER_GRID_SIZE = 64
+
+# Width of the web mercator projection, in meters
+WEB_MERCATOR_WIDTH = 40075016.68557849
+
+# Maximum number of points in a tile which is not clustered
+MAX_TILE_POINTS = 50000
+
+
+def get_cluster_cell_size(z: int) -> float:
+    """Return the width, in web mercator meters, of
+    the grid cells of a clustered tile at zoom level z"""
+    return WEB_MERCATOR_WIDTH / 2**z / CLUSTER_GRID_SIZE
+
+
+def select_tile_records(columns, compound_filter, tile_bounds):
+    """Select the columns of the records matching
+    the filters within the bounds of the tile"""
+    return (
+        select(*columns)
+        .select_from(PublishedRecord)
+        .join(PublishedDataset)
+        .join(PublishedProject)
+        .where(compound_filter)
+        .where(
+            func.ST_Intersects(
+                PublishedRecord.geom, func.ST_Transform(tile_bounds, 4326)
+            )
+        )
+    )
+
+
+def select_tile_features(
+    z: int,
+    x: int,
+    y: int,
+    params: Optional[FiltersQueryStringParameters] = None,
+):
+    """Select the features of a tile, which are clusters of the
+    records matching the filters if the zoom level is below the
+    CLUSTER_ZOOM, otherwise the individual records."""
+
+    (compound_filter, _) = get_compound_filter(params)
+
+    tile_bounds = func.ST_TileEnvelope(z, x, y)
+    geom = func.ST_Transform(PublishedRecord.geom, 3857)
+
+    if z < CLUSTER_ZOOM:
+        # Group the points by grid cell, placing each cluster at the
+        # centroid of its points, so that every point is counted and
+        # the size of the tile doesn't depend on the number of points.
+        # The grid is offset by half a cell so that the edges of the
+        # cells are aligned with the edges of the tiles.
+        cell_size = get_cluster_cell_size(z)
+        # pylint: disable=not-callable
+        features = select_tile_records(
+            [
+                func.ST_AsMVTGeom(func.ST_Centroid(func.ST_Collect(geom)), tile_bounds),
+                func.count().label("point_count"),
+                *[
+                    func.count()
+                    .filter(PublishedRecord.detection_outcome == outcome.value)
+                    .label(outcome.value)
+                    for outcome in DetectionOutcome
+                ],
+            ],
+            compound_filter,
+            tile_bounds,
+        ).group_by(
+            func.ST_SnapToGrid(geom, cell_size / 2, cell_size / 2, cell_size, cell_size)
+        )
+
+    else:
+        features = select_tile_records(
+            [
+                func.ST_AsMVTGeom(geom, tile_bounds),
+                PublishedRecord.pharos_id,
+                PublishedProject.name.label("project_name"),
+            ],
+            compound_filter,
+            tile_bounds,
+        ).limit(MAX_TILE_POINTS)
+
+    return features
+
+
+def get_tile(
+    session: Session,
+    z: int,
+    x: int,
+    y: int,
+    params: Optional[FiltersQueryStringParameters] = None,
+) -> bytes:
+    """Render the vector tile of the published records
+    matching the filters at the given tile coordinates."""
+
+    mvt_geom = select_tile_features(z, x, y, params).cte("mvt_geom")
+
+    query = select(
+        func.ST_AsMVT(mvt_geom.table_valued(), LAYER_NAME),
+    ).select_from(mvt_geom)
+
+    memory = session.scalar(query)
+
+    if not memory:
+        return bytes()
+
+    return bytes(memory)
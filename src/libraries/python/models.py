@@ -3,7 +3,7 @@ from typing import Optional
 
 from geoalchemy2 import WKTElement
 from geoalchemy2.types import Geometry
-from sqlalchemy import BigInteger, Column, ForeignKey, Numeric, Table
+from sqlalchemy import BigInteger, Column, ForeignKey, Index, Numeric, Table, func
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.types import String, TypeDecorator
 from value_alias import (
@@ -254,3 +254,47 @@ class PublishedRecord(Base):
         "PublishedDataset",
         back_populates="records",
     )
+
+
+# Indexes of the filters of published records; the filters match the
+# lower-case values, so the indexes are on the lower-case columns.
+# They are created with new tables; scripts/create_filter_indexes.py
+# creates them in databases whose tables were created without them.
+Index("ix_projects_lower_name", func.lower(PublishedProject.name))
+Index(
+    "ix_published_records_lower_host_species", func.lower(PublishedRecord.host_species)
+)
+Index("ix_published_records_lower_pathogen", func.lower(PublishedRecord.pathogen))
+Index(
+    "ix_published_records_lower_detection_target",
+    func.lower(PublishedRecord.detection_target),
+)
+Index("ix_published_records_detection_outcome", PublishedRecord.detection_outcome)
+
+
+class FilterOptionValue(Base):
+    """A distinct value of a filterable column in the records of a
+    published dataset. This summarizes published_records so that
+    the possible filters can be rebuilt without scanning every
+    published record."""
+
+    __tablename__ = "filter_option_values"
+
+    dataset_id: Mapped[str] = mapped_column(
+        ForeignKey("datasets.dataset_id", ondelete="CASCADE"), primary_key=True
+    )
+    filter_id: Mapped[str] = mapped_column(primary_key=True)
+    value: Mapped[str] = mapped_column(primary_key=True)
+
+
+class PossibleFiltersCache(Base):
+    """The possible filters of the published records, stored as
+    json, with a version which changes each time it is rebuilt, and
+    the total number of published records when it was rebuilt."""
+
+    __tablename__ = "possible_filters_cache"
+
+    cache_key: Mapped[str] = mapped_column(primary_key=True)
+    version: Mapped[str]
+    possible_filters: Mapped[str]
+    record_count: Mapped[Optional[int]] = mapped_column(BigInteger)
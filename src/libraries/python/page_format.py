@@ -0,0 +1,244 @@
+"""
+Storage formats of register pages.
+
+Pages were stored as the json of the Register model, which repeats
+the UI name of every column in every record, the keys of every
+datapoint and of every previous version in its history, and the
+researcherID of the user who modified each version. The compact
+format stores the same data in a columnar layout: each record is a
+flat list of indexes into a dictionary of column names alternating
+with the values of the columns, each datapoint is a list of its
+values in a fixed order, and each modifiedBy is an index into a
+table of interned strings.
+
+Every reader accepts both formats, and `decode_page` returns the
+same dict for a page in either format, so pages are converted to
+the compact format as they are saved.
+
+Pages in either format can also be stored gzip compressed, with the
+Content-Encoding of the S3 object set to gzip. Compressed pages are
+recognized by the gzip magic number, which can't start a json page,
+so uncompressed pages are still read as they are.
+"""
+
+import gzip
+import json
+import os
+import zlib
+from typing import Any, Collection, Iterable, Iterator, Optional
+
+PAGE_FORMAT_JSON = "json"
+PAGE_FORMAT_COMPACT = "compact"
+
+# Format used when pages are saved
+PAGE_FORMAT = os.environ.get("PAGE_FORMAT", PAGE_FORMAT_JSON)
+
+# Compression of the pages when they are saved, none or gzip
+PAGE_COMPRESSION = os.environ.get("PAGE_COMPRESSION", "none")
+PAGE_COMPRESSION_GZIP = "gzip"
+PAGE_COMPRESSION_LEVEL = int(os.environ.get("PAGE_COMPRESSION_LEVEL", "6"))
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+COMPACT_FORMAT_VERSION = "compact-1"
+# Compact pages are encoded with the format as their first key,
+# so that they can be recognized without parsing the whole page
+COMPACT_PREFIX = f'{{"format":"{COMPACT_FORMAT_VERSION}"'.encode("utf-8")
+
+# The order of the values in a compact datapoint list
+DATAPOINT_KEYS = ("dataValue", "modifiedBy", "version", "report", "previous")
+REQUIRED_DATAPOINT_KEYS = {"dataValue", "modifiedBy", "version"}
+
+
+def is_compact_page(page: str | bytes) -> bool:
+    if isinstance(page, str):
+        page = page[: len(COMPACT_PREFIX)].encode("utf-8")
+    return page.startswith(COMPACT_PREFIX)
+
+
+def is_datapoint(value: Any) -> bool:
+    return (
+        isinstance(value, dict)
+        and REQUIRED_DATAPOINT_KEYS <= value.keys() <= set(DATAPOINT_KEYS)
+        and isinstance(value["modifiedBy"], str)
+    )
+
+
+class PageEncoder:
+    """Builds the column dictionary and string table of a page"""
+
+    def __init__(self) -> None:
+        self.columns: dict[str, int] = {}
+        self.strings: dict[str, int] = {}
+
+    @staticmethod
+    def intern(table: dict[str, int], value: str) -> int:
+        index = table.get(value)
+        if index is None:
+            index = table[value] = len(table)
+        return index
+
+    def encode_value(self, value: Any) -> Any:
+        """Encode a datapoint and its history as nested lists. Other
+        values, such as the record's metadata or malformed datapoints,
+        are wrapped in a dict and stored as they are, so that they are
+        validated in the same way when they are read."""
+        if not is_datapoint(value):
+            return {"value": value}
+
+        values = [
+            value["dataValue"],
+            self.intern(self.strings, value["modifiedBy"]),
+            value["version"],
+            value.get("report"),
+        ]
+        if "previous" in value:
+            values.append(self.encode_value(value["previous"]))
+        elif values[-1] is None:
+            values.pop()
+
+        return values
+
+    def encode_record(self, record: Any) -> Any:
+        if not isinstance(record, dict):
+            return {"value": record}
+
+        encoded: list[Any] = []
+        for column, value in record.items():
+            encoded.append(self.intern(self.columns, column))
+            encoded.append(self.encode_value(value))
+
+        return encoded
+
+
+def decode_value(encoded: Any, strings: list[str], history: bool = True) -> Any:
+    if not isinstance(encoded, list):
+        return encoded["value"]
+
+    datapoint = {
+        "dataValue": encoded[0],
+        "modifiedBy": strings[encoded[1]],
+        "version": encoded[2],
+    }
+    if len(encoded) > 3 and encoded[3] is not None:
+        datapoint["report"] = encoded[3]
+    if history and len(encoded) > 4:
+        datapoint["previous"] = decode_value(encoded[4], strings)
+
+    return datapoint
+
+
+def decode_record(
+    encoded: Any, columns: list[str], strings: list[str], history: bool = True
+) -> Any:
+    if not isinstance(encoded, list):
+        return encoded["value"]
+
+    return {
+        columns[encoded[index]]: decode_value(encoded[index + 1], strings, history)
+        for index in range(0, len(encoded), 2)
+    }
+
+
+def encode_compact_page(register_dict: dict[str, Any]) -> bytes:
+    encoder = PageEncoder()
+    records = {
+        record_id: encoder.encode_record(record)
+        for record_id, record in register_dict["register"].items()
+    }
+    compact_dict = {
+        "format": COMPACT_FORMAT_VERSION,
+        "columns": list(encoder.columns),
+        "strings": list(encoder.strings),
+        "register": records,
+    }
+    return json.dumps(compact_dict, separators=(",", ":")).encode("utf-8")
+
+
+def encode_page(register_dict: dict[str, Any], page_format: str = PAGE_FORMAT) -> bytes:
+    """Encode a register dict, in the structure of the
+    Register model's json, in the page format."""
+    if page_format == PAGE_FORMAT_COMPACT:
+        return encode_compact_page(register_dict)
+    return json.dumps(register_dict).encode("utf-8")
+
+
+def decode_page(
+    page: str | bytes,
+    history: bool = True,
+    record_ids: Optional[Collection[str]] = None,
+) -> dict[str, Any]:
+    """Decode a page in either format into a register dict
+    in the structure of the Register model's json. Without
+    history, the previous versions of the datapoints of compact
+    pages are not decoded, for readers which only use the current
+    values; they are still included in legacy pages. If record_ids
+    are given, only those records are decoded and returned."""
+    page_dict = json.loads(page)
+    if not isinstance(page_dict, dict) or page_dict.get("format") != (
+        COMPACT_FORMAT_VERSION
+    ):
+        if record_ids is None:
+            return page_dict
+        return {
+            "register": {
+                record_id: record
+                for record_id, record in page_dict["register"].items()
+                if record_id in record_ids
+            }
+        }
+
+    columns = page_dict["columns"]
+    strings = page_dict["strings"]
+    return {
+        "register": {
+            record_id: decode_record(encoded, columns, strings, history)
+            for record_id, encoded in page_dict["register"].items()
+            if record_ids is None or record_id in record_ids
+        }
+    }
+
+
+def to_register_json(page: bytes) -> bytes:
+    """Return the page as the json of the Register model, which
+    is returned to the client, without parsing legacy pages."""
+    if not is_compact_page(page):
+        return page
+    return json.dumps(decode_page(page)).encode("utf-8")
+
+
+def page_object(page: bytes, compression: str = PAGE_COMPRESSION) -> dict[str, Any]:
+    """Return the Body and ContentEncoding arguments of
+    put_object to store the page with the compression."""
+    if compression == PAGE_COMPRESSION_GZIP:
+        return {
+            # without a timestamp, the same page always
+            # has the same compressed bytes and ETag
+            "Body": gzip.compress(page, PAGE_COMPRESSION_LEVEL, mtime=0),
+            "ContentEncoding": "gzip",
+        }
+    return {"Body": page}
+
+
+def decompress_page(page: bytes) -> bytes:
+    """Decompress a page which was stored compressed"""
+    if page.startswith(GZIP_MAGIC):
+        return gzip.decompress(page)
+    return page
+
+
+def decompress_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Decompress a page which is read as an iterable of
+    byte chunks, one chunk at a time."""
+    chunks = iter(chunks)
+    first_chunk = next(chunks, b"")
+    if not first_chunk.startswith(GZIP_MAGIC):
+        yield first_chunk
+        yield from chunks
+        return
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    yield decompressor.decompress(first_chunk)
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
@@ -0,0 +1,155 @@
+"""
+Append-only change logs of register pages.
+
+Saving records by rewriting the whole page costs the size of the page
+on every save. With PAGE_LOG, save_records instead writes the saved
+records as a small entry in the change log of the page, and every
+PAGE_LOG_COMPACT_ENTRIES entries it compacts the log, merging the
+entries into the page and deleting them.
+
+Each entry is stored in its own object, so that saves never conflict:
+
+    page_log/{page key}/{time in ns}-{random id}.json
+
+and contains the saved records in the structure of the Register
+model's json. Merging is independent of the order in which records
+are merged, so readers fold the entries into the page in the order
+they are listed, and the same entry can be merged more than once if
+compaction is interrupted before the entries are deleted.
+"""
+
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Any, Collection, Optional
+
+from botocore.exceptions import ClientError
+from page_format import decode_page, decompress_page
+from record_merge import merge_register
+
+# Save records to the change log of the page instead of rewriting it
+PAGE_LOG = os.environ.get("PAGE_LOG", "false") == "true"
+
+# Number of entries in the log of a page at which it is compacted
+PAGE_LOG_COMPACT_ENTRIES = int(os.environ.get("PAGE_LOG_COMPACT_ENTRIES", "50"))
+
+PAGE_LOG_PREFIX = "page_log"
+
+
+def get_page_log_prefix(key: str) -> str:
+    return f"{PAGE_LOG_PREFIX}/{key}/"
+
+
+def get_dataset_log_prefix(dataset_id: str) -> str:
+    return f"{PAGE_LOG_PREFIX}/{dataset_id}/"
+
+
+def get_log_entry_key(key: str) -> str:
+    return f"{get_page_log_prefix(key)}{time.time_ns():020d}-{uuid.uuid4().hex}.json"
+
+
+def get_log_page_key(log_key: str) -> str:
+    """Return the key of the page of a log entry"""
+    return log_key[len(PAGE_LOG_PREFIX) + 1 : log_key.rindex("/")]
+
+
+def list_page_logs(s3client, bucket: str, prefix: str) -> dict[str, list[str]]:
+    """Return the keys of the log entries under the prefix, which is
+    the prefix of a page or of a dataset, keyed by the key of their page"""
+    logs: dict[str, list[str]] = {}
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        response = s3client.list_objects_v2(**kwargs)
+        for item in response.get("Contents", []):
+            logs.setdefault(get_log_page_key(item["Key"]), []).append(item["Key"])
+
+        if not response.get("IsTruncated"):
+            return logs
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def list_page_log(s3client, bucket: str, key: str) -> list[str]:
+    return list_page_logs(s3client, bucket, get_page_log_prefix(key)).get(key, [])
+
+
+def get_page_version(etag: Optional[str], log_keys: list[str]) -> str:
+    """Return an identifier of the version of the page and its log,
+    which changes whenever an entry is added to the log; it is the
+    page's ETag if the log is empty, so it matches cached reports."""
+    if not log_keys:
+        return etag or ""
+
+    log_hash = hashlib.md5("\n".join(sorted(log_keys)).encode("utf-8")).hexdigest()
+    return f"{etag}+{log_hash}"
+
+
+def read_log_entry(s3client, bucket: str, log_key: str) -> dict[str, Any]:
+    try:
+        response = s3client.get_object(Bucket=bucket, Key=log_key)
+    except ClientError as e:
+        # the entry was deleted after it was compacted into the page
+        if e.response.get("Error", {}).get("Code") != "NoSuchKey":
+            raise
+        return {}
+
+    return json.loads(decompress_page(response["Body"].read()))["register"]
+
+
+def fold_page_log(
+    register_dict: dict[str, Any], entries: list[dict[str, Any]]
+) -> dict[str, Any]:
+    """Merge the records of the log entries into the register dict"""
+    for entry in entries:
+        merge_register(register_dict["register"], entry)
+    return register_dict
+
+
+def read_page(
+    s3client,
+    bucket: str,
+    key: str,
+    log_keys: Optional[list[str]] = None,
+    record_ids: Optional[Collection[str]] = None,
+) -> tuple[bytes, str]:
+    """Read the page with its log folded into it, and return it with
+    its version from `get_page_version`. Pages without log entries
+    are returned as they are stored, decompressed; pages with entries
+    are returned as the json of the Register model. If the log_keys of
+    the page are not given, the log is listed. If record_ids are given,
+    only those records are folded and returned from pages with entries."""
+    if log_keys is None:
+        log_keys = list_page_log(s3client, bucket, key)
+
+    # the entries are read before the page: entries are only deleted
+    # after the page they were compacted into is saved, so an entry
+    # which is missing is always in the page which is read after it
+    entries = [read_log_entry(s3client, bucket, log_key) for log_key in log_keys]
+
+    try:
+        page_response = s3client.get_object(Bucket=bucket, Key=key)
+        page = decompress_page(page_response["Body"].read())
+        etag = page_response["ETag"]
+    except ClientError as e:
+        # pages which were only saved to their log don't exist
+        # until the log is compacted for the first time
+        if e.response.get("Error", {}).get("Code") != "NoSuchKey" or not log_keys:
+            raise
+        page, etag = b'{"register":{}}', None
+
+    if not log_keys:
+        return page, etag
+
+    if record_ids is not None:
+        entries = [
+            {
+                record_id: entry[record_id]
+                for record_id in record_ids
+                if record_id in entry
+            }
+            for entry in entries
+        ]
+
+    folded = fold_page_log(decode_page(page, record_ids=record_ids), entries)
+    return json.dumps(folded).encode("utf-8"), get_page_version(etag, log_keys)
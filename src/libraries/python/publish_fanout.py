@@ -0,0 +1,385 @@
+"""
+Fan-out publishing of the datasets in a project.
+
+Instead of publishing every dataset in a single invocation, the
+publish_registers lambda creates a publish job item in the metadata
+table and starts one worker for each dataset. Each worker publishes
+its dataset with its own database session and records the result on
+the job item; the worker which records the last result finishes the
+job, setting the project to published only if every dataset was
+published.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+from models import PublishedProject
+from page_log import get_dataset_log_prefix, list_page_logs, read_page
+from publish_register import (
+    copy_published_records,
+    create_published_dataset,
+    create_published_records,
+)
+from published_records_metadata import (
+    refresh_possible_filters,
+    update_dataset_filter_options,
+)
+from pydantic import BaseModel, Extra, Field
+from register import Dataset, DatasetReleaseStatus, Project, ProjectPublishStatus
+from sqlalchemy import Engine, select
+from sqlalchemy.orm import Session
+from tile_cache import refresh_map_tiles
+
+# Publish jobs are stored in their own partition so that
+# they are not returned when querying a project's datasets
+PUBLISH_JOB_PK = "_publish"
+
+
+class PublishJob(BaseModel):
+    """Metadata table item which tracks the datasets
+    published by the workers of a publish job."""
+
+    project_id: str = Field(alias="projectID")
+    job_id: str = Field(alias="jobID")
+    dataset_ids: list[str] = Field(alias="datasetIDs")
+    published_dataset_ids: set[str] = Field(set(), alias="publishedDatasetIDs")
+    failed_dataset_ids: set[str] = Field(set(), alias="failedDatasetIDs")
+    finished: bool = False
+
+    class Config:
+        extra = Extra.forbid
+
+    @property
+    def complete(self) -> bool:
+        """True when every dataset has recorded a result"""
+        return len(self.published_dataset_ids) + len(self.failed_dataset_ids) >= len(
+            self.dataset_ids
+        )
+
+    def table_item(self):
+        """Return the job as a dict, with the publish job partition
+        key and the projectID as the sort key. Empty sets are left
+        out because they can't be stored in DynamoDB."""
+        job_dict = self.dict(by_alias=True)
+        job_dict["pk"] = PUBLISH_JOB_PK
+        job_dict["sk"] = job_dict.pop("projectID")
+        for key in ("publishedDatasetIDs", "failedDatasetIDs"):
+            if not job_dict[key]:
+                job_dict.pop(key)
+        return job_dict
+
+    @classmethod
+    def parse_table_item(cls, table_item):
+        """Parse the job from a MetadataTable item."""
+        table_item["projectID"] = table_item.pop("sk")
+        table_item.pop("pk")
+        return PublishJob.parse_obj(table_item)
+
+
+class PublishShard(BaseModel):
+    """Event data payload for a worker to publish one dataset."""
+
+    job_id: str = Field(alias="jobID")
+    project: Project
+    dataset: Dataset
+
+    class Config:
+        extra = Extra.forbid
+
+
+def start_publish_job(table, project: Project, datasets: list[Dataset]) -> PublishJob:
+    """Create the publish job for a project, replacing any
+    previous job so that its workers can't record results."""
+    job = PublishJob(
+        projectID=project.project_id,
+        jobID=datetime.utcnow().isoformat() + "Z",
+        datasetIDs=[dataset.dataset_id for dataset in datasets],
+    )
+    table.put_item(Item=job.table_item())
+    return job
+
+
+def get_publish_job(table, project_id: str) -> Optional[PublishJob]:
+    """Return the current publish job of the project, or None if it has none"""
+    response = table.get_item(Key={"pk": PUBLISH_JOB_PK, "sk": project_id})
+    if "Item" not in response:
+        return None
+    return PublishJob.parse_table_item(response["Item"])
+
+
+def record_shard_result(
+    table, shard: PublishShard, published: bool
+) -> Optional[PublishJob]:
+    """Add the dataset to the published or failed set of the job and
+    return the updated job, or None if the job has been replaced."""
+    attribute = "publishedDatasetIDs" if published else "failedDatasetIDs"
+
+    try:
+        response = table.update_item(
+            Key={"pk": PUBLISH_JOB_PK, "sk": shard.project.project_id},
+            UpdateExpression=f"ADD {attribute} :d",
+            ConditionExpression="jobID = :j",
+            ExpressionAttributeValues={
+                ":d": {shard.dataset.dataset_id},
+                ":j": shard.job_id,
+            },
+            ReturnValues="ALL_NEW",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return None
+        raise
+
+    return PublishJob.parse_table_item(response["Attributes"])
+
+
+def claim_finish(table, job: PublishJob) -> bool:
+    """Mark a complete job as finished, returning True only for
+    the one worker which should finish publishing the project."""
+    if not job.complete or job.finished:
+        return False
+
+    try:
+        table.update_item(
+            Key={"pk": PUBLISH_JOB_PK, "sk": job.project_id},
+            UpdateExpression="SET finished = :t",
+            ConditionExpression="jobID = :j AND finished = :f",
+            ExpressionAttributeValues={":t": True, ":f": False, ":j": job.job_id},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+
+    return True
+
+
+def publish_dataset(  # pylint: disable=too-many-arguments,too-many-locals
+    engine: Engine,
+    s3client,
+    bucket: str,
+    project_id: str,
+    dataset: Dataset,
+    copy_records: bool = False,
+) -> None:
+    """Publish every page of the dataset, committing each page. If
+    copy_records is set, records are inserted with a COPY statement
+    for each page instead of an INSERT for each record."""
+    start = time.time()
+
+    with Session(engine) as session:
+        published_project = session.scalar(
+            select(PublishedProject).where(PublishedProject.project_id == project_id)
+        )
+
+        if not published_project:
+            raise ValueError("Project not found")
+
+        published_dataset = create_published_dataset(dataset=dataset)
+        published_project.datasets.append(published_dataset)
+
+        if copy_records:
+            # the dataset row must exist before records are copied
+            session.flush()
+
+        item_list = s3client.list_objects_v2(
+            Bucket=bucket, Prefix=f"{dataset.dataset_id}/"
+        ).get("Contents", [])
+
+        # the change logs of the pages are folded into them as they are read,
+        # including pages which were only saved to their change logs
+        logs = list_page_logs(
+            s3client, bucket, get_dataset_log_prefix(dataset.dataset_id)
+        )
+        keys = [item["Key"] for item in item_list]
+        keys.extend(key for key in logs if key not in keys)
+
+        for key in keys:
+            page, _ = read_page(s3client, bucket, key, logs.get(key, []))
+            register_json = page.decode("utf-8")
+
+            if copy_records:
+                copy_published_records(
+                    session,
+                    register_json=register_json,
+                    project_id=project_id,
+                    dataset_id=dataset.dataset_id,
+                )
+            else:
+                published_dataset.records.extend(
+                    create_published_records(
+                        register_json=register_json,
+                        project_id=project_id,
+                        dataset_id=dataset.dataset_id,
+                    )
+                )
+
+            session.commit()
+
+        # summarize the filter options of the dataset
+        # for rebuilding the possible filters cache
+        update_dataset_filter_options(session, dataset.dataset_id)
+        session.commit()
+
+    print(f"Published dataset {dataset.name}", time.time() - start)
+
+
+def invalidate_api_cache(cf_client, cache_policy_id: str, caller_reference: str):
+    """Invalidate the CloudFront distribution of the public API."""
+    distributions = cf_client.list_distributions_by_cache_policy_id(
+        CachePolicyId=cache_policy_id
+    )
+
+    cf_id = distributions.get("DistributionIdList", {}).get("Items")[0]
+
+    if cf_id:
+        invalidation = cf_client.create_invalidation(
+            DistributionId=cf_id,
+            InvalidationBatch={
+                "Paths": {"Quantity": 1, "Items": ["/*"]},
+                "CallerReference": caller_reference,
+            },
+        )
+
+        print(invalidation)
+
+
+def publish_shard(  # pylint: disable=too-many-arguments
+    shard: PublishShard,
+    engine: Engine,
+    s3client,
+    bucket: str,
+    table,
+    copy_records: bool = False,
+):
+    """Publish the dataset of a shard and record the result on the
+    publish job. Returns the job if this worker should finish
+    publishing the project, otherwise None."""
+    dataset = shard.dataset
+
+    job = get_publish_job(table, shard.project.project_id)
+    if job is None or job.job_id != shard.job_id:
+        print(f"Publish job {shard.job_id} was replaced")
+        return None
+
+    # If the shard is delivered again after its result was recorded,
+    # publishing the dataset again would insert its rows a second time
+    # and record it as failed, so only the finish is claimed again.
+    if dataset.dataset_id in job.published_dataset_ids | job.failed_dataset_ids:
+        print(f"Dataset {dataset.dataset_id} was already published by this job")
+        return job if claim_finish(table, job) else None
+
+    try:
+        publish_dataset(
+            engine,
+            s3client,
+            bucket,
+            shard.project.project_id,
+            dataset,
+            copy_records,
+        )
+        dataset.release_status = DatasetReleaseStatus.PUBLISHED
+        published = True
+
+    except Exception as e:  # pylint: disable=broad-except
+        print(e)
+        dataset.release_status = DatasetReleaseStatus.UNRELEASED
+        published = False
+
+    dataset.last_updated = datetime.utcnow().isoformat() + "Z"
+    try:
+        table.put_item(Item=dataset.table_item())
+    except ClientError as e:
+        # the result must still be recorded, or the job never finishes
+        print(e)
+
+    job = record_shard_result(table, shard, published)
+    if job and claim_finish(table, job):
+        return job
+
+    return None
+
+
+def refresh_published_records(engine: Engine) -> None:
+    """Refresh the possible filters and the map tiles after records are
+    published or deleted. Errors are printed but not raised, because the
+    records have already been changed."""
+    try:
+        refresh_map_tiles(engine, refresh_possible_filters(engine))
+    except Exception as e:  # pylint: disable=broad-except
+        print(e)
+
+
+def invoke_refresh_published_records(lambda_client, function_name: str) -> None:
+    """Start refreshing the possible filters and the map tiles in the
+    refresh lambda without waiting for it, after published records are
+    deleted by an API request. Errors are printed but not raised,
+    because the records have already been deleted."""
+    try:
+        lambda_client.invoke(
+            FunctionName=function_name, InvocationType="Event", Payload=b"{}"
+        )
+    except (BotoCoreError, ClientError) as e:
+        print(e)
+
+
+def finish_publish_job(table, project: Project, job: PublishJob) -> Project:
+    """Set the project to published if every dataset was
+    published, otherwise reset it to unpublished."""
+    project.last_updated = datetime.utcnow().isoformat() + "Z"
+    if job.failed_dataset_ids:
+        project.publish_status = ProjectPublishStatus.UNPUBLISHED
+    else:
+        project.publish_status = ProjectPublishStatus.PUBLISHED
+    table.put_item(Item=project.table_item())
+    return project
+
+
+def run_shard(shard_json: str) -> bool:
+    """Run a worker with clients created from the environment, as
+    the publish_dataset lambda does. This is used by the process pool
+    which stands in for lambda when publishing locally."""
+    # pylint: disable=import-outside-toplevel
+    # engine requires the DATABASE environment variable when it is
+    # imported, which only the workers need. get_engine reuses the
+    # engine of the worker's process, whose pool is replaced after
+    # the fork, so the connections of the parent are never shared.
+    from engine import get_engine
+
+    shard = PublishShard.parse_raw(shard_json)
+    table = boto3.resource("dynamodb").Table(os.environ["METADATA_TABLE_NAME"])
+    engine = get_engine()
+
+    job = publish_shard(
+        shard,
+        engine,
+        boto3.client("s3"),
+        os.environ["DATASETS_S3_BUCKET"],
+        table,
+        os.environ.get("COPY_RECORDS", "false") == "true",
+    )
+
+    if job:
+        project = finish_publish_job(table, shard.project, job)
+        refresh_published_records(engine)
+        invalidate_api_cache(
+            boto3.client("cloudfront"),
+            os.environ["CF_CACHE_POLICY_ID"],
+            f"{project.project_id}_{project.last_updated}",
+        )
+
+    return shard.dataset.release_status == DatasetReleaseStatus.PUBLISHED
+
+
+def run_shards_locally(shards: list[PublishShard], processes: int) -> list[bool]:
+    """Run the workers of a publish job on a local process pool,
+    returning whether each dataset was published."""
+    with ProcessPoolExecutor(processes) as pool:
+        return list(
+            pool.map(run_shard, [shard.json(by_alias=True) for shard in shards])
+        )
@@ -1,12 +1,18 @@
+import io
 import json
 import time
 from datetime import date, datetime
+from enum import Enum
+from typing import Any, Iterator
 
 from column_alias import get_api_name
 from geoalchemy2 import WKTElement
 from models import PublishedDataset, PublishedProject, PublishedRecord, Researcher
+from page_format import decode_page
 from register import COMPLEX_FIELDS, Datapoint, Dataset, Project, Record, User
+from sqlalchemy.engine import Dialect
 from sqlalchemy.orm import Session
+from sqlalchemy.types import TypeDecorator
 
 
 def create_published_project(project: Project) -> PublishedProject:
@@ -82,21 +88,24 @@ def upsert_project_users(
     print("Add new researchers", time.time() - start)
 
 
-def create_published_records(
+def iter_published_record_values(
     register_json: str, project_id: str, dataset_id: str
-) -> list[PublishedRecord]:
+) -> Iterator[dict[str, Any]]:
 
-    """Transform a register json string into a list of PublishedRecord objects."""
+    """Transform a register json string into a dict of PublishedRecord
+    attribute values for each record, before the column types coerce
+    them; these are shared by the ORM and COPY publishing paths."""
 
-    register_dict = json.loads(register_json)
-    published_records = []
+    # the history of each datapoint isn't published
+    register_dict = decode_page(register_json, history=False)
 
     for record_id, record_dict in register_dict["register"].items():
 
-        # create a PublishedRecord database model with just ID columns
-        published_record = PublishedRecord()
-        published_record.pharos_id = project_id + "-" + dataset_id + "-" + record_id
-        published_record.dataset_id = dataset_id
+        # start with just the ID columns
+        values: dict[str, Any] = {
+            "pharos_id": project_id + "-" + dataset_id + "-" + record_id,
+            "dataset_id": dataset_id,
+        }
 
         # construct a blank record with no fields or validation
         record = Record.construct()
@@ -119,9 +128,9 @@ def create_published_records(
                 setattr(record, api_field, datapoint)
 
             # add simple fields directly to the
-            # PublishedRecord database model.
+            # PublishedRecord attribute values.
             else:
-                setattr(published_record, api_field, datapoint)
+                values[api_field] = datapoint
 
         # extra guard for missing fields; shouldn't
         # be able to get here without them fields
@@ -134,9 +143,8 @@ def create_published_records(
                 "Record is missing collection date, should not have passed validator"
             )
 
-        # create and add the collection_date
-        # object to the database model
-        published_record.collection_date = date(
+        # create and add the collection_date object
+        values["collection_date"] = date(
             int(record.collection_year),
             int(record.collection_month),
             int(record.collection_day),
@@ -149,11 +157,24 @@ def create_published_records(
                 "Record is missing location, should not have passed validator"
             )
 
-        # create and add the location WKT
-        # geometry string to the database model
-        published_record.geom = WKTElement(
-            f"POINT({record.longitude} {record.latitude})"
-        )
+        # create and add the location WKT geometry string
+        values["geom"] = WKTElement(f"POINT({record.longitude} {record.latitude})")
+
+        yield values
+
+
+def create_published_records(
+    register_json: str, project_id: str, dataset_id: str
+) -> list[PublishedRecord]:
+
+    """Transform a register json string into a list of PublishedRecord objects."""
+
+    published_records = []
+
+    for values in iter_published_record_values(register_json, project_id, dataset_id):
+        published_record = PublishedRecord()
+        for key, value in values.items():
+            setattr(published_record, key, value)
 
         # add the researchers to the published record
         # published_record.researchers.extend(researchers)
@@ -161,3 +182,74 @@ def create_published_records(
         published_records.append(published_record)
 
     return published_records
+
+
+# Columns of the published_records table, in the order they
+# are written to the COPY stream
+COPY_COLUMNS = list(PublishedRecord.__table__.columns)
+
+COPY_SQL = (
+    f"COPY {PublishedRecord.__tablename__} "
+    f"({', '.join(column.name for column in COPY_COLUMNS)}) "
+    "FROM STDIN WITH (FORMAT csv)"
+)
+
+
+def copy_field(value: Any) -> str:
+    """Format a value as a csv field for COPY; None is an empty
+    unquoted field, which COPY reads as NULL, and strings are always
+    quoted so that empty strings are not read as NULL."""
+    if value is None:
+        return ""
+    if isinstance(value, Enum):
+        value = value.value
+    if isinstance(value, (int, float)):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def published_record_row(values: dict[str, Any], dialect: Dialect) -> str:
+    """Convert the attribute values of a record into a line of the
+    COPY stream, coercing each value with the same column type as
+    the ORM does, and writing the geometry as EWKT."""
+    fields = []
+
+    for column in COPY_COLUMNS:
+        value = values.get(column.key)
+
+        if isinstance(value, WKTElement):
+            # the ORM binds the point without an SRID,
+            # which postgis sets to the column SRID.
+            value = f"SRID={column.type.srid};{value.data}"
+
+        elif value is not None and isinstance(column.type, TypeDecorator):
+            value = column.type.process_bind_param(value, dialect)
+
+        fields.append(copy_field(value))
+
+    return ",".join(fields) + "\n"
+
+
+def copy_published_records(
+    session: Session, register_json: str, project_id: str, dataset_id: str
+) -> int:
+
+    """Insert the records of a register json string into the
+    published_records table with a single COPY statement in the
+    session's transaction, instead of an INSERT for each record.
+    The dataset must already be flushed. Returns the number of
+    records copied."""
+
+    connection = session.connection()
+
+    buffer = io.StringIO()
+    count = 0
+    for values in iter_published_record_values(register_json, project_id, dataset_id):
+        buffer.write(published_record_row(values, connection.dialect))
+        count += 1
+
+    buffer.seek(0)
+    with connection.connection.dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(COPY_SQL, buffer)
+
+    return count
@@ -1,30 +1,101 @@
-from datetime import datetime
-from typing import Any, Dict, Optional, Tuple
+import base64
+import binascii
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Callable, Dict, Optional, Tuple
 
 from column_alias import API_NAME_TO_UI_NAME_MAP, UI_NAME_TO_API_NAME_MAP
-from models import PublishedDataset, PublishedProject, PublishedRecord, Researcher
-from published_records_metadata import sortable_fields
+from models import (
+    PublishedDataset,
+    PublishedProject,
+    PublishedRecord,
+    Researcher,
+    projects_researchers,
+)
+from published_records_metadata import get_cached_record_count, sortable_fields
 from pydantic import BaseModel, Extra, Field, validator
 from register import COMPLEX_FIELDS
-from sqlalchemy import and_, or_
-from sqlalchemy.engine import Engine
-from sqlalchemy.orm import Query, Session, selectinload
+from sqlalchemy import and_, any_, func, literal, literal_column, null, or_, select
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by
+from sqlalchemy.engine import Engine, Row
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Query, Session
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from sqlalchemy.types import String, TypeDecorator
+from value_alias import DETECTION_OUTCOME_VALUES_MAP
 
 
 class FieldDoesNotExistException(Exception):
     pass
 
 
+class CountStrategy(str, Enum):
+    """How the records matching the filters are counted"""
+
+    EXACT = "exact"
+    # Use the number of rows estimated by the query planner
+    ESTIMATE = "estimate"
+    # Don't count the matching records
+    NONE = "none"
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN statement, used to read the number of rows the query
+    planner estimates for a query without running the query"""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def any_value(values: list[str]):
+    """Bind the values as one array parameter, so that a filter has the
+    same SQL for any number of values, and queries with the same filters
+    reuse the statement which SQLAlchemy compiled for the first query"""
+    return any_(literal(values, ARRAY(String)))
+
+
+def lower_any_value(column):
+    """Return a filter function which matches the column against any of
+    the values, ignoring case; the column is compared with lower() so
+    that the filter can use the index on the lower-case column"""
+    return lambda values: func.lower(column, type_=String) == any_value(
+        [value.lower() for value in values]
+    )
+
+
+def detection_outcome_any_value(values: list[str]):
+    """Match the detection outcome against any of the values, which are
+    converted to the standardized database values; values which are not
+    allowed detection outcomes don't match any record"""
+    outcomes = [
+        DETECTION_OUTCOME_VALUES_MAP[value.lower()].value
+        for value in values
+        if value.lower() in DETECTION_OUTCOME_VALUES_MAP
+    ]
+    return PublishedRecord.detection_outcome == any_value(outcomes)
+
+
 class FiltersQueryStringParameters(BaseModel):
     # The following fields filter the set of published records. Each "filter
-    # function" will be used as a parameter to SQLAlchemy's Query.filter()
-    # method.
+    # function" is called with the value of the field, which is the list of
+    # values of a multi-value field, and the filter it returns will be used
+    # as a parameter to SQLAlchemy's Query.filter() method.
 
     pharos_id: Optional[list[str]] = Field(
-        None, filter_function=lambda value: PublishedRecord.pharos_id == value
+        None,
+        filter_function=lambda values: PublishedRecord.pharos_id == any_value(values),
     )
     project_id: Optional[list[str]] = Field(
-        None, filter_function=lambda value: PublishedProject.project_id == value
+        None,
+        filter_function=lambda values: PublishedProject.project_id == any_value(values),
     )
     dataset_id: Optional[str] = Field(
         None,
@@ -46,30 +117,30 @@ class FiltersQueryStringParameters(BaseModel):
     )
     project_name: Optional[list[str]] = Field(
         None,
-        filter_function=lambda value: PublishedRecord.dataset.has(
-            PublishedDataset.project.has(PublishedProject.name.ilike(value))
+        filter_function=lambda values: PublishedRecord.dataset.has(
+            PublishedDataset.project.has(lower_any_value(PublishedProject.name)(values))
         ),
     )
     host_species: Optional[list[str]] = Field(
         None,
-        filter_function=PublishedRecord.host_species.ilike,
+        filter_function=lower_any_value(PublishedRecord.host_species),
     )
     pathogen: Optional[list[str]] = Field(
-        None, filter_function=PublishedRecord.pathogen.ilike
+        None, filter_function=lower_any_value(PublishedRecord.pathogen)
     )
     detection_target: Optional[list[str]] = Field(
-        None, filter_function=PublishedRecord.detection_target.ilike
+        None, filter_function=lower_any_value(PublishedRecord.detection_target)
     )
     researcher_name: Optional[list[str]] = Field(
         None,
-        filter_function=lambda value: PublishedRecord.dataset.has(
+        filter_function=lambda values: PublishedRecord.dataset.has(
             PublishedDataset.project.has(
-                PublishedProject.researchers.any(Researcher.name == value)
+                PublishedProject.researchers.any(Researcher.name == any_value(values))
             )
         ),
     )
     detection_outcome: Optional[list[str]] = Field(
-        None, filter_function=PublishedRecord.detection_outcome.ilike
+        None, filter_function=detection_outcome_any_value
     )
 
     @validator("collection_start_date", "collection_end_date", pre=True, always=True)
@@ -87,10 +158,76 @@ class FiltersQueryStringParameters(BaseModel):
         extra = Extra.forbid
 
 
+class PageCursor(BaseModel):
+    """The position after the last row of a page, used to request the
+    next page without scanning the rows of the preceding pages. The
+    cursor holds the values of the sorted columns and the pharos_id
+    of the last row, and is sent to the client as an opaque string."""
+
+    sort: list[str]
+    after: list[Any]
+    row_number: int = Field(ge=0, alias="rowNumber")
+
+    class Config:
+        extra = Extra.forbid
+
+    def encode(self) -> str:
+        """Encode the cursor as a url-safe string"""
+        return base64.urlsafe_b64encode(
+            self.json(by_alias=True).encode("utf-8")
+        ).decode("ascii")
+
+    @classmethod
+    def decode(cls, cursor: str) -> "PageCursor":
+        """Decode a cursor string, raising ValueError if it is invalid"""
+        try:
+            return cls.parse_raw(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except (binascii.Error, ValueError) as exc:
+            raise ValueError("Invalid cursor") from exc
+
+
 class QueryStringParameters(FiltersQueryStringParameters):
-    page: int = Field(ge=1, alias="page")
+    # The page is ignored when a cursor is given
+    page: int = Field(1, ge=1, alias="page")
     page_size: int = Field(ge=1, le=10000, alias="pageSize")
     sort: Optional[list[str]] = Field(alias="sort")
+    cursor: Optional[PageCursor] = Field(None, alias="cursor")
+    count: CountStrategy = Field(CountStrategy.EXACT, alias="count")
+
+    @validator("cursor", pre=True)
+    def decode_cursor(cls, value):
+        """Decode the cursor from the query string"""
+        if isinstance(value, str):
+            return PageCursor.decode(value)
+        return value
+
+    @validator("cursor")
+    def validate_cursor(cls, cursor, values):
+        """Ensure that the cursor was created for the same sort order,
+        and that its values are of the types of the sorted columns"""
+        if cursor is not None:
+            sort = values.get("sort") or []
+            if cursor.sort != sort or len(cursor.after) != len(sort) + 1:
+                raise ValueError("The cursor does not match the sort order")
+
+            try:
+                sort_columns = get_sort_columns(sort)
+            except FieldDoesNotExistException as exc:
+                raise ValueError("Invalid cursor") from exc
+
+            for (column, _), value in zip(sort_columns, cursor.after):
+                if value is not None:
+                    cursor_literal(column, value)
+        return cursor
+
+
+# The filter function of each field which has one, read from the
+# fields once when the module is loaded
+FILTER_FUNCTIONS: tuple[tuple[str, Callable[[Any], Any]], ...] = tuple(
+    (fieldname, field.field_info.extra["filter_function"])
+    for fieldname, field in FiltersQueryStringParameters.__fields__.items()
+    if "filter_function" in field.field_info.extra
+)
 
 
 def get_compound_filter(
@@ -105,76 +242,86 @@ def get_compound_filter(
         return (and_(True, *[]), len([]))
 
     filters = []
-    for fieldname, field in FiltersQueryStringParameters.__fields__.items():
-        filter_function = field.field_info.extra.get("filter_function")
-        if filter_function is None:
-            continue
+    for fieldname, filter_function in FILTER_FUNCTIONS:
         # This field will be associated either with a single value or, if it's
         # a multi-value field, a list of values
         list_or_string = getattr(params, fieldname, None)
         if list_or_string:
-            if isinstance(list_or_string, list):
-                values = list_or_string
-                filters_for_field = [filter_function(value) for value in values]
-                # Suppose the query string was:
-                # "?pathogen=Influenza&pathogen=Hepatitis". Then
-                # `filters_for_field` would be equivalent to the following
-                # list:
-                #    [
-                #      PublishedRecord.pathogen.ilike('Influenza'),
-                #      PublishedRecord.pathogen.ilike('Hepatitis')]
-                #    ]
-                filters.append(or_(*filters_for_field))
-                # `or_` is used here because we want records that match at
-                # least one of the values that the user specified for this
-                # field
-            else:
-                value = list_or_string
-                filters.append(filter_function(value))
+            filters.append(filter_function(list_or_string))
     conjunction = and_(True, *filters)  # Using `True` to avoid a deprecation warning
 
     # Suppose that the query string is:
-    # "?host_species=Wolf&host_species=Bear&pathogen=Influenza&pathogen=Hepatitis".
-    # Then `conjunction` is equivalent to:
-    #    and_([
-    #      or_([
-    #          PublishedRecord.host_species.ilike('Wolf'),
-    #          PublishedRecord.host_species.ilike('Bear'),
-    #      ]),
-    #      or_([
-    #          PublishedRecord.pathogen.ilike('Influenza'),
-    #          PublishedRecord.pathogen.ilike('Hepatitis'),
-    #      ]),
-    #    ])
+    # "?host_species=Wolf&host_species=Bear&pathogen=Influenza".
+    # Then `conjunction` is equivalent to the SQL:
+    #    lower(host_species) = ANY(['wolf', 'bear'])
+    #    AND lower(pathogen) = ANY(['influenza'])
     # In plain English, this means: "The host species is Wolf or Bear, and the
-    # pathogen is Influenza or Hepatitis."
+    # pathogen is Influenza", ignoring case. The values are bound as one array
+    # for each field, so the SQL is the same for any number of values.
 
     return (conjunction, len(filters))
 
 
+# The researchers of each project, as a json list
+# ordered by name, aggregated in the database so that
+# a page of records is retrieved with a single query.
+PROJECT_RESEARCHERS = (
+    select(
+        projects_researchers.c.project_id,
+        func.json_agg(
+            aggregate_order_by(
+                func.json_build_object(
+                    "name", Researcher.name, "researcherID", Researcher.researcher_id
+                ),
+                Researcher.name,
+            )
+        ).label("researchers"),
+    )
+    .join(Researcher, Researcher.researcher_id == projects_researchers.c.researcher_id)
+    .group_by(projects_researchers.c.project_id)
+    .subquery("project_researchers")
+)
+
+# The columns selected for the response, keyed by display name.
+# Each column is labeled with its API name so that the values of
+# the sorted columns can be read from the rows for the next cursor.
+# pylint: disable=not-callable
+RESPONSE_COLUMNS = {
+    "pharosID": PublishedRecord.pharos_id,
+    "Project": PublishedProject.name.label("project_name"),
+    "Researcher": func.coalesce(
+        PROJECT_RESEARCHERS.c.researchers, literal_column("'[]'::json")
+    ).label("researcher_name"),
+    "Collection date": func.to_char(
+        PublishedRecord.collection_date, "YYYY-MM-DD"
+    ).label("collection_date"),
+    "Latitude": PublishedRecord.geom.ST_Y().label("latitude"),
+    "Longitude": PublishedRecord.geom.ST_X().label("longitude"),
+}
+for _api_name, _ui_name in API_NAME_TO_UI_NAME_MAP.items():
+    if _api_name not in COMPLEX_FIELDS and _ui_name not in RESPONSE_COLUMNS:
+        RESPONSE_COLUMNS[_ui_name] = getattr(
+            PublishedRecord, _api_name, null().label(_api_name)
+        )
+
+# The keys of each response row, in the order of the selected
+# columns with the row number inserted after the pharosID
+RESPONSE_KEYS = ("pharosID", "rowNumber", *list(RESPONSE_COLUMNS)[1:])
+
+
 def query_records(session: Session, params: QueryStringParameters) -> Tuple[Query, int]:
-    """Returns a tuple: (query, filter_count)"""
+    """Returns a tuple: (query, filter_count). The query selects the
+    columns of the response rather than the published records, so
+    rows are returned as tuples without loading any ORM objects."""
     (compound_filter, filter_count) = get_compound_filter(params)
     query = (
-        session.query(
-            PublishedRecord,
-            PublishedRecord.geom.ST_X(),
-            PublishedRecord.geom.ST_Y(),
-        )
-        .options(
-            # In the dataset table, eagerly load the id
-            selectinload(PublishedRecord.dataset).load_only(
-                PublishedDataset.dataset_id
-            ),
-            # In the project table, eagerly load the project name
-            selectinload(PublishedRecord.dataset)
-            .selectinload(PublishedDataset.project)
-            .load_only(PublishedProject.name),
-            # In the researcher table, eagerly load the researcher names
-            selectinload(PublishedRecord.dataset)
-            .selectinload(PublishedDataset.project)
-            .selectinload(PublishedProject.researchers)
-            .load_only(Researcher.name),
+        session.query(*RESPONSE_COLUMNS.values())
+        .select_from(PublishedRecord)
+        .join(PublishedRecord.dataset)
+        .join(PublishedDataset.project)
+        .outerjoin(
+            PROJECT_RESEARCHERS,
+            PROJECT_RESEARCHERS.c.project_id == PublishedProject.project_id,
         )
         .where(compound_filter)
     )
@@ -221,91 +368,202 @@ def format_response_rows(rows, offset):
     """Format the rows returned from the database to change API
     names into display names and add query-relative row numbers."""
 
-    response_rows = []
-    for row_number, row in enumerate(rows, start=1):
-        (
-            published_record,
-            longitude,
-            latitude,
-        ) = row
-
-        response_dict = {}
-
-        response_dict["pharosID"] = published_record.pharos_id
-        response_dict["rowNumber"] = row_number + offset
-
-        project = published_record.dataset.project
-
-        response_dict["Project"] = project.name
-        response_dict["Researcher"] = [
-            {
-                "name": researcher.name,
-                "researcherID": researcher.researcher_id,
-            }
-            for researcher in project.researchers
-        ]
-        response_dict["Collection date"] = published_record.collection_date.isoformat()
-        response_dict["Latitude"] = latitude
-        response_dict["Longitude"] = longitude
+    return [
+        dict(zip(RESPONSE_KEYS, (row[0], row_number, *row[1:])))
+        for row_number, row in enumerate(rows, start=offset + 1)
+    ]
 
-        for api_name, ui_name in API_NAME_TO_UI_NAME_MAP.items():
-            if api_name not in COMPLEX_FIELDS and ui_name not in response_dict:
-                response_dict[ui_name] = getattr(published_record, api_name, None)
 
-        response_rows.append(response_dict)
+def get_sort_columns(sort: Optional[list[str]]) -> list[Tuple[Any, bool]]:
+    """Return a list of (column, descending) tuples for the sort
+    parameter, ending with pharos_id as the tie-breaker."""
+    sort_columns = []
+    for field in sort or []:
+        descending = field.startswith("-")
+        if descending:
+            field = field[1:]
+        column = sortable_fields.get(UI_NAME_TO_API_NAME_MAP.get(field) or "")
+        if not column:
+            raise FieldDoesNotExistException
+        sort_columns.append((column, descending))
+
+    sort_columns.append((PublishedRecord.pharos_id, False))
+    return sort_columns
+
+
+def cursor_value(value):
+    """Convert a value of a sorted column to json"""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        # Avoid rounding the value through a float
+        return str(value)
+    return value
+
+
+def cursor_literal(column, value):
+    """Bind a cursor value with the underlying type of the column, since
+    the value was read from the database and must not be coerced again by
+    the column's type decorator. Raise ValueError if the value is not of
+    the column's type, which the values of a tampered cursor may not be."""
+    column_type = column.type
+    if isinstance(column_type, TypeDecorator):
+        column_type = column_type.impl_instance
+    python_type = column_type.python_type
+    try:
+        if python_type is date:
+            value = date.fromisoformat(value)
+        elif python_type is Decimal:
+            value = Decimal(value)
+    except (ArithmeticError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+    # bools are ints, but aren't the value of any column
+    if isinstance(value, bool) or not isinstance(value, python_type):
+        raise ValueError("Invalid cursor")
+    return literal(value, column_type)
+
+
+def get_keyset_filter(sort_columns: list[Tuple[Any, bool]], after: list[Any]):
+    """Create a filter for the rows which are sorted after the given
+    values of the sort columns. Postgres sorts nulls last in ascending
+    order and first in descending order, so the filter does too."""
+    conditions = []
+    preceding_columns_equal = []
+
+    for (column, descending), value in zip(sort_columns, after):
+        if value is None:
+            if descending:
+                conditions.append(and_(*preceding_columns_equal, column.is_not(None)))
+            # Nothing sorts after a null in ascending order
+            preceding_columns_equal.append(column.is_(None))
+            continue
 
-    return response_rows
+        bound_value = cursor_literal(column, value)
+        if descending:
+            follows = column < bound_value
+        elif column.nullable:
+            follows = or_(column > bound_value, column.is_(None))
+        else:
+            follows = column > bound_value
+        conditions.append(and_(*preceding_columns_equal, follows))
+        preceding_columns_equal.append(column == bound_value)
+
+    # Suppose the sort is "-Collection date" and the last row of the page
+    # was collected on 2023-01-01 with the pharos_id "prj-set-rec9". Then
+    # the filter is equivalent to:
+    #    or_(
+    #      PublishedRecord.collection_date < '2023-01-01',
+    #      and_(
+    #        PublishedRecord.collection_date == '2023-01-01',
+    #        PublishedRecord.pharos_id > 'prj-set-rec9',
+    #      ),
+    #    )
+    return or_(False, *conditions)
+
+
+def estimate_count(session: Session, query: Query) -> int:
+    """Return the number of rows the query planner estimates the query
+    will return, which is based on the table statistics collected by
+    ANALYZE and can be far from the actual number of rows."""
+    plan = session.execute(Explain(query.statement)).scalar_one()
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_matching_records(
+    session: Session,
+    query: Query,
+    filter_count: int,
+    record_count: int,
+    strategy: CountStrategy,
+) -> Optional[int]:
+    """Count the records matching the filters of the query"""
+    if filter_count == 0:
+        return record_count
+    if strategy == CountStrategy.EXACT:
+        return query.count()
+    if strategy == CountStrategy.ESTIMATE:
+        return estimate_count(session, query)
+    return None
+
+
+def get_next_cursor(
+    sort: Optional[list[str]],
+    sort_columns: list[Tuple[Any, bool]],
+    last_row: Row,
+    row_number: int,
+) -> PageCursor:
+    """Create the cursor for the page after the last row"""
+    return PageCursor(
+        sort=sort or [],
+        after=[
+            cursor_value(getattr(last_row, column.key)) for column, _ in sort_columns
+        ],
+        rowNumber=row_number,
+    )
 
 
 def get_published_records_response(
     engine: Engine, params: QueryStringParameters
 ) -> Dict[str, Any]:
     limit = params.page_size
-    offset = (params.page - 1) * limit
+    sort_columns = get_sort_columns(params.sort)
+
+    if params.cursor:
+        offset = params.cursor.row_number
+    else:
+        offset = (params.page - 1) * limit
 
     with Session(engine) as session:
         # Get the total number of records in the database
-        record_count = session.query(PublishedRecord).count()
+        record_count = get_cached_record_count(session)
 
         # Get records that match the filters
-        (query, _) = query_records(session, params)
+        (query, filter_count) = query_records(session, params)
 
         # Retrieve total number of matching records before limiting results to just one page
-        matching_record_count = query.count()
-
-        if params.sort:
-            for sort in params.sort:
-                order = "asc"
-                if sort.startswith("-"):
-                    order = "desc"
-                    sort = sort[1:]
-                field_to_sort = sortable_fields.get(
-                    UI_NAME_TO_API_NAME_MAP.get(sort) or ""
-                )
-                if not field_to_sort:
-                    raise FieldDoesNotExistException
-                print("field_to_sort")
-                print(field_to_sort)
-
-                if order == "desc":
-                    field_to_sort = field_to_sort.desc()
-                query = query.order_by(field_to_sort)
-
-        query = query.order_by(PublishedRecord.pharos_id)
-
-        # Limit results to just one page
-        query = query.limit(limit).offset(offset)
+        matching_record_count = count_matching_records(
+            session, query, filter_count, record_count, params.count
+        )
+
+        query = query.order_by(
+            *[
+                column.desc() if descending else column
+                for column, descending in sort_columns
+            ]
+        )
+
+        # Fetch one more row than the page size to
+        # find out if there is a page after this one
+        if params.cursor:
+            # Start after the last row of the previous page instead
+            # of scanning and discarding the rows of every page
+            query = query.where(
+                get_keyset_filter(sort_columns, params.cursor.after)
+            ).limit(limit + 1)
+        else:
+            query = query.limit(limit + 1).offset(offset)
 
         # Execute the query
         rows = query.all()
 
-    is_last_page = matching_record_count <= limit + offset
+    is_last_page = len(rows) <= limit
+    rows = rows[:limit]
 
     response_rows = format_response_rows(rows, offset)
 
+    next_cursor = None
+    if rows and not is_last_page:
+        next_cursor = get_next_cursor(
+            params.sort, sort_columns, rows[-1], offset + len(rows)
+        ).encode()
+
     return {
         "publishedRecords": response_rows,
         "isLastPage": is_last_page,
+        "nextCursor": next_cursor,
         "recordCount": record_count,
         "matchingRecordCount": matching_record_count,
     }
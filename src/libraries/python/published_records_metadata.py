@@ -1,15 +1,54 @@
-from sqlalchemy import func
+import json
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import String, exists, func, insert, literal, select
+from sqlalchemy.exc import ProgrammingError, SQLAlchemyError
 from sqlalchemy.orm import Session
-from models import PublishedProject, PublishedRecord, Researcher
+from models import (
+    FilterOptionValue,
+    PossibleFiltersCache,
+    PublishedDataset,
+    PublishedProject,
+    PublishedRecord,
+    Researcher,
+)
 from column_alias import API_NAME_TO_UI_NAME_MAP
 
+POSSIBLE_FILTERS_CACHE_KEY = "possible_filters"
+
+# Filters whose options are the distinct values of a
+# column of the published records, summarized for each
+# dataset in the filter_option_values table.
+RECORD_FILTER_COLUMNS = {
+    "host_species": PublishedRecord.host_species,
+    "detection_target": PublishedRecord.detection_target,
+    "detection_outcome": PublishedRecord.detection_outcome,
+    "pathogen": PublishedRecord.pathogen,
+}
+
+
+def query_column_options(session, _, column):
+    """Query the distinct values of a column"""
+    return session.query(column).distinct().order_by(column)
+
+
+def query_summary_options(session, filter_id, column):
+    """Query the distinct values of a column, using the summary
+    table instead of the published records where possible"""
+    if filter_id not in RECORD_FILTER_COLUMNS:
+        return query_column_options(session, filter_id, column)
+
+    return (
+        session.query(FilterOptionValue.value)
+        .where(FilterOptionValue.filter_id == filter_id)
+        .distinct()
+        .order_by(FilterOptionValue.value)
+    )
+
 
 def get_possible_filters(engine):
     with Session(engine) as session:
-        earliest_date_in_database_string = None
-        # 'Latest' as in 'furthest into the future', not as in 'most recent'
-        latest_date_in_database_string = None
-
         # pylint mistakenly rejects func.min and func.max
         # See: https://github.com/sqlalchemy/sqlalchemy/issues/9189
         # pylint: disable=not-callable
@@ -18,82 +57,223 @@ def get_possible_filters(engine):
             func.max(PublishedRecord.collection_date),
         ).first()
 
-        if earliest_and_latest_date:
-            earliest_date_in_database = earliest_and_latest_date[0]
-            latest_date_in_database = earliest_and_latest_date[1]
-            if earliest_date_in_database and latest_date_in_database:
-                earliest_date_in_database_string = earliest_date_in_database.strftime(
-                    "%Y-%m-%d"
-                )
-                latest_date_in_database_string = latest_date_in_database.strftime(
-                    "%Y-%m-%d"
+        return build_possible_filters(
+            session, earliest_and_latest_date, query_column_options
+        )
+
+
+def build_possible_filters(session, earliest_and_latest_date, options_query):
+    """Build the possible filters from the earliest and latest
+    collection dates, and a function to query the options of
+    a filter from its filter_id and column."""
+    earliest_date_in_database_string = None
+    # 'Latest' as in 'furthest into the future', not as in 'most recent'
+    latest_date_in_database_string = None
+
+    if earliest_and_latest_date:
+        earliest_date_in_database = earliest_and_latest_date[0]
+        latest_date_in_database = earliest_and_latest_date[1]
+        if earliest_date_in_database and latest_date_in_database:
+            earliest_date_in_database_string = earliest_date_in_database.strftime(
+                "%Y-%m-%d"
+            )
+            latest_date_in_database_string = latest_date_in_database.strftime(
+                "%Y-%m-%d"
+            )
+
+    possible_filters = {
+        "project_name": {
+            "model": PublishedProject,
+            "column": "name",
+        },
+        "researcher_name": {
+            "model": Researcher,
+            "column": "name",
+        },
+        "host_species": {
+            "model": PublishedRecord,
+            "column": "host_species",
+        },
+        "detection_target": {
+            "model": PublishedRecord,
+            "column": "detection_target",
+        },
+        "detection_outcome": {
+            "model": PublishedRecord,
+            "column": "detection_outcome",
+        },
+        "pathogen": {
+            "model": PublishedRecord,
+            "column": "pathogen",
+        },
+        "collection_start_date": {
+            "label": "Collection date",
+            "dataGridKey": "Collection date",
+            "type": "date",
+            "earliestDateInDatabase": earliest_date_in_database_string,
+            "latestDateInDatabase": latest_date_in_database_string,
+        },
+        "collection_end_date": {
+            "label": "Collection date",
+            "dataGridKey": "Collection date",
+            "type": "date",
+            "earliestDateInDatabase": earliest_date_in_database_string,
+            "latestDateInDatabase": latest_date_in_database_string,
+        },
+    }
+
+    for filter_id, possible_filter in possible_filters.items():
+        model = possible_filter.get("model")
+        column = possible_filter.get("column")
+        if model and column:
+            options = [
+                row[0]
+                for row in options_query(
+                    session, filter_id, getattr(model, column)
+                ).all()
+            ]
+            options = [option for option in options if option is not None]
+            possible_filter["options"] = options
+            del possible_filter["model"]
+            del possible_filter["column"]
+        # Labels and data grid keys not specified above are determined by column_alias.py
+        if "label" not in possible_filter and filter_id in API_NAME_TO_UI_NAME_MAP:
+            possible_filter["label"] = API_NAME_TO_UI_NAME_MAP[filter_id]
+        if (
+            "dataGridKey" not in possible_filter
+            and filter_id in API_NAME_TO_UI_NAME_MAP
+        ):
+            possible_filter["dataGridKey"] = API_NAME_TO_UI_NAME_MAP[filter_id]
+    return possible_filters
+
+
+def update_dataset_filter_options(session: Session, dataset_id: str) -> None:
+    """Replace the filter option values and the collection date
+    range of a published dataset from its published records."""
+    session.query(FilterOptionValue).where(
+        FilterOptionValue.dataset_id == dataset_id
+    ).delete()
+
+    for filter_id, column in RECORD_FILTER_COLUMNS.items():
+        session.execute(
+            insert(FilterOptionValue).from_select(
+                ["dataset_id", "filter_id", "value"],
+                select(
+                    literal(dataset_id, String),
+                    literal(filter_id, String),
+                    column,
                 )
+                .where(PublishedRecord.dataset_id == dataset_id)
+                .where(column.is_not(None))
+                .distinct(),
+            )
+        )
+
+    # pylint: disable=not-callable
+    earliest_date, latest_date = session.execute(
+        select(
+            func.min(PublishedRecord.collection_date),
+            func.max(PublishedRecord.collection_date),
+        ).where(PublishedRecord.dataset_id == dataset_id)
+    ).one()
 
-        possible_filters = {
-            "project_name": {
-                "model": PublishedProject,
-                "column": "name",
-            },
-            "researcher_name": {
-                "model": Researcher,
-                "column": "name",
-            },
-            "host_species": {
-                "model": PublishedRecord,
-                "column": "host_species",
-            },
-            "detection_target": {
-                "model": PublishedRecord,
-                "column": "detection_target",
-            },
-            "detection_outcome": {
-                "model": PublishedRecord,
-                "column": "detection_outcome",
-            },
-            "pathogen": {
-                "model": PublishedRecord,
-                "column": "pathogen",
-            },
-            "collection_start_date": {
-                "label": "Collection date",
-                "dataGridKey": "Collection date",
-                "type": "date",
-                "earliestDateInDatabase": earliest_date_in_database_string,
-                "latestDateInDatabase": latest_date_in_database_string,
-            },
-            "collection_end_date": {
-                "label": "Collection date",
-                "dataGridKey": "Collection date",
-                "type": "date",
-                "earliestDateInDatabase": earliest_date_in_database_string,
-                "latestDateInDatabase": latest_date_in_database_string,
-            },
+    session.query(PublishedDataset).where(
+        PublishedDataset.dataset_id == dataset_id
+    ).update(
+        {
+            PublishedDataset.earliest_date: earliest_date,
+            PublishedDataset.latest_date: latest_date,
         }
+    )
+
+
+def rebuild_possible_filters(session: Session) -> PossibleFiltersCache:
+    """Rebuild the possible filters cache from the filter option
+    values of the published datasets, first summarizing any dataset
+    which was published before the summary table existed."""
+    unsummarized_dataset_ids = session.scalars(
+        select(PublishedDataset.dataset_id).where(
+            ~exists().where(FilterOptionValue.dataset_id == PublishedDataset.dataset_id)
+        )
+    ).all()
+
+    for dataset_id in unsummarized_dataset_ids:
+        update_dataset_filter_options(session, dataset_id)
+
+    # pylint: disable=not-callable
+    earliest_and_latest_date = session.query(
+        func.min(PublishedDataset.earliest_date),
+        func.max(PublishedDataset.latest_date),
+    ).first()
+
+    possible_filters = build_possible_filters(
+        session, earliest_and_latest_date, query_summary_options
+    )
+
+    return session.merge(
+        PossibleFiltersCache(
+            cache_key=POSSIBLE_FILTERS_CACHE_KEY,
+            version=datetime.utcnow().isoformat() + "Z",
+            possible_filters=json.dumps(possible_filters),
+            record_count=session.query(PublishedRecord).count(),
+        )
+    )
+
+
+def refresh_possible_filters(engine) -> Optional[str]:
+    """Rebuild the possible filters cache after records are
+    published or deleted, returning the new version. Errors are
+    printed but not raised, because the records have already
+    been changed and the cache is rebuilt on the next change."""
+    try:
+        with Session(engine) as session:
+            version = rebuild_possible_filters(session).version
+            session.commit()
+            return version
+
+    except SQLAlchemyError as e:
+        print(e)
+        return None
+
+
+def get_cached_possible_filters(engine) -> tuple[str, str]:
+    """Return the possible filters as a json string, and the
+    version of the cache, rebuilding the cache if it is empty."""
+    with Session(engine, expire_on_commit=False) as session:
+        try:
+            cache = session.get(PossibleFiltersCache, POSSIBLE_FILTERS_CACHE_KEY)
+
+        except ProgrammingError:
+            # the cache tables are only created when projects are
+            # published, so query the published records instead
+            # of creating tables in a request; the version is empty
+            # because these filters aren't from the cache.
+            session.rollback()
+            return json.dumps(get_possible_filters(engine)), ""
+
+        if cache is None:
+            cache = rebuild_possible_filters(session)
+            session.commit()
+
+        return cache.possible_filters, cache.version
+
+
+def get_cached_record_count(session: Session) -> int:
+    """Return the total number of published records from the possible
+    filters cache, which is rebuilt whenever records are published or
+    deleted, counting the records only if the cache is empty."""
+    try:
+        cache = session.get(PossibleFiltersCache, POSSIBLE_FILTERS_CACHE_KEY)
+
+    except ProgrammingError:
+        # the cache tables don't exist until projects are published
+        session.rollback()
+        cache = None
+
+    if cache is None or cache.record_count is None:
+        return session.query(PublishedRecord).count()
 
-        for filter_id, possible_filter in possible_filters.items():
-            model = possible_filter.get("model")
-            column = possible_filter.get("column")
-            if model and column:
-                options = [
-                    getattr(record, column)
-                    for record in session.query(getattr(model, column))
-                    .distinct()
-                    .order_by(getattr(model, column))
-                    .all()
-                ]
-                options = [option for option in options if option is not None]
-                possible_filter["options"] = options
-                del possible_filter["model"]
-                del possible_filter["column"]
-            # Labels and data grid keys not specified above are determined by column_alias.py
-            if "label" not in possible_filter and filter_id in API_NAME_TO_UI_NAME_MAP:
-                possible_filter["label"] = API_NAME_TO_UI_NAME_MAP[filter_id]
-            if (
-                "dataGridKey" not in possible_filter
-                and filter_id in API_NAME_TO_UI_NAME_MAP
-            ):
-                possible_filter["dataGridKey"] = API_NAME_TO_UI_NAME_MAP[filter_id]
-        return possible_filters
+    return cache.record_count
 
 
 sortable_fields = {
@@ -0,0 +1,100 @@
+"""
+Merging of records as plain dicts.
+
+The records of a page are decoded as dicts in the structure of the
+Register model's json, so merging them as dicts avoids parsing both
+versions of every record into the Record model and serializing the
+merged record again. The merge follows `Datapoint.merge` and
+`Record.merge`, and also merges the columns which the Record model
+doesn't recognize, which are kept in the page and shown to the user.
+"""
+
+from typing import Any, Optional
+
+META_KEY = "_meta"
+
+
+def merge_datapoints(
+    left: Optional[dict[str, Any]], right: Optional[dict[str, Any]]
+) -> Optional[dict[str, Any]]:
+    """Merge two versions of the same datapoint in the same way as
+    `Datapoint.merge`: the histories are sorted from newest to oldest,
+    so they are merged in one pass, copying each version which is kept
+    and linking it to the next version, until both histories reach the
+    same version without a report; the rest of that history is shared."""
+    # the merged history is linked to the previous key of the head
+    head: dict[str, Any] = {}
+    last = head
+
+    while left is not None and right is not None:
+        left_version, right_version = int(left["version"]), int(right["version"])
+
+        if left_version == right_version:
+            # keep the datapoint which has a report
+            if left.get("report"):
+                version = left
+            elif right.get("report"):
+                version = right
+            else:
+                right = None
+                break
+            left, right = left.get("previous"), right.get("previous")
+
+        elif left_version > right_version:
+            version, left = left, left.get("previous")
+
+        else:
+            version, right = right, right.get("previous")
+
+        next_datapoint = {
+            key: value for key, value in version.items() if key != "previous"
+        }
+        last["previous"] = next_datapoint
+        last = next_datapoint
+
+    rest = left if right is None else right
+    if rest is not None:
+        last["previous"] = rest
+    return head.get("previous")
+
+
+def merge_records(
+    left: Optional[dict[str, Any]], right: Optional[dict[str, Any]]
+) -> Optional[dict[str, Any]]:
+    """Merge two versions of the same record, merging the datapoints of
+    every column in either record. The metadata of the right record is
+    kept, or of the left record if the right record has none."""
+    if right is None:
+        return left
+    if left is None:
+        return right
+
+    merged: dict[str, Any] = {}
+    # the columns are kept in the order of the left record
+    for column in [*left, *(column for column in right if column not in left)]:
+        if column == META_KEY:
+            continue
+
+        datapoint = merge_datapoints(left.get(column), right.get(column))
+        if datapoint is not None:
+            merged[column] = datapoint
+
+    meta = right.get(META_KEY, left.get(META_KEY))
+    if meta is not None:
+        merged[META_KEY] = meta
+
+    return merged
+
+
+def merge_register(register_dict: dict[str, Any], records: dict[str, Any]) -> None:
+    """Merge the records into the records of a register in place.
+    Raises ValueError if a record in the register is not a dict."""
+    for record_id, record in records.items():
+        previous_record = register_dict.get(record_id)
+
+        if previous_record:
+            if not isinstance(previous_record, dict):
+                raise ValueError(f"Record {record_id} can't be merged")
+            record = merge_records(previous_record, record)
+
+        register_dict[record_id] = record
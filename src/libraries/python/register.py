@@ -223,6 +223,74 @@ class ReleaseReport(BaseModel):
 
         return next_report
 
+    def update(self, other: "ReleaseReport") -> None:
+        """Merge another report into this report in place, with the
+        same result as `ReleaseReport.merge(self, other)` but without
+        copying the field dicts, for folding many reports together."""
+        if not (
+            self.release_status == DatasetReleaseStatus.RELEASED
+            and other.release_status == DatasetReleaseStatus.RELEASED
+        ):
+            self.release_status = DatasetReleaseStatus.UNRELEASED
+
+        self.success_count += other.success_count
+        self.warning_count += other.warning_count
+        self.fail_count += other.fail_count
+        self.missing_count += other.missing_count
+
+        self.warning_fields.update(other.warning_fields)
+        self.fail_fields.update(other.fail_fields)
+        self.missing_fields.update(other.missing_fields)
+
+
+class PageReleaseReport(BaseModel):
+    """The release report of one page of a dataset, cached with
+    the version of the page which was validated so that the page
+    is only validated again after it changes."""
+
+    last_updated: Optional[str] = Field(None, alias="lastUpdated")
+    """The lastUpdated timestamp of the page in the dataset's
+    registerPages when the page was validated."""
+
+    etag: str
+    """The ETag of the page object which was validated."""
+
+    release_report: ReleaseReport = Field(alias="releaseReport")
+
+
+class PageReleaseReports(BaseModel):
+    """The cached release reports of the pages of a dataset,
+    keyed by the S3 key of each page."""
+
+    pages: Dict[str, PageReleaseReport] = {}
+
+
+class PageSummary(BaseModel):
+    """The release report of each record of a register page,
+    updated by save_records as records are saved so that the
+    release report of the page can be computed without parsing
+    the page."""
+
+    etag: Optional[str]
+    """The ETag of the page object which the summary describes."""
+
+    records: Dict[str, ReleaseReport] = {}
+
+    versions: Dict[str, int] = {}
+    """The newest datapoint version of each record, so that
+    load_records can find the records which changed since
+    a version without parsing the page."""
+
+    def get_release_report(self) -> ReleaseReport:
+        """Merge the reports of the records, with the same result
+        as `Register.get_release_report` on the whole page."""
+        report = ReleaseReport()
+        report.release_status = DatasetReleaseStatus.RELEASED
+        for record_report in self.records.values():
+            report.update(record_report)
+
+        return report
+
 
 class Dataset(BaseModel):
     """The dataset object which contains
@@ -395,35 +463,50 @@ class Datapoint(BaseModel):
     @classmethod
     def merge(cls, left: "Datapoint | None", right: "Datapoint | None"):
         """Given two versions of the same datapoint with differing histories,
-        return a merged single datapoint with one chronological history."""
-        if left is None:
-            return right
-        if right is None:
-            return left
-
-        # If version is a perfect match, keep
-        # the datapoint which has a report
-        if left.version == right.version:
-            if left.report:
-                next_datapoint = left.copy()
-                next_datapoint.previous = Datapoint.merge(left.previous, right.previous)
-                return next_datapoint
-            if right.report:
-                next_datapoint = right.copy()
-                next_datapoint.previous = Datapoint.merge(left.previous, right.previous)
-                return next_datapoint
-            # if there is no report to preserve, they are considered
-            # identical so it doesn't matter which we keep.
-            return left
-
-        if left.version > right.version:
-            next_datapoint = left.copy()
-            next_datapoint.previous = Datapoint.merge(left.previous, right)
-            return next_datapoint
-
-        next_datapoint = right.copy()
-        next_datapoint.previous = Datapoint.merge(left, right.previous)
-        return next_datapoint
+        return a merged single datapoint with one chronological history.
+
+        The histories are sorted from newest to oldest, so they are merged
+        in one pass like two sorted lists, copying each version which is
+        kept and linking it to the next version; this doesn't recurse, so
+        the length of the history is not limited by the recursion limit."""
+        merged: Optional[Datapoint] = None
+        last: Optional[Datapoint] = None
+
+        while left is not None and right is not None:
+            # If version is a perfect match, keep
+            # the datapoint which has a report
+            if left.version == right.version:
+                if left.report:
+                    version = left
+                elif right.report:
+                    version = right
+                else:
+                    # if there is no report to preserve, they are considered
+                    # identical so it doesn't matter which we keep.
+                    right = None
+                    break
+                left, right = left.previous, right.previous
+
+            elif left.version > right.version:
+                version, left = left, left.previous
+
+            else:
+                version, right = right, right.previous
+
+            next_datapoint = version.copy()
+            if last is None:
+                merged = next_datapoint
+            else:
+                last.previous = next_datapoint
+            last = next_datapoint
+
+        # the rest of the remaining history is kept as it is
+        rest = left if right is None else right
+        if last is None:
+            return rest
+
+        last.previous = rest
+        return merged
 
     class Config:
         extra = Extra.forbid
@@ -745,13 +828,17 @@ class Record(BaseModel):
     @classmethod
     def merge(cls, left: "Record | None", right: "Record | None"):
         """Given two versions of the same record, iterate all fields and
-        merge all datapoints in both records. If both are None return None"""
+        merge all datapoints in both records, including the columns which
+        are not recognized. The metadata of the right record is kept, or of
+        the left record if the right record has none. If both are None
+        return None"""
         if right is None:
             return left
         if left is None:
             return right
 
         next_record = Record()
+        next_record.meta = right.meta if right.meta is not None else left.meta
 
         for field in cls.__fields__:
             if field != "meta":
@@ -761,6 +848,12 @@ class Record(BaseModel):
                     Datapoint.merge(getattr(left, field), getattr(right, field)),
                 )
 
+        extra_fields = (set(left.__dict__) | set(right.__dict__)) - set(cls.__fields__)
+        for key in sorted(extra_fields):
+            next_record.__dict__[key] = Datapoint.merge(
+                left.__dict__.get(key), right.__dict__.get(key)
+            )
+
         return next_record
 
 
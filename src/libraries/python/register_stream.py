@@ -0,0 +1,209 @@
+"""
+Streaming parser for register pages.
+
+Loading a page with `Register.parse_raw` holds the raw bytes, the
+decoded string, the parsed dict, and the validated models of every
+record in memory at the same time. This module reads a page from an
+iterable of byte chunks (such as the body of an S3 object) and yields
+the records one at a time, so that each record can be validated and
+summarized in a release report and then discarded; memory use stays
+bounded by the chunk size and the largest record, regardless of the
+size of the page.
+"""
+
+import codecs
+import json
+from itertools import chain, islice
+from typing import Any, Iterable, Iterator
+
+from columnar_register import ColumnarRegister, ValidationEngine, get_release_report
+from page_format import COMPACT_PREFIX, is_compact_page
+from pydantic import ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from pydantic.errors import MissingError
+from pydantic.utils import ROOT_KEY
+from register import DatasetReleaseStatus, Register, ReleaseReport
+
+# Size of the chunks to read from the S3 object body
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Number of records to validate together; the columnar
+# engine is faster when it can validate more rows at once
+STREAM_BATCH_SIZE = 1000
+
+WHITESPACE = " \t\n\r"
+
+DECODER = json.JSONDecoder()
+
+
+class RegisterStream:
+    """Incrementally parse the records out of a register page
+    which is read as an iterable of utf-8 encoded byte chunks.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _read(self) -> bool:
+        """Add the next chunk to the buffer, discarding the part of
+        the buffer which was already parsed. Return False if there
+        are no more chunks to read."""
+        if self._eof:
+            return False
+
+        self._buffer = self._buffer[self._pos :]
+        self._pos = 0
+
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._buffer += self._decoder.decode(b"", final=True)
+            self._eof = True
+            return False
+
+        self._buffer += self._decoder.decode(chunk)
+        return True
+
+    def _skip_whitespace(self) -> None:
+        while True:
+            while (
+                self._pos < len(self._buffer) and self._buffer[self._pos] in WHITESPACE
+            ):
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._read():
+                return
+
+    def _peek(self) -> str:
+        self._skip_whitespace()
+        if self._pos >= len(self._buffer):
+            raise json.JSONDecodeError(
+                "Unexpected end of register", self._buffer, self._pos
+            )
+        return self._buffer[self._pos]
+
+    def _expect(self, characters: str) -> str:
+        character = self._peek()
+        if character not in characters:
+            raise json.JSONDecodeError(
+                f"Expecting one of {characters!r}", self._buffer, self._pos
+            )
+        self._pos += 1
+        return character
+
+    def _value(self) -> Any:
+        """Parse the next complete json value."""
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self._buffer, self._pos)
+                # A value which ends exactly at the end of the buffer
+                # might be a number which continues in the next chunk.
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+
+            self._read()
+
+    def _keys(self) -> Iterator[str]:
+        """Iterate over the keys of the json object starting at the
+        current position; each value must be consumed by the caller
+        before the next key is read."""
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            if self._peek() != '"':
+                raise json.JSONDecodeError(
+                    "Expecting property name", self._buffer, self._pos
+                )
+            key = self._value()
+            self._expect(":")
+            yield key
+            if self._expect(",}") == "}":
+                return
+
+    def records(self) -> Iterator[tuple[str, Any]]:
+        """Iterate over (record_id, record_dict) pairs in the register."""
+        found_register = False
+
+        for key in self._keys():
+            if key != "register":
+                self._value()
+                continue
+
+            found_register = True
+            if self._peek() != "{":
+                # let the Register model raise the same error it would
+                # for the whole page, or coerce the value into a dict
+                # in the same way.
+                register = self._value()
+                Register.parse_obj({"register": register})
+                yield from dict(register).items()
+                continue
+
+            for record_id in self._keys():
+                yield record_id, self._value()
+
+        self._skip_whitespace()
+        if self._pos < len(self._buffer):
+            raise json.JSONDecodeError("Extra data", self._buffer, self._pos)
+
+        if not found_register:
+            raise ValidationError(
+                [ErrorWrapper(MissingError(), ("register",))], Register
+            )
+
+
+def get_streamed_release_report(
+    chunks: Iterable[bytes],
+    engine: ValidationEngine = ValidationEngine.RECORD,
+    batch_size: int = STREAM_BATCH_SIZE,
+) -> ReleaseReport:
+    """Validate a register page read from an iterable of byte chunks,
+    folding each batch of records into the release report before
+    parsing the next batch. The result is the same as calling
+    `get_release_report` on the whole page."""
+    release_report = ReleaseReport()
+    # start the release report as "released" so that folding in
+    # a successful report will keep the released status.
+    release_report.release_status = DatasetReleaseStatus.RELEASED
+
+    # read enough of the page to recognize its format
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= len(COMPACT_PREFIX):
+            break
+
+    if is_compact_page(head):
+        # compact pages are not parsed incrementally
+        return get_release_report(b"".join([head, *chunks]), engine)
+
+    records = RegisterStream(chain([head], chunks)).records()
+
+    try:
+        while batch := list(islice(records, batch_size)):
+            if engine == ValidationEngine.COLUMNAR:
+                report = ColumnarRegister.from_records(batch).get_release_report()
+            else:
+                report = Register.parse_obj(
+                    {"register": dict(batch)}
+                ).get_release_report()
+
+            release_report.update(report)
+
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        # raise the same type of error as Register.parse_raw
+        raise ValidationError([ErrorWrapper(e, ROOT_KEY)], Register) from e
+
+    return release_report
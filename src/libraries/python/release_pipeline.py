@@ -0,0 +1,301 @@
+"""
+Concurrent validation of the pages of a dataset.
+
+Each page goes through two stages: downloading it, which is I/O bound
+and runs on a thread pool, and validating it, which is CPU bound and
+runs on a process pool so that pages can be parsed in parallel outside
+of the GIL. At most `window` pages are in flight at any time, which
+bounds the memory used for downloaded pages, and the page reports are
+merged in the order of the keys so that the final release report is
+identical to validating the pages one after the other.
+
+The release report of each page can be cached, so that a release only
+validates the pages which have changed since the previous release and
+merges their reports with the cached reports of the other pages.
+"""
+
+import re
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from register import (
+    DatasetReleaseStatus,
+    PageReleaseReport,
+    PageReleaseReports,
+    PageSummary,
+    Register,
+    RegisterPage,
+    ReleaseReport,
+)
+
+FetchPage = Callable[[str], Any]
+ValidatePage = Callable[[Any], ReleaseReport]
+
+# The cached page reports of each dataset are stored outside of
+# the dataset's prefix, so that they aren't listed as pages
+PAGE_REPORTS_PREFIX = "release_reports"
+
+# The summary of each page is stored under this prefix and the key of the page
+PAGE_SUMMARIES_PREFIX = "page_summaries"
+
+PAGE_KEY_PATTERN = re.compile(r"/data_(\w+)\.json$")
+
+
+def get_page_reports_key(dataset_id: str) -> str:
+    return f"{PAGE_REPORTS_PREFIX}/{dataset_id}.json"
+
+
+def get_page_summary_key(key: str) -> str:
+    return f"{PAGE_SUMMARIES_PREFIX}/{key}"
+
+
+def get_record_report(record_id: str, record_dict: Any) -> ReleaseReport:
+    """Validate a single record and return its release report.
+    Records are validated independently of each other, so the
+    release report of a page is the merge of its records' reports."""
+    return Register.parse_obj(
+        {"register": {record_id: record_dict}}
+    ).get_release_report()
+
+
+def get_record_version(record_dict: Any) -> int:
+    """Return the newest version of the datapoints of the record;
+    each datapoint is its own newest version, so the histories
+    don't need to be read."""
+    if not isinstance(record_dict, dict):
+        return 0
+
+    return max(
+        (
+            int(datapoint["version"])
+            for datapoint in record_dict.values()
+            if isinstance(datapoint, dict) and "version" in datapoint
+        ),
+        default=0,
+    )
+
+
+def get_record_versions(register_dict: dict[str, Any]) -> dict[str, int]:
+    return {
+        record_id: get_record_version(record_dict)
+        for record_id, record_dict in register_dict.items()
+    }
+
+
+def update_page_summary(
+    page_summary: Optional[PageSummary],
+    previous_etag: Optional[str],
+    register_dict: dict[str, Any],
+    record_ids: Iterable[str],
+) -> PageSummary:
+    """Update the reports of the saved records in the summary of
+    the page, or summarize every record if the summary doesn't
+    describe the version of the page which was updated. The
+    versions of the records are cheap to read, so they are
+    always read from the whole page."""
+    if page_summary is None or page_summary.etag != previous_etag:
+        return PageSummary(
+            etag=None,
+            records={
+                record_id: get_record_report(record_id, record_dict)
+                for record_id, record_dict in register_dict.items()
+            },
+            versions=get_record_versions(register_dict),
+        )
+
+    for record_id in record_ids:
+        page_summary.records[record_id] = get_record_report(
+            record_id, register_dict[record_id]
+        )
+    page_summary.versions = get_record_versions(register_dict)
+    page_summary.etag = None
+
+    return page_summary
+
+
+def get_register_page(key: str) -> Optional[str]:
+    """Return the registerPages key of the page stored at the S3
+    key, or None for the unpaginated register of legacy datasets"""
+    match = PAGE_KEY_PATTERN.search(key)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def get_page_last_updated(
+    key: str, register_pages: Optional[dict[str, RegisterPage]]
+) -> Optional[str]:
+    register_page = get_register_page(key)
+    if not register_pages or register_page not in register_pages:
+        return None
+    return register_pages[register_page].last_updated
+
+
+def get_valid_page_reports(
+    etags: dict[str, str],
+    register_pages: Optional[dict[str, RegisterPage]],
+    page_reports: PageReleaseReports,
+) -> dict[str, ReleaseReport]:
+    """Return the cached release reports of the pages which haven't
+    changed since they were validated, keyed by the S3 key of the page.
+    A page has changed if its lastUpdated timestamp in registerPages
+    or the ETag of its object are different from the cached report's."""
+    valid_reports = {}
+    for key, etag in etags.items():
+        cached = page_reports.pages.get(key)
+        if (
+            cached is not None
+            and cached.etag == etag
+            and cached.last_updated == get_page_last_updated(key, register_pages)
+        ):
+            valid_reports[key] = cached.release_report
+
+    return valid_reports
+
+
+def update_page_reports(
+    etags: dict[str, str],
+    register_pages: Optional[dict[str, RegisterPage]],
+    valid_reports: dict[str, ReleaseReport],
+    new_reports: dict[str, ReleaseReport],
+) -> PageReleaseReports:
+    """Return the page reports to cache after a release, with
+    the new reports of the pages which were validated, and
+    without the reports of pages which no longer exist."""
+    page_reports = PageReleaseReports()
+    for key, etag in etags.items():
+        page_reports.pages[key] = PageReleaseReport(
+            lastUpdated=get_page_last_updated(key, register_pages),
+            etag=etag,
+            releaseReport=(
+                valid_reports[key] if key in valid_reports else new_reports[key]
+            ),
+        )
+
+    return page_reports
+
+
+def create_process_pool(processes: int) -> Optional[Executor]:
+    """Create the process pool used to validate pages, or return
+    None to validate pages on the download threads instead. Lambda
+    does not provide the shared memory which multiprocessing needs
+    for its locks, so fall back to threads if the pool can't start."""
+    if processes < 1:
+        return None
+
+    try:
+        return ProcessPoolExecutor(processes)
+    except OSError as e:
+        print(f"Validating pages on threads, process pool unavailable: {e}")
+        return None
+
+
+def iter_page_reports(  # pylint: disable=too-many-arguments
+    keys: Iterable[str],
+    fetch_page: FetchPage,
+    validate_page: ValidatePage,
+    threads: int = 4,
+    processes: int = 0,
+    window: Optional[int] = None,
+) -> Iterator[tuple[str, ReleaseReport]]:
+    """Download and validate each page, yielding the key and
+    release report of each page in the order of `keys`.
+
+    `validate_page` must be picklable (a module level function or a
+    `functools.partial` of one) and `fetch_page` must return a picklable
+    value when `processes` is greater than zero.
+    """
+    window = window or max(threads, processes)
+
+    process_pool = create_process_pool(processes)
+
+    def fetch_and_validate(key: str) -> ReleaseReport:
+        page = fetch_page(key)
+        if process_pool is None:
+            return validate_page(page)
+        return process_pool.submit(validate_page, page).result()
+
+    thread_pool = ThreadPoolExecutor(threads)
+    in_flight: deque[tuple[str, Future[ReleaseReport]]] = deque()
+
+    try:
+        for key in keys:
+            if len(in_flight) >= window:
+                (done_key, future) = in_flight.popleft()
+                yield done_key, future.result()
+            in_flight.append((key, thread_pool.submit(fetch_and_validate, key)))
+
+        while in_flight:
+            (done_key, future) = in_flight.popleft()
+            yield done_key, future.result()
+
+    finally:
+        # if a page fails, don't start the pages which are waiting
+        thread_pool.shutdown(cancel_futures=True)
+        if process_pool is not None:
+            process_pool.shutdown(cancel_futures=True)
+
+
+def get_released_report() -> ReleaseReport:
+    release_report = ReleaseReport()
+    # start the release report as "released" so that the merge
+    # of a successful report with the blank report will return
+    # released status.
+    release_report.release_status = DatasetReleaseStatus.RELEASED
+    return release_report
+
+
+def get_pipelined_release_report(  # pylint: disable=too-many-arguments
+    keys: Iterable[str],
+    fetch_page: FetchPage,
+    validate_page: ValidatePage,
+    threads: int = 4,
+    processes: int = 0,
+    window: Optional[int] = None,
+) -> ReleaseReport:
+    """Download and validate each page, and merge the page release
+    reports in the order of `keys`; see `iter_page_reports`."""
+    release_report = get_released_report()
+
+    for _, page_report in iter_page_reports(
+        keys, fetch_page, validate_page, threads, processes, window
+    ):
+        release_report.update(page_report)
+
+    return release_report
+
+
+def get_incremental_release_report(  # pylint: disable=too-many-arguments
+    keys: Iterable[str],
+    fetch_page: FetchPage,
+    validate_page: ValidatePage,
+    cached_reports: dict[str, ReleaseReport],
+    threads: int = 4,
+    processes: int = 0,
+    window: Optional[int] = None,
+) -> tuple[ReleaseReport, dict[str, ReleaseReport]]:
+    """Validate only the pages which don't have a cached release
+    report, and merge the cached and new page reports in the order
+    of `keys`. Returns the release report and the new page reports,
+    so that the caller can cache them for the next release."""
+    keys = list(keys)
+
+    new_reports = dict(
+        iter_page_reports(
+            [key for key in keys if key not in cached_reports],
+            fetch_page,
+            validate_page,
+            threads,
+            processes,
+            window,
+        )
+    )
+
+    release_report = get_released_report()
+    for key in keys:
+        release_report.update(
+            cached_reports[key] if key in cached_reports else new_reports[key]
+        )
+
+    return release_report, new_reports
@@ -0,0 +1,203 @@
+"""
+Cache of rendered map tiles.
+
+Tiles are stored under the data version of the published records,
+which is the version of the possible filters cache and changes each
+time records are published or deleted, and a hash of the filters of
+the tile request. The current data version is stored in the cache
+itself, so that cached tiles are served without querying the
+database. When records are published or deleted the low zoom levels
+of the unfiltered map are rendered under the new version before the
+version is switched, and the tiles of the previous version are
+deleted.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+from botocore.exceptions import BotoCoreError, ClientError
+from clients import lazy_client
+from map_tiles import get_tile
+from published_records import FiltersQueryStringParameters
+from sqlalchemy import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+TILE_CACHE_VERSION_KEY = "version"
+UNFILTERED = "unfiltered"
+
+# Zoom levels 0 to 3 are 85 tiles
+TILE_SEED_MAX_ZOOM = int(os.environ.get("TILE_SEED_MAX_ZOOM", "3"))
+
+
+class TileCache:
+    """Storage backend of the tile cache"""
+
+    def read(self, key: str) -> Optional[bytes]:
+        """Return the object stored at the key, or None"""
+        raise NotImplementedError
+
+    def write(self, key: str, data: bytes) -> None:
+        """Store the object at the key"""
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str) -> None:
+        """Delete every object whose key starts with the prefix"""
+        raise NotImplementedError
+
+    def get_version(self) -> Optional[str]:
+        """Return the current data version of the cache"""
+        version = self.read(TILE_CACHE_VERSION_KEY)
+        if not version:
+            return None
+        return version.decode("utf-8")
+
+    def set_version(self, version: str) -> None:
+        self.write(TILE_CACHE_VERSION_KEY, version.encode("utf-8"))
+
+
+class LocalTileCache(TileCache):
+    """Tile cache stored in a local directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.directory, key), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, data: bytes) -> None:
+        path = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file and rename it so
+        # that readers never see a partially written tile
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), delete=False
+        ) as file:
+            file.write(data)
+        os.replace(file.name, path)
+
+    def delete_prefix(self, prefix: str) -> None:
+        shutil.rmtree(os.path.join(self.directory, prefix), ignore_errors=True)
+
+
+class S3TileCache(TileCache):
+    """Tile cache stored in an S3 bucket"""
+
+    def __init__(self, s3client, bucket: str):
+        self.s3client = s3client
+        self.bucket = bucket
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            return self.s3client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "NoSuchKey":
+                return None
+            raise
+
+    def write(self, key: str, data: bytes) -> None:
+        self.s3client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def delete_prefix(self, prefix: str) -> None:
+        paginator = self.s3client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if objects:
+                self.s3client.delete_objects(
+                    Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True}
+                )
+
+
+def get_tile_cache() -> Optional[TileCache]:
+    """Create the tile cache configured in the environment, or
+    return None if tiles should not be cached."""
+    bucket = os.environ.get("MAP_TILES_S3_BUCKET")
+    if bucket:
+        return S3TileCache(lazy_client("s3"), bucket)
+
+    directory = os.environ.get("MAP_TILES_DIRECTORY")
+    if directory:
+        return LocalTileCache(directory)
+
+    return None
+
+
+def get_filters_hash(params: Optional[FiltersQueryStringParameters]) -> str:
+    """Hash the filters of a tile request, ignoring the order
+    and repetition of the values of multi-value filters."""
+    filters = {}
+    if params is not None:
+        for name, value in params.dict(exclude_none=True).items():
+            if isinstance(value, list):
+                value = sorted(set(value))
+            if value:
+                filters[name] = value
+
+    if not filters:
+        return UNFILTERED
+
+    return hashlib.sha256(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+
+
+def get_tile_key(version: str, filters_hash: str, z: int, x: int, y: int) -> str:
+    return f"{version}/{filters_hash}/{z}/{x}/{y}.pbf"
+
+
+def seed_tiles(engine: Engine, cache: TileCache, version: str, max_zoom: int):
+    """Render every unfiltered tile up to the max zoom level"""
+    with Session(engine) as session:
+        for z in range(max_zoom + 1):
+            for x in range(2**z):
+                for y in range(2**z):
+                    cache.write(
+                        get_tile_key(version, UNFILTERED, z, x, y),
+                        get_tile(session, z, x, y),
+                    )
+
+
+def refresh_tile_cache(
+    engine: Engine,
+    cache: TileCache,
+    version: str,
+    max_zoom: int = TILE_SEED_MAX_ZOOM,
+) -> None:
+    """Seed the tiles of a new data version, switch the cache to
+    the new version, and delete the tiles of the previous version."""
+    previous_version = cache.get_version()
+    if previous_version == version:
+        return
+
+    seed_tiles(engine, cache, version, max_zoom)
+    cache.set_version(version)
+
+    if previous_version:
+        cache.delete_prefix(f"{previous_version}/")
+
+
+def refresh_map_tiles(engine: Engine, version: Optional[str]) -> None:
+    """Refresh the tile cache configured in the environment after
+    records are published or deleted. Errors are printed but not
+    raised, like refresh_possible_filters, because the records have
+    already been changed."""
+    cache = get_tile_cache()
+    if cache is None:
+        return
+
+    try:
+        if version is None:
+            # the data version is unknown, so stop serving cached
+            # tiles until the next time the records are refreshed
+            cache.set_version("")
+        else:
+            refresh_tile_cache(engine, cache, version)
+
+    except (BotoCoreError, ClientError, OSError, SQLAlchemyError) as e:
+        print(e)
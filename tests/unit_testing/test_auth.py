@@ -0,0 +1,106 @@
+import os
+
+os.environ.setdefault("METADATA_TABLE_NAME", "metadata")
+
+# pylint: disable=wrong-import-position
+import auth
+from auth import check_auth, check_project_auth
+
+CLAIMS = {
+    "sub": "1",
+    "email_verified": "true",
+    "iss": "iss",
+    "cognito:username": "user",
+    "origin_jti": "jti",
+    "aud": "aud",
+    "event_id": "event",
+    "token_use": "id",
+    "auth_time": "0",
+    "exp": "0",
+    "iat": "0",
+    "jti": "jti",
+    "email": "user@example.com",
+}
+
+EVENT = {"requestContext": {"authorizer": {"claims": CLAIMS}}}
+
+
+class MetadataTable:
+    def __init__(self):
+        self.calls = 0
+        self.project_ids = {"prj1"}
+
+    def get_item(self, Key):  # pylint: disable=invalid-name
+        self.calls += 1
+        return {
+            "Item": {
+                "pk": Key["pk"],
+                "sk": Key["sk"],
+                "projectIDs": set(self.project_ids),
+                "email": CLAIMS["email"],
+                "name": "Researcher",
+                "organization": "Viral Emergence",
+            }
+        }
+
+
+def setup_cache(monkeypatch, ttl=60):
+    table = MetadataTable()
+    monkeypatch.setattr(auth, "METADATA_TABLE", table)
+    monkeypatch.setattr(auth, "USERS", {})
+    monkeypatch.setattr(auth, "USER_CACHE_STATS", {"hits": 0, "misses": 0})
+    monkeypatch.setattr(auth, "USER_CACHE_TTL", ttl)
+    return table
+
+
+def test_user_cache(monkeypatch):
+    table = setup_cache(monkeypatch)
+
+    user = check_auth(EVENT, cache=True)
+    assert user.researcher_id == "res1"
+    # the cached user can't be changed by the handler
+    user.project_ids.add("prj2")
+
+    assert check_auth(EVENT, cache=True).project_ids == {"prj1"}
+    assert table.calls == 1
+    assert auth.USER_CACHE_STATS == {"hits": 1, "misses": 1}
+
+    # without the cache the user is always read
+    check_auth(EVENT)
+    assert table.calls == 2
+
+
+def test_users_without_projects_are_read(monkeypatch):
+    table = setup_cache(monkeypatch)
+    table.project_ids.clear()
+
+    assert not check_auth(EVENT, cache=True).project_ids
+    # the user's first project was created by another function
+    table.project_ids.add("prj1")
+    assert check_auth(EVENT, cache=True).project_ids == {"prj1"}
+    assert table.calls == 2
+
+
+def test_user_cache_expires(monkeypatch):
+    table = setup_cache(monkeypatch, ttl=0)
+
+    check_auth(EVENT, cache=True)
+    check_auth(EVENT, cache=True)
+    assert table.calls == 2
+    assert auth.USER_CACHE_STATS == {"hits": 0, "misses": 2}
+
+
+def test_project_auth(monkeypatch):
+    table = setup_cache(monkeypatch)
+    user = check_auth(EVENT, cache=True)
+
+    assert check_project_auth(EVENT, user, "prj1") is user
+    assert table.calls == 1
+
+    # a project which was added since the user was cached
+    table.project_ids.add("prj2")
+    user = check_auth(EVENT, cache=True)
+    assert check_project_auth(EVENT, user, "prj2").project_ids == {"prj1", "prj2"}
+    assert check_auth(EVENT, cache=True).project_ids == {"prj1", "prj2"}
+
+    assert not check_project_auth(EVENT, user, "prj3")
@@ -0,0 +1,43 @@
+import json
+
+import clients
+from clients import Lazy, get_secret
+
+
+def test_lazy():
+    created = []
+
+    def factory():
+        created.append(True)
+        return "client"
+
+    client = Lazy(factory)
+    assert not created
+
+    assert client.upper() == "CLIENT"
+    assert client.get() == "client"
+    assert len(created) == 1
+
+
+class SecretsManager:
+    def __init__(self):
+        self.calls = 0
+
+    def get_secret_value(self, SecretId):  # pylint: disable=invalid-name
+        self.calls += 1
+        return {"SecretString": json.dumps({"id": SecretId, "call": self.calls})}
+
+
+def test_get_secret(monkeypatch):
+    secrets_manager = SecretsManager()
+    monkeypatch.setattr(clients, "SECRETS_MANAGER", secrets_manager)
+    monkeypatch.setattr(clients, "SECRETS", {})
+
+    assert get_secret("secret") == {"id": "secret", "call": 1}
+    assert get_secret("secret") == {"id": "secret", "call": 1}
+    assert get_secret("other") == {"id": "other", "call": 2}
+
+    # expired secrets are fetched again
+    assert get_secret("rotated", ttl=0) == {"id": "rotated", "call": 3}
+    assert get_secret("rotated") == {"id": "rotated", "call": 4}
+    assert get_secret("rotated") == {"id": "rotated", "call": 4}
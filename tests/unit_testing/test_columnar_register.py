@@ -0,0 +1,188 @@
+"""Tests comparing the columnar validation engine to the Record model"""
+
+import json
+import random
+
+import pytest
+from columnar_register import ColumnarRegister, ValidationEngine, get_release_report
+from pydantic import ValidationError
+from register import Record, Register
+
+VALUES = {
+    "Host species": ["Vulpes vulpes", "Homo sapiens", "HUMAN", "", "Bat"],
+    "Host species NCBI tax ID": ["9606", "0", "96123109812306", "pears", ""],
+    "Latitude": ["40.0150", "-90", "90.1", "plum", "nan", ""],
+    "Longitude": ["105.2705", "-180", "-1105.2705", "pear", " 12 ", ""],
+    "Collection day": ["1", "31", "0", "x", ""],
+    "Collection month": ["1", "2", "13", ""],
+    "Collection year": ["2019", "2020", "19", "year", "0999", ""],
+    "Detection outcome": ["positive", "NEG", "+", "maybe", ""],
+    "Organism sex": ["m", "Female", "?", "both", ""],
+    "Dead or alive": ["alive", "D", "zombie", ""],
+    "Age": ["10", "1e3", "apple", ""],
+    "Mass": ["1.5", "heavy", ""],
+    "Pathogen": ["SARS-CoV-2", ""],
+    "Sample ID": ["A1", ""],
+    "Random column": ["SARS-CoV-2", ""],
+    "Another column": ["1", ""],
+}
+
+STORED_REPORTS = [
+    None,
+    {"status": "SUCCESS", "message": "Ready to release."},
+    {"status": "FAIL", "message": "stored failure"},
+    {"status": "WARNING", "message": "don't modify me"},
+    {"status": "WARNING", "message": "with data", "data": {"key": "value"}},
+]
+
+
+def create_random_register(record_count: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    register: dict = {"register": {}}
+
+    for index in range(record_count):
+        record: dict = {}
+        if rng.random() < 0.3:
+            record["_meta"] = {"order": index}
+
+        for column, values in rng.sample(sorted(VALUES.items()), len(VALUES)):
+            if rng.random() < 0.2:
+                continue
+
+            datapoint: dict = {
+                "dataValue": rng.choice(values),
+                "modifiedBy": "dev",
+                "version": str(rng.randint(0, 10)),
+            }
+
+            report = rng.choice(STORED_REPORTS)
+            if report:
+                datapoint["report"] = report
+
+            if rng.random() < 0.3:
+                datapoint["previous"] = {
+                    "dataValue": rng.choice(values),
+                    "modifiedBy": "dev",
+                    "version": 0,
+                }
+
+            record[column] = datapoint
+
+        register["register"][f"rec{index}"] = record
+
+    return register
+
+
+def model_reports(register: Register):
+    """Extract the reports from a register parsed by the Record model,
+    keyed in the same way as ColumnarRegister.get_reports."""
+    return {
+        record_id: {
+            (
+                Record.__fields__[field].alias if field in Record.__fields__ else field
+            ): datapoint.report
+            for field, datapoint in record
+            if field != "meta" and datapoint is not None
+        }
+        for record_id, record in register.register_data.items()
+    }
+
+
+def assert_engines_match(register_dict: dict):
+    register = Register.parse_obj(json.loads(json.dumps(register_dict)))
+    columnar = ColumnarRegister.parse_obj(json.loads(json.dumps(register_dict)))
+
+    expected_reports = model_reports(register)
+    reports = columnar.get_reports()
+
+    assert list(reports) == list(expected_reports)
+    for record_id, record_reports in expected_reports.items():
+        assert reports[record_id].keys() == record_reports.keys()
+        for field, report in record_reports.items():
+            if report is None:
+                assert reports[record_id][field] is None
+            else:
+                assert reports[record_id][field] is not None
+                assert reports[record_id][field].json() == report.json()
+
+    expected_release_report = register.get_release_report()
+    release_report = columnar.get_release_report()
+    assert release_report.json(by_alias=True) == expected_release_report.json(
+        by_alias=True
+    )
+    assert release_report.__fields_set__ == expected_release_report.__fields_set__
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_registers(seed):
+    assert_engines_match(create_random_register(50, seed))
+
+
+def test_empty_register():
+    assert_engines_match({"register": {}})
+
+
+def test_coerced_datapoints():
+    """Datapoints which need coercion are handled by the Record model"""
+    assert_engines_match(
+        {
+            "register": {
+                "rec1": {
+                    "Latitude": {"dataValue": 95, "modifiedBy": "dev", "version": 1},
+                    "Longitude": {"dataValue": "1", "modifiedBy": "dev", "version": 1},
+                    "Random column": {
+                        "dataValue": 2,
+                        "modifiedBy": "dev",
+                        "version": 1,
+                    },
+                    "_meta": {"order": "3"},
+                },
+                "rec2": {
+                    "Collection day": {
+                        "dataValue": "1",
+                        "modifiedBy": "dev",
+                        "version": "1",
+                        "previous": {"dataValue": 1, "modifiedBy": "dev", "version": 0},
+                    },
+                    "Collection month": {
+                        "dataValue": "1",
+                        "modifiedBy": "dev",
+                        "version": "1",
+                    },
+                    "Collection year": {
+                        "dataValue": "2000",
+                        "modifiedBy": "dev",
+                        "version": "1",
+                    },
+                },
+            }
+        }
+    )
+
+
+def test_invalid_datapoint():
+    """Both engines raise a ValidationError for invalid datapoints"""
+    register = {
+        "register": {
+            "rec1": {
+                "Host species": {
+                    "dataValue": "Vulpes vulpes",
+                    "version": "2",
+                    "someOtherKey": "someOtherValue",
+                }
+            }
+        }
+    }
+
+    with pytest.raises(ValidationError):
+        Register.parse_obj(register)
+
+    with pytest.raises(ValidationError):
+        ColumnarRegister.parse_obj(register)
+
+
+def test_engine_flag():
+    register_json = json.dumps(create_random_register(20, 0))
+    record_report = get_release_report(register_json, ValidationEngine.RECORD)
+    columnar_report = get_release_report(register_json, ValidationEngine.COLUMNAR)
+    assert record_report == columnar_report
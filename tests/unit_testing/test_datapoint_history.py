@@ -0,0 +1,92 @@
+"""Tests for the compaction of the history of datapoints"""
+
+from datapoint_history import archive_history, compact_history, truncate_history
+from register import Datapoint
+
+
+def datapoint(value: str, version: int, previous=None):
+    result = {"dataValue": value, "modifiedBy": "dev", "version": str(version)}
+    if previous:
+        result["previous"] = previous
+    return result
+
+
+def history(version_numbers: range):
+    result = None
+    for version in version_numbers:
+        result = datapoint(f"value {version}", version, result)
+    return result
+
+
+def versions(value):
+    result = []
+    while value:
+        result.append(int(value["version"]))
+        value = value.get("previous")
+    return result
+
+
+def test_truncate_history():
+    value = history(range(1, 6))
+
+    archived = truncate_history(value, 2)
+    assert versions(value) == [5, 4]
+    assert [int(version["version"]) for version in archived] == [3, 2, 1]
+    assert all("previous" not in version for version in archived)
+
+    assert not truncate_history(value, 2)
+    assert not truncate_history(value, 10)
+    assert versions(value) == [5, 4]
+
+
+def test_compact_history():
+    register_dict = {
+        "rec0|1": {
+            "Host species": history(range(1, 5)),
+            "Latitude": history(range(1, 2)),
+            "_meta": {"order": 1},
+        },
+        "rec0|2": {"Host species": history(range(1, 5))},
+    }
+
+    archived = compact_history(register_dict, ["rec0|1"], 3)
+    assert list(archived) == ["rec0|1"]
+    assert list(archived["rec0|1"]) == ["Host species"]
+    assert versions(register_dict["rec0|1"]["Host species"]) == [4, 3, 2]
+    # records which were not saved are not compacted
+    assert versions(register_dict["rec0|2"]["Host species"]) == [4, 3, 2, 1]
+
+    # the whole history is kept by default
+    assert not compact_history(register_dict, ["rec0|2"], 0)
+    assert versions(register_dict["rec0|2"]["Host species"]) == [4, 3, 2, 1]
+
+
+def test_archive_history():
+    archive = {}
+    archive_history(archive, {"rec0|1": {"Host species": [datapoint("b", 2)]}})
+    archive_history(
+        archive,
+        {"rec0|1": {"Host species": [datapoint("c", 3), datapoint("b", 2)]}},
+    )
+    archive_history(archive, {"rec0|1": {"Host species": [datapoint("a", 1)]}})
+
+    archived_versions = archive["register"]["rec0|1"]["Host species"]
+    assert [version["dataValue"] for version in archived_versions] == ["c", "b", "a"]
+
+
+def test_merge_deep_history():
+    left = Datapoint.parse_obj(datapoint("value 0", 0))
+    right = Datapoint.parse_obj(datapoint("value 0", 0))
+    for version in range(1, 5000):
+        if version % 2:
+            left = Datapoint(**datapoint(f"value {version}", version), previous=left)
+        else:
+            right = Datapoint(**datapoint(f"value {version}", version), previous=right)
+
+    merged = Datapoint.merge(left, right)
+    merged_versions = []
+    while merged:
+        merged_versions.append(int(merged.version))
+        merged = merged.previous
+
+    assert merged_versions == list(range(4999, -1, -1))
@@ -0,0 +1,54 @@
+import os
+
+os.environ.setdefault("DATABASE", "pharos-pytest")
+
+# pylint: disable=wrong-import-position
+import engine
+import sqlalchemy
+from engine import ENGINES, POOL_METRICS, PoolMetrics, get_engine
+from sqlalchemy.pool import QueuePool
+
+
+def test_engine_is_reused():
+    first = get_engine("pharos-test-a")
+    assert get_engine("pharos-test-a") is first
+    assert get_engine("pharos-test-b") is not first
+    assert ENGINES["pharos-test-a"] is first
+    assert "pharos-test-a" in POOL_METRICS
+
+
+def test_pools_are_replaced_after_fork():
+    pool = get_engine("pharos-test-a").pool
+
+    pid = os.fork()
+    if pid == 0:
+        # the child keeps the engine, with a new pool
+        replaced = get_engine("pharos-test-a").pool is not pool
+        os._exit(0 if replaced else 1)  # pylint: disable=protected-access
+
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert engine.ENGINES["pharos-test-a"].pool is pool
+
+
+def test_pool_metrics():
+    sqlite_engine = sqlalchemy.create_engine("sqlite://", poolclass=QueuePool)
+    metrics = PoolMetrics()
+    metrics.listen(sqlite_engine)
+
+    with sqlite_engine.connect():
+        assert metrics.checkouts == 1
+        assert metrics.connections == 1
+
+        with sqlite_engine.connect():
+            assert metrics.checkouts == 2
+            assert metrics.connections == 2
+
+    # returned connections are checked out again without connecting
+    with sqlite_engine.connect():
+        pass
+
+    assert metrics.checkouts == 3
+    assert metrics.connections == 2
+    assert metrics.max_checked_out == 2
+    assert metrics.connect_seconds >= metrics.max_connect_seconds > 0
@@ -0,0 +1,52 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+# pylint: disable=unused-import
+
+import math
+
+from fixture import ENGINE, map_data, mock_data
+from map_tiles import (
+    CLUSTER_GRID_SIZE,
+    CLUSTER_ZOOM,
+    WEB_MERCATOR_WIDTH,
+    get_cluster_cell_size,
+    get_tile,
+    select_tile_features,
+)
+from published_records import FiltersQueryStringParameters
+from sqlalchemy.orm import Session
+
+MAP_DATASET_FILTER = FiltersQueryStringParameters(dataset_id="mapSet")
+
+
+def test_cluster_cell_size():
+    assert get_cluster_cell_size(0) * CLUSTER_GRID_SIZE == WEB_MERCATOR_WIDTH
+    assert get_cluster_cell_size(1) == get_cluster_cell_size(0) / 2
+
+
+def test_clusters_count_every_record(map_data):
+    with Session(ENGINE) as session:
+        clusters = session.execute(
+            select_tile_features(0, 0, 0, MAP_DATASET_FILTER)
+        ).all()
+        assert 1 <= len(clusters) < 100
+        assert sum(cluster.point_count for cluster in clusters) == 100
+        assert sum(cluster.positive for cluster in clusters) == 50
+        assert sum(cluster.negative for cluster in clusters) == 25
+        assert sum(cluster.inconclusive for cluster in clusters) == 25
+
+        assert get_tile(session, 0, 0, 0, MAP_DATASET_FILTER)
+
+
+def test_points_at_cluster_zoom(map_data):
+    # the tile at the cluster zoom level which contains (-105, 40)
+    x = int((-105 + 180) / 360 * 2**CLUSTER_ZOOM)
+    y = int(
+        (1 - math.asinh(math.tan(math.radians(40))) / math.pi) / 2 * 2**CLUSTER_ZOOM
+    )
+    with Session(ENGINE) as session:
+        points = session.execute(
+            select_tile_features(CLUSTER_ZOOM, x, y, MAP_DATASET_FILTER)
+        ).all()
+        assert points
+        assert all(point.pharos_id.startswith("project0-mapSet-") for point in points)
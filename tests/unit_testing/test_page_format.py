@@ -0,0 +1,134 @@
+import json
+
+import pytest
+from columnar_register import ValidationEngine, get_release_report
+from page_format import (
+    PAGE_COMPRESSION_GZIP,
+    PAGE_FORMAT_COMPACT,
+    decode_page,
+    decompress_chunks,
+    decompress_page,
+    encode_page,
+    is_compact_page,
+    page_object,
+    to_register_json,
+)
+from register_stream import get_streamed_release_report
+
+
+def datapoint(value: str, modified_by: str, version: int, previous=None):
+    result = {"dataValue": value, "modifiedBy": modified_by, "version": str(version)}
+    if previous:
+        result["previous"] = previous
+    return result
+
+
+REGISTER = {
+    "register": {
+        f"rec0|{index}": {
+            "Host species": datapoint(
+                "Vulpes vulpes",
+                "dev",
+                index + 2,
+                datapoint("Vulpes", "researcher", index + 1),
+            ),
+            "Latitude": {
+                **datapoint("plum", "researcher", 1),
+                "report": {"status": "FAIL", "message": "Invalid latitude"},
+            },
+            "Collection year": datapoint("2019", "dev", 1),
+            "Detection outcome": datapoint("positive", "dev", 1),
+            "Unknown column": datapoint("extra", "dev", 1),
+            "_meta": {"order": index},
+        }
+        for index in range(20)
+    }
+}
+
+
+def test_compact_round_trip():
+    compact = encode_page(REGISTER, PAGE_FORMAT_COMPACT)
+    legacy = encode_page(REGISTER, "json")
+
+    assert is_compact_page(compact)
+    assert not is_compact_page(legacy)
+    assert len(compact) < len(legacy) / 2
+
+    assert decode_page(compact) == REGISTER
+    assert decode_page(legacy) == REGISTER
+    assert json.loads(to_register_json(compact)) == REGISTER
+    assert to_register_json(legacy) is legacy
+
+
+def test_malformed_values_round_trip():
+    register = {
+        "register": {
+            "rec0|1": {
+                "Host species": {"dataValue": "Bat", "modifiedBy": 12, "version": "1"},
+                "Latitude": {"dataValue": "1", "illegal": True},
+                "Pathogen": ["SARS-CoV-2"],
+                "Collection year": datapoint("2019", "dev", 1, previous=None),
+            },
+            "rec0|2": "not a record",
+        }
+    }
+    assert decode_page(encode_page(register, PAGE_FORMAT_COMPACT)) == register
+
+
+def test_decode_without_history():
+    register_dict = decode_page(encode_page(REGISTER, PAGE_FORMAT_COMPACT), False)
+    record = register_dict["register"]["rec0|0"]
+    assert "previous" not in record["Host species"]
+    assert record["Host species"]["dataValue"] == "Vulpes vulpes"
+
+
+@pytest.mark.parametrize("page_format", ["json", PAGE_FORMAT_COMPACT])
+def test_decode_records(page_format):
+    record_ids = {"rec0|3", "rec0|7", "rec0|missing"}
+    register_dict = decode_page(
+        encode_page(REGISTER, page_format), record_ids=record_ids
+    )
+
+    assert register_dict == {
+        "register": {
+            record_id: REGISTER["register"][record_id]
+            for record_id in ("rec0|3", "rec0|7")
+        }
+    }
+
+
+@pytest.mark.parametrize("engine", list(ValidationEngine))
+def test_compact_release_report(engine):
+    legacy = encode_page(REGISTER, "json")
+    compact = encode_page(REGISTER, PAGE_FORMAT_COMPACT)
+    expected = get_release_report(legacy, engine).json(by_alias=True)
+
+    assert get_release_report(compact, engine).json(by_alias=True) == expected
+
+    chunks = [compact[index : index + 100] for index in range(0, len(compact), 100)]
+    streamed_report = get_streamed_release_report(chunks, engine)
+    assert streamed_report.json(by_alias=True) == expected
+
+
+@pytest.mark.parametrize("page_format", ["json", PAGE_FORMAT_COMPACT])
+def test_gzip_page(page_format):
+    page = encode_page(REGISTER, page_format)
+
+    stored = page_object(page, PAGE_COMPRESSION_GZIP)
+    assert stored["ContentEncoding"] == "gzip"
+    assert len(stored["Body"]) < len(page)
+    # the same page is always compressed to the same bytes
+    assert page_object(page, PAGE_COMPRESSION_GZIP) == stored
+
+    assert decompress_page(stored["Body"]) == page
+    # uncompressed pages are read as they are
+    assert page_object(page, "none") == {"Body": page}
+    assert decompress_page(page) is page
+
+    for body in (stored["Body"], page):
+        # the first chunks of a compressed page may not decompress to any bytes
+        chunks = [body[index : index + 10] for index in range(0, len(body), 10)]
+        assert b"".join(decompress_chunks(chunks)) == page
+
+        streamed_report = get_streamed_release_report(decompress_chunks(chunks))
+        assert streamed_report == get_release_report(page)
@@ -0,0 +1,129 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+# pylint: disable=unused-import
+
+import json
+
+import pytest
+from fixture import ENGINE, create_mock_register, mock_data
+from models import PublishedDataset, PublishedProject, PublishedRecord
+from publish_register import (
+    COPY_COLUMNS,
+    copy_published_records,
+    create_published_dataset,
+    create_published_records,
+    iter_published_record_values,
+    published_record_row,
+)
+from register import Dataset
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+VALID_REGISTER = json.dumps(
+    {
+        "register": {
+            "rec1": {
+                "Host species": {"dataValue": 'Vulpes "vulpes"', "version": "1"},
+                "Latitude": {"dataValue": "40.0150", "version": "1"},
+                "Longitude": {"dataValue": " 105.2705 ", "version": "1"},
+                "Collection day": {"dataValue": "1", "version": "1"},
+                "Collection month": {"dataValue": "2", "version": "1"},
+                "Collection year": {"dataValue": "2023", "version": "1"},
+                "Detection outcome": {"dataValue": "POSITIVE", "version": "1"},
+                "Host species NCBI tax ID": {"dataValue": "9606", "version": "1"},
+                "Age": {"dataValue": "1.5", "version": "1"},
+                "Mass": {"dataValue": "heavy", "version": "1"},
+                "Sample ID": {"dataValue": "", "version": "1"},
+                "Random column": {"dataValue": "ignored", "version": "1"},
+                "_meta": {"order": 1},
+            }
+        }
+    }
+)
+
+
+def test_published_record_row():
+    """Values are coerced by the column types and written as csv"""
+    values = next(iter_published_record_values(VALID_REGISTER, "prj1", "set1"))
+    row = published_record_row(values, postgresql.dialect())
+    fields = dict(zip((column.name for column in COPY_COLUMNS), row[:-1].split(",")))
+
+    assert row.endswith("\n")
+    assert fields["pharos_id"] == '"prj1-set1-rec1"'
+    assert fields["host_species"] == '"Vulpes ""vulpes"""'
+    assert fields["host_species_ncbi_tax_id"] == "9606"
+    assert fields["detection_outcome"] == '"positive"'
+    assert fields["age"] == "1.5"
+    # uncoercible values and missing columns are NULL
+    assert fields["mass"] == ""
+    assert fields["animal_id"] == ""
+    # empty strings are kept as strings
+    assert fields["sample_id"] == '""'
+    assert fields["collection_date"] == '"2023-02-01"'
+    assert fields["geom"] == '"SRID=4326;POINT( 105.2705  40.0150)"'
+
+
+def published_rows(session: Session, dataset_id: str):
+    columns = [
+        func.ST_AsEWKT(column) if column.name == "geom" else column
+        for column in COPY_COLUMNS
+        if column.name not in ("pharos_id", "dataset_id")
+    ]
+    return session.execute(
+        select(*columns)
+        .where(PublishedRecord.dataset_id == dataset_id)
+        .order_by(PublishedRecord.pharos_id)
+    ).all()
+
+
+@pytest.mark.parametrize(
+    "register_json", [create_mock_register(200), VALID_REGISTER], ids=["mock", "valid"]
+)
+def test_copy_matches_orm(mock_data, register_json):
+    """Records published with COPY are identical to the ORM records"""
+
+    with Session(ENGINE) as session:
+        project = session.scalar(
+            select(PublishedProject).where(PublishedProject.project_id == "project0")
+        )
+        assert project
+
+        orm_dataset = create_published_dataset(
+            Dataset.parse_table_item(
+                {
+                    "pk": "project0",
+                    "sk": "ormSet",
+                    "name": "ORM",
+                    "releaseStatus": "Released",
+                }
+            )
+        )
+        orm_dataset.records = create_published_records(
+            register_json=register_json, project_id="ormPrj", dataset_id="ormSet"
+        )
+        copy_dataset = create_published_dataset(
+            Dataset.parse_table_item(
+                {
+                    "pk": "project0",
+                    "sk": "copySet",
+                    "name": "COPY",
+                    "releaseStatus": "Released",
+                }
+            )
+        )
+        project.datasets.extend([orm_dataset, copy_dataset])
+        session.flush()
+
+        count = copy_published_records(
+            session, register_json, project_id="copyPrj", dataset_id="copySet"
+        )
+        session.commit()
+
+        orm_rows = published_rows(session, "ormSet")
+        assert len(orm_rows) == count
+        assert published_rows(session, "copySet") == orm_rows
+
+        session.delete(session.get(PublishedDataset, "ormSet"))
+        session.delete(session.get(PublishedDataset, "copySet"))
+        session.commit()
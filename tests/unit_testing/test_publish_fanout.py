@@ -0,0 +1,179 @@
+import copy
+
+import publish_fanout
+from botocore.exceptions import ClientError
+from publish_fanout import (
+    PUBLISH_JOB_PK,
+    PublishJob,
+    PublishShard,
+    publish_shard,
+    refresh_published_records,
+    start_publish_job,
+)
+from register import DatasetReleaseStatus
+
+VALID_JOB = PublishJob(
+    projectID="prjTest", jobID="2023-01-01T00:00:00Z", datasetIDs=["setA", "setB"]
+)
+
+
+def test_job_table_item():
+    table_item = VALID_JOB.table_item()
+
+    assert table_item["pk"] == PUBLISH_JOB_PK
+    assert table_item["sk"] == "prjTest"
+    # empty sets can't be stored in dynamodb
+    assert "publishedDatasetIDs" not in table_item
+    assert "failedDatasetIDs" not in table_item
+
+    assert PublishJob.parse_table_item(table_item) == VALID_JOB
+
+
+def test_job_complete():
+    assert not VALID_JOB.complete
+
+    job = PublishJob.parse_table_item(
+        {**VALID_JOB.table_item(), "publishedDatasetIDs": {"setA"}}
+    )
+    assert not job.complete
+
+    job = PublishJob.parse_table_item(
+        {
+            **VALID_JOB.table_item(),
+            "publishedDatasetIDs": {"setA"},
+            "failedDatasetIDs": {"setB"},
+        }
+    )
+    assert job.complete
+
+
+def test_shard_payload():
+    shard = PublishShard.parse_obj(
+        {
+            "jobID": VALID_JOB.job_id,
+            "project": {
+                "projectID": "prjTest",
+                "name": "Test project",
+                "datasetIDs": ["setA"],
+            },
+            "dataset": {
+                "projectID": "prjTest",
+                "datasetID": "setA",
+                "name": "Test dataset",
+            },
+        }
+    )
+
+    assert PublishShard.parse_raw(shard.json(by_alias=True)) == shard
+
+
+class LocalTable:
+    """Stand-in for the metadata table, supporting the
+    updates which the workers of a publish job make"""
+
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, Item):
+        self.items[(Item["pk"], Item["sk"])] = copy.deepcopy(Item)
+
+    def get_item(self, Key):
+        item = self.items.get((Key["pk"], Key["sk"]))
+        return {"Item": copy.deepcopy(item)} if item else {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression, **kwargs):
+        item = self.items[(Key["pk"], Key["sk"])]
+        values = kwargs["ExpressionAttributeValues"]
+
+        if item["jobID"] != values[":j"] or (
+            "finished" in ConditionExpression and item["finished"] != values[":f"]
+        ):
+            raise ClientError(
+                {"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem"
+            )
+
+        action, attribute, value = UpdateExpression.split(" ", 2)
+        if action == "ADD":
+            item[attribute] = item.get(attribute, set()) | values[value]
+        else:
+            item[attribute] = values[value.split("= ")[1]]
+
+        return {"Attributes": copy.deepcopy(item)}
+
+
+def make_shards(table):
+    project = {
+        "projectID": "prjTest",
+        "name": "Test project",
+        "datasetIDs": ["setA", "setB"],
+    }
+    datasets = [
+        {"projectID": "prjTest", "datasetID": dataset_id, "name": dataset_id}
+        for dataset_id in ("setA", "setB")
+    ]
+    shards = [
+        PublishShard.parse_obj({"jobID": "", "project": project, "dataset": dataset})
+        for dataset in datasets
+    ]
+    job = start_publish_job(table, shards[0].project, [s.dataset for s in shards])
+    for shard in shards:
+        shard.job_id = job.job_id
+    return shards
+
+
+def test_shard_fails_after_committing_pages(monkeypatch):
+    table = LocalTable()
+    shards = make_shards(table)
+    committed = []
+
+    def publish_dataset(*args):
+        dataset = args[4]
+        committed.append(dataset.dataset_id)
+        if dataset.dataset_id == "setA":
+            raise ValueError("Failed after the first page was committed")
+
+    monkeypatch.setattr(publish_fanout, "publish_dataset", publish_dataset)
+
+    assert publish_shard(shards[0], None, None, "bucket", table) is None
+    assert shards[0].dataset.release_status == DatasetReleaseStatus.UNRELEASED
+
+    # a retry of the shard doesn't publish the dataset again
+    assert publish_shard(shards[0], None, None, "bucket", table) is None
+    assert committed == ["setA"]
+
+    job = publish_shard(shards[1], None, None, "bucket", table)
+    assert job is not None
+    assert job.failed_dataset_ids == {"setA"}
+    assert job.published_dataset_ids == {"setB"}
+
+    # the job is only finished once
+    assert publish_shard(shards[1], None, None, "bucket", table) is None
+    assert committed == ["setA", "setB"]
+
+
+def test_replaced_job(monkeypatch):
+    table = LocalTable()
+    shards = make_shards(table)
+    # the project is published again before the shard runs
+    table.put_item(
+        Item=PublishJob(
+            projectID="prjTest", jobID="newer", datasetIDs=["setA"]
+        ).table_item()
+    )
+    published = []
+
+    monkeypatch.setattr(
+        publish_fanout, "publish_dataset", lambda *args: published.append(args)
+    )
+    assert publish_shard(shards[0], None, None, "bucket", table) is None
+    assert not published
+
+
+def test_refresh_errors_are_not_raised(monkeypatch):
+    def refresh_possible_filters(engine):
+        raise RuntimeError("Database is unavailable")
+
+    monkeypatch.setattr(
+        publish_fanout, "refresh_possible_filters", refresh_possible_filters
+    )
+    refresh_published_records(None)
@@ -0,0 +1,59 @@
+"""Tests for the publish registers lambda"""
+
+import os
+
+os.environ.setdefault("DATABASE", "pharos-pytest")
+os.environ.setdefault("DATASETS_S3_BUCKET", "datasets")
+os.environ.setdefault("METADATA_TABLE_NAME", "metadata")
+os.environ.setdefault("CF_CACHE_POLICY_ID", "policy")
+
+# pylint: disable=wrong-import-position
+import importlib.util
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from register import ProjectPublishStatus
+
+APP_PATH = Path(__file__).parents[2] / "src" / "lambda" / "publish_registers" / "app.py"
+spec = importlib.util.spec_from_file_location("publish_registers_app", APP_PATH)
+publish_registers = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(publish_registers)
+
+
+def test_project_without_datasets_is_published(monkeypatch):
+    table = MagicMock()
+    fan_out = MagicMock()
+    refreshed = []
+
+    monkeypatch.setattr(publish_registers, "PUBLISH_PROCESSES", 2)
+    monkeypatch.setattr(publish_registers, "METADATA_TABLE", table)
+    monkeypatch.setattr(publish_registers, "fan_out_datasets", fan_out)
+    monkeypatch.setattr(publish_registers, "get_engine", lambda: None)
+    monkeypatch.setattr(publish_registers, "Base", MagicMock())
+    monkeypatch.setattr(publish_registers, "Session", MagicMock())
+    monkeypatch.setattr(publish_registers, "create_published_project", MagicMock())
+    monkeypatch.setattr(publish_registers, "upsert_project_users", MagicMock())
+    monkeypatch.setattr(
+        publish_registers, "refresh_published_records", refreshed.append
+    )
+    monkeypatch.setattr(publish_registers, "invalidate_api_cache", MagicMock())
+
+    event = {
+        "project": {
+            "projectID": "prjTest",
+            "name": "Test project",
+            "datasetIDs": [],
+            "publishStatus": "Publishing",
+        },
+        "released_datasets": [],
+        "project_users": [],
+    }
+
+    # no worker would finish a job without datasets, so
+    # the project mustn't be left publishing
+    assert publish_registers.lambda_handler(event, None)
+    fan_out.assert_not_called()
+
+    item = table.put_item.call_args.kwargs["Item"]
+    assert item["publishStatus"] == ProjectPublishStatus.PUBLISHED
+    assert refreshed == [None]
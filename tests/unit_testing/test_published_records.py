@@ -4,9 +4,16 @@
 
 from types import SimpleNamespace
 from typing import Dict, List
+import pytest
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import Session
 from published_records import (
+    FiltersQueryStringParameters,
+    PageCursor,
     QueryStringParameters,
+    get_compound_filter,
     format_response_rows,
     query_records,
     get_published_records_response,
@@ -105,15 +112,42 @@ def test_filter_by_researcher_name_and_project_name(mock_data):
     check({"researcher_name": ["Researcher Zero"], "project_name": ["Project One"]}, 0)
 
 
+def test_filter_by_project_id(mock_data):
+    check({"project_id": ["project0"]}, 200)
+    check({"project_id": ["project0", "project1"]}, 400)
+
+
 def test_filter_by_dataset_id(mock_data):
     check({"dataset_id": "dataset0"}, 200)
     check({"dataset_id": "dataset1"}, 200)
 
 
+def compile_filter(**params):
+    (compound_filter, _) = get_compound_filter(FiltersQueryStringParameters(**params))
+    return (
+        select(PublishedRecord.pharos_id)
+        .where(compound_filter)
+        .compile(dialect=postgresql.dialect())
+    )
+
+
+def test_filter_sql_is_the_same_for_any_number_of_values():
+    one = compile_filter(host_species=["Wolf"], detection_outcome=["pos"])
+    many = compile_filter(
+        host_species=["Wolf", "Bear"], detection_outcome=["Positive", "neg", "no"]
+    )
+    assert str(one) == str(many)
+    assert "lower(published_records.host_species) = ANY" in str(many)
+
+    # the values are matched in lower case, and detection
+    # outcomes are converted to the database values
+    assert list(many.params.values()) == [["wolf", "bear"], ["positive", "negative"]]
+
+
 def test_format_response_rows(mock_data):
     with Session(ENGINE) as session:
         (query, _) = query_records(session, {})
-        rows = query.limit(50).offset(0).all()
+        rows = query.order_by(PublishedRecord.pharos_id).limit(50).offset(0).all()
     formatted_rows = format_response_rows(rows, 0)
     assert formatted_rows[0] == {
         "pharosID": "project0-dataset0-rec0",
@@ -172,3 +206,89 @@ def test_get_published_records_response_with_filters(mock_data):
     assert response["isLastPage"] is False
     assert response["recordCount"] == 400
     assert response["matchingRecordCount"] == 200
+
+
+def test_invalid_cursor():
+    with pytest.raises(ValidationError):
+        QueryStringParameters(pageSize=50, cursor="not a cursor")
+
+    cursor = PageCursor(sort=[], after=["project0-dataset0-rec0"], rowNumber=50)
+    QueryStringParameters(pageSize=50, cursor=cursor.encode())
+    # the cursor must be used with the sort order it was created for
+    with pytest.raises(ValidationError):
+        QueryStringParameters(pageSize=50, sort=["Pathogen"], cursor=cursor.encode())
+
+
+@pytest.mark.parametrize(
+    "sort,after",
+    [
+        (["Collection date"], ["not a date", "project0-dataset0-rec0"]),
+        (["Collection date"], [20230101, "project0-dataset0-rec0"]),
+        (["Age"], ["not a number", "project0-dataset0-rec0"]),
+        (["Age"], [{"value": 1}, "project0-dataset0-rec0"]),
+        (["Pathogen"], [["path1"], "project0-dataset0-rec0"]),
+        ([], [True]),
+        (["Not a field"], [None, "project0-dataset0-rec0"]),
+    ],
+)
+def test_tampered_cursor(sort, after):
+    """Cursors with values which aren't of the type of their column
+    are rejected like other invalid cursors, instead of failing when
+    the query is built or run"""
+    cursor = PageCursor(sort=sort, after=after, rowNumber=50)
+    with pytest.raises(ValidationError):
+        QueryStringParameters(pageSize=50, sort=sort, cursor=cursor.encode())
+
+
+@pytest.mark.parametrize(
+    "sort",
+    [None, ["-Collection date"], ["Pathogen", "-Host species"], ["-Sample ID"]],
+)
+def test_cursor_pages_match_offset_pages(mock_data, sort):
+    """Following nextCursor returns the same rows as requesting each page"""
+    cursor = None
+    for page in range(1, 10):
+        page_response = get_published_records_response(
+            ENGINE, QueryStringParameters(pageSize=45, page=page, sort=sort)
+        )
+        cursor_response = get_published_records_response(
+            ENGINE, QueryStringParameters(pageSize=45, sort=sort, cursor=cursor)
+        )
+        assert cursor_response["publishedRecords"] == page_response["publishedRecords"]
+        assert cursor_response["isLastPage"] == page_response["isLastPage"]
+        cursor = cursor_response["nextCursor"]
+
+    assert cursor is None
+    assert cursor_response["publishedRecords"][-1]["rowNumber"] == 400
+
+
+def test_count_strategies(mock_data):
+    for count, expected_count in [("exact", 200), ("none", None)]:
+        params = QueryStringParameters(
+            pageSize=50, researcher_name=["Researcher Zero"], count=count
+        )
+        response = get_published_records_response(ENGINE, params)
+        assert response["matchingRecordCount"] == expected_count
+        assert response["isLastPage"] is False
+        assert response["recordCount"] == 400
+
+    params = QueryStringParameters(
+        pageSize=50, researcher_name=["Researcher Zero"], count="estimate"
+    )
+    response = get_published_records_response(ENGINE, params)
+    assert isinstance(response["matchingRecordCount"], int)
+
+
+def test_last_page(mock_data):
+    response = get_published_records_response(
+        ENGINE, QueryStringParameters(pageSize=400, count="none")
+    )
+    assert len(response["publishedRecords"]) == 400
+    assert response["isLastPage"] is True
+    assert response["nextCursor"] is None
+
+    response = get_published_records_response(
+        ENGINE, QueryStringParameters(pageSize=399, count="none")
+    )
+    assert len(response["publishedRecords"]) == 399
+    assert response["isLastPage"] is False
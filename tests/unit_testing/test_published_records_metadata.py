@@ -2,8 +2,17 @@
 # pylint: disable=unused-argument
 # pylint: disable=unused-import
 
+import json
+
 from fixture import ENGINE, mock_data
-from published_records_metadata import get_possible_filters
+from models import PublishedDataset
+from published_records_metadata import (
+    get_cached_possible_filters,
+    get_cached_record_count,
+    get_possible_filters,
+    refresh_possible_filters,
+)
+from sqlalchemy.orm import Session
 
 
 def test_get_possible_filters(mock_data):
@@ -31,3 +40,43 @@ def test_get_possible_filters(mock_data):
         "collection_start_date",
         "collection_end_date",
     ]
+
+
+def test_cached_possible_filters(mock_data):
+    """The cache is built from the summary of each dataset, and
+    returns the same filters as querying the published records"""
+    possible_filters, version = get_cached_possible_filters(ENGINE)
+    assert json.loads(possible_filters) == get_possible_filters(ENGINE)
+
+    # the cache is not rebuilt until the records change
+    assert get_cached_possible_filters(ENGINE) == (possible_filters, version)
+
+
+def test_refresh_possible_filters(mock_data):
+    _, version = get_cached_possible_filters(ENGINE)
+
+    with Session(ENGINE) as session:
+        session.delete(session.get(PublishedDataset, "dataset1"))
+        session.commit()
+
+    next_version = refresh_possible_filters(ENGINE)
+    assert next_version and next_version != version
+
+    possible_filters, cached_version = get_cached_possible_filters(ENGINE)
+    assert cached_version == next_version
+    filters = json.loads(possible_filters)
+    assert filters == get_possible_filters(ENGINE)
+    assert filters["project_name"]["options"] == ["Project One", "Project Zero"]
+
+
+def test_cached_record_count(mock_data):
+    with Session(ENGINE) as session:
+        assert get_cached_record_count(session) == 400
+
+        session.delete(session.get(PublishedDataset, "dataset1"))
+        session.commit()
+
+    refresh_possible_filters(ENGINE)
+
+    with Session(ENGINE) as session:
+        assert get_cached_record_count(session) == 200
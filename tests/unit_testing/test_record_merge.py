@@ -0,0 +1,105 @@
+"""Tests for merging records as plain dicts"""
+
+import json
+import random
+
+from record_merge import merge_datapoints, merge_records
+from register import Datapoint, Record
+
+VALUES = {
+    "Host species": ["Vulpes vulpes", "Homo sapiens", ""],
+    "Latitude": ["40.0150", "-90", "plum"],
+    "Collection year": ["2019", "2020", "19"],
+    "Unknown column": ["extra", "other"],
+}
+
+
+def random_history(rng: random.Random, versions: list[int]):
+    datapoint = None
+    for version in sorted(rng.sample(versions, rng.randint(1, len(versions)))):
+        datapoint = {
+            "dataValue": rng.choice(["a", "b", "c"]),
+            "modifiedBy": rng.choice(["dev", "researcher"]),
+            "version": str(version),
+            **({"previous": datapoint} if datapoint else {}),
+        }
+    return datapoint
+
+
+def random_record(rng: random.Random):
+    record = {}
+    for column, values in VALUES.items():
+        if rng.random() < 0.8:
+            record[column] = random_history(rng, list(range(1, 6)))
+            record[column]["dataValue"] = rng.choice(values)
+    if rng.random() < 0.5:
+        record["_meta"] = {"order": rng.randint(0, 100)}
+    return json.loads(Record(**record).json(by_alias=True, exclude_none=True))
+
+
+def test_merge_datapoints_matches_model():
+    rng = random.Random(0)
+    for _ in range(2000):
+        left = random_history(rng, list(range(1, 8)))
+        right = random_history(rng, list(range(1, 8)))
+        if rng.random() < 0.3:
+            left["report"] = {"status": "SUCCESS", "message": "Ready to release."}
+
+        expected = Datapoint.merge(
+            Datapoint.parse_obj(left), Datapoint.parse_obj(right)
+        )
+        merged = merge_datapoints(left, right)
+        assert Datapoint.parse_obj(merged) == expected
+
+
+def test_merge_records_matches_model():
+    rng = random.Random(1)
+    for _ in range(300):
+        left, right = random_record(rng), random_record(rng)
+
+        expected = Record.merge(Record(**left), Record(**right))
+        merged = merge_records(left, right)
+        assert merged is not None
+        assert json.loads(expected.json(by_alias=True, exclude_none=True)) == merged
+
+
+def test_merge_records_extra_columns_and_meta():
+    left = {
+        "Unknown column": {"dataValue": "a", "modifiedBy": "dev", "version": "1"},
+        "_meta": {"order": 1},
+    }
+    right = {
+        "Other column": {"dataValue": "b", "modifiedBy": "dev", "version": "2"},
+    }
+
+    merged = merge_records(left, right)
+    assert merged == {
+        "Unknown column": left["Unknown column"],
+        "Other column": right["Other column"],
+        "_meta": {"order": 1},
+    }
+
+    assert merge_records(None, right) is right
+    assert merge_records(left, None) is left
+
+    # the model keeps the same metadata
+    expected = Record.merge(Record.parse_obj(left), Record.parse_obj(right))
+    assert expected.meta is not None and expected.meta.order == 1
+
+
+def test_merge_deep_history():
+    left = right = None
+    for version in range(1, 20000):
+        datapoint = {"dataValue": str(version), "modifiedBy": "dev", "version": version}
+        if version % 2:
+            left = {**datapoint, **({"previous": left} if left else {})}
+        else:
+            right = {**datapoint, **({"previous": right} if right else {})}
+
+    merged = merge_datapoints(left, right)
+    versions = []
+    while merged:
+        versions.append(merged["version"])
+        merged = merged.get("previous")
+
+    assert versions == list(range(19999, 0, -1))
@@ -0,0 +1,99 @@
+"""Tests comparing the streaming register parser to parsing whole pages"""
+
+import json
+
+import pytest
+from columnar_register import ValidationEngine, get_release_report
+from pydantic import ValidationError
+from register_stream import RegisterStream, get_streamed_release_report
+
+VALUES = {
+    "Host species": ["Vulpes vulpes", "HUMAN", "", "Bat"],
+    "Latitude": ["40.0150", "90.1", "plum", ""],
+    "Longitude": ["105.2705", "-1105.2705", " 12 "],
+    "Collection day": ["1", "0", "x", ""],
+    "Collection month": ["1", "13", ""],
+    "Collection year": ["2019", "19", ""],
+    "Detection outcome": ["positive", "maybe", ""],
+    "Random column": ["SARS-CoV-2", ""],
+}
+
+REPORTS = [
+    None,
+    {"status": "SUCCESS", "message": "Ready to release."},
+    {"status": "FAIL", "message": "stored failure"},
+]
+
+
+def create_register(record_count: int) -> dict:
+    register: dict = {"register": {}}
+    for index in range(record_count):
+        record: dict = {"_meta": {"order": index}}
+        for column_index, (column, values) in enumerate(VALUES.items()):
+            datapoint: dict = {
+                "dataValue": values[(index + column_index) % len(values)],
+                "modifiedBy": "dev",
+                "version": str(index),
+            }
+            report = REPORTS[(index * column_index) % len(REPORTS)]
+            if report:
+                datapoint["report"] = report
+            record[column] = datapoint
+        register["register"][f"rec{index}"] = record
+    return register
+
+
+def split_chunks(data: bytes, chunk_size: int):
+    return [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 4096])
+def test_stream_records(chunk_size):
+    register = create_register(20)
+    register["register"]["rec0"]["Host species"] = {
+        "dataValue": "Zorro culpeo ü 𝄞",
+        "modifiedBy": "dev",
+        "version": 12345,
+    }
+    register_json = json.dumps({"other": [1, {"a": None}], **register}, indent=2)
+    chunks = split_chunks(register_json.encode("UTF-8"), chunk_size)
+
+    records = list(RegisterStream(chunks).records())
+    assert records == list(register["register"].items())
+
+
+@pytest.mark.parametrize("engine", list(ValidationEngine))
+@pytest.mark.parametrize("batch_size", [1, 7, 1000])
+def test_streamed_release_report(engine, batch_size):
+    register_json = json.dumps(create_register(50))
+    chunks = split_chunks(register_json.encode("UTF-8"), 100)
+
+    expected = get_release_report(register_json, ValidationEngine.RECORD)
+    streamed = get_streamed_release_report(chunks, engine, batch_size)
+    assert streamed.json(by_alias=True) == expected.json(by_alias=True)
+
+
+@pytest.mark.parametrize("register_json", ['{"register": {}}', '{"register": []}'])
+def test_streamed_empty_register(register_json):
+    expected = get_release_report(register_json)
+    streamed = get_streamed_release_report([b" ", register_json.encode("UTF-8")])
+    assert streamed.json(by_alias=True) == expected.json(by_alias=True)
+
+
+@pytest.mark.parametrize(
+    "register_json",
+    [
+        "",
+        "{}",
+        '{"register": {"rec1": {}}',
+        '{"register": {"rec1": {}}} {}',
+        '{"register": {"rec1": {"Latitude": {"dataValue": "1"}}}}',
+    ],
+)
+def test_streamed_invalid_register(register_json):
+    """The stream raises a ValidationError wherever parse_raw does"""
+    with pytest.raises(ValidationError):
+        get_release_report(register_json)
+
+    with pytest.raises(ValidationError):
+        get_streamed_release_report([register_json.encode("UTF-8")])
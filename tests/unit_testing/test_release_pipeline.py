@@ -0,0 +1,219 @@
+"""Tests comparing the release pipeline to validating pages serially"""
+
+import json
+import random
+import time
+from functools import partial
+
+import pytest
+from columnar_register import ValidationEngine, get_release_report
+from pydantic import ValidationError
+from register import (
+    DatasetReleaseStatus,
+    PageReleaseReports,
+    PageSummary,
+    RegisterPage,
+    ReleaseReport,
+)
+from release_pipeline import (
+    get_incremental_release_report,
+    get_pipelined_release_report,
+    get_record_version,
+    get_register_page,
+    get_valid_page_reports,
+    update_page_reports,
+    update_page_summary,
+)
+
+VALUES = {
+    "Host species": ["Vulpes vulpes", "HUMAN", "", "Bat"],
+    "Latitude": ["40.0150", "90.1", "plum", ""],
+    "Collection year": ["2019", "19", ""],
+    "Detection outcome": ["positive", "maybe", ""],
+}
+
+
+def create_page(page: int, record_count: int) -> bytes:
+    rng = random.Random(page)
+    register = {
+        "register": {
+            f"rec{page}-{index}": {
+                column: {
+                    "dataValue": rng.choice(values),
+                    "modifiedBy": "dev",
+                    "version": "1",
+                }
+                for column, values in VALUES.items()
+                if rng.random() < 0.9
+            }
+            for index in range(record_count)
+        }
+    }
+    return json.dumps(register).encode("UTF-8")
+
+
+PAGES = {f"set1/data_{page}.json": create_page(page, 20) for page in range(12)}
+
+
+def fetch_page(key: str) -> bytes:
+    # finish the downloads out of order
+    time.sleep(random.random() * 0.01)
+    return PAGES[key]
+
+
+def serial_release_report(keys) -> ReleaseReport:
+    release_report = ReleaseReport()
+    release_report.release_status = DatasetReleaseStatus.RELEASED
+    for key in keys:
+        release_report = ReleaseReport.merge(
+            release_report, get_release_report(PAGES[key])
+        )
+    return release_report
+
+
+@pytest.mark.parametrize(
+    "threads,processes,window", [(1, 0, 1), (4, 0, None), (3, 0, 2), (2, 2, 3)]
+)
+def test_pipeline_matches_serial(threads, processes, window):
+    keys = list(PAGES)
+    expected = serial_release_report(keys)
+
+    release_report = get_pipelined_release_report(
+        keys,
+        fetch_page,
+        partial(get_release_report, engine=ValidationEngine.COLUMNAR),
+        threads=threads,
+        processes=processes,
+        window=window,
+    )
+
+    assert release_report.json(by_alias=True) == expected.json(by_alias=True)
+
+
+def test_pipeline_no_pages():
+    release_report = get_pipelined_release_report([], fetch_page, get_release_report)
+    assert release_report.release_status == DatasetReleaseStatus.RELEASED
+    assert release_report.success_count == 0
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_pipeline_invalid_page(processes):
+    """An invalid page raises its ValidationError from the pipeline"""
+    pages = {**PAGES, "set1/invalid.json": b'{"register": "invalid"}'}
+
+    with pytest.raises(ValidationError):
+        get_pipelined_release_report(
+            list(pages),
+            pages.__getitem__,
+            get_release_report,
+            threads=2,
+            processes=processes,
+        )
+
+
+def test_register_page():
+    assert get_register_page("set1/data_12.json") == "12"
+    assert get_register_page("set1/data.json") is None
+
+
+def test_incremental_matches_serial():
+    keys = list(PAGES)
+    expected = serial_release_report(keys)
+    etags = {key: "etag1" for key in keys}
+    register_pages = {str(page): RegisterPage(lastUpdated="t1") for page in range(12)}
+
+    # validate every page the first time
+    release_report, new_reports = get_incremental_release_report(
+        keys, fetch_page, get_release_report, {}, threads=3
+    )
+    assert release_report.json(by_alias=True) == expected.json(by_alias=True)
+    assert list(new_reports) == keys
+
+    page_reports = PageReleaseReports.parse_raw(
+        update_page_reports(etags, register_pages, {}, new_reports).json(by_alias=True)
+    )
+
+    # one page was edited, and another page was rewritten
+    register_pages["3"] = RegisterPage(lastUpdated="t2")
+    etags["set1/data_7.json"] = "etag2"
+
+    valid_reports = get_valid_page_reports(etags, register_pages, page_reports)
+    assert set(keys) - set(valid_reports) == {"set1/data_3.json", "set1/data_7.json"}
+
+    fetched = []
+
+    def fetch_changed_page(key: str) -> bytes:
+        fetched.append(key)
+        return PAGES[key]
+
+    release_report, new_reports = get_incremental_release_report(
+        keys, fetch_changed_page, get_release_report, valid_reports, threads=3
+    )
+    assert release_report.json(by_alias=True) == expected.json(by_alias=True)
+    assert sorted(fetched) == ["set1/data_3.json", "set1/data_7.json"]
+
+    # the reports of deleted pages are not cached
+    del etags["set1/data_11.json"]
+    page_reports = update_page_reports(
+        etags, register_pages, valid_reports, new_reports
+    )
+    assert set(page_reports.pages) == set(etags)
+    assert page_reports.pages["set1/data_3.json"].last_updated == "t2"
+    assert page_reports.pages["set1/data_7.json"].etag == "etag2"
+
+
+def test_page_summary():
+    register_dict = json.loads(PAGES["set1/data_0.json"])["register"]
+
+    page_summary = update_page_summary(None, None, register_dict, register_dict)
+    assert page_summary.get_release_report() == get_release_report(
+        json.dumps({"register": register_dict})
+    )
+
+    page_summary.etag = "etag1"
+    page_summary = PageSummary.parse_raw(
+        page_summary.json(by_alias=True, exclude_defaults=True)
+    )
+
+    # fix one record, break another, and add a new record
+    saved = {
+        "rec0-1": {
+            "Latitude": {"dataValue": "40.0150", "modifiedBy": "dev", "version": "2"}
+        },
+        "rec0-2": {
+            "Latitude": {"dataValue": "plum", "modifiedBy": "dev", "version": "2"}
+        },
+        "rec0-20": {
+            "Pathogen": {"dataValue": "SARS-CoV-2", "modifiedBy": "dev", "version": "2"}
+        },
+    }
+    for record_id, record_dict in saved.items():
+        register_dict[record_id] = {**register_dict.get(record_id, {}), **record_dict}
+    expected = get_release_report(json.dumps({"register": register_dict}))
+
+    for previous_etag in ("etag1", "etag2"):
+        # the summary is updated, or rebuilt if the page changed since it was saved
+        updated_summary = update_page_summary(
+            page_summary.copy(deep=True), previous_etag, register_dict, saved
+        )
+        release_report = updated_summary.get_release_report()
+        assert release_report.json(by_alias=True) == expected.json(by_alias=True)
+        assert updated_summary.versions == {
+            record_id: 2 if record_id in saved else 1 for record_id in register_dict
+        }
+
+
+def test_record_version():
+    record_dict = {
+        "Host species": {
+            "dataValue": "Vulpes vulpes",
+            "modifiedBy": "dev",
+            "version": "3",
+            "previous": {"dataValue": "Bat", "modifiedBy": "dev", "version": "1"},
+        },
+        "Latitude": {"dataValue": "40", "modifiedBy": "dev", "version": 12},
+        "_meta": {"order": 1},
+    }
+    assert get_record_version(record_dict) == 12
+    assert get_record_version({"_meta": {"order": 1}}) == 0
+    assert get_record_version("not a record") == 0
@@ -0,0 +1,307 @@
+"""Tests for concurrent saves of records to the same page"""
+
+import os
+
+os.environ.setdefault("CORS_ALLOW", "*")
+os.environ.setdefault("DATASETS_S3_BUCKET", "datasets")
+os.environ.setdefault("METADATA_TABLE_NAME", "metadata")
+
+# pylint: disable=wrong-import-position
+import hashlib
+import json
+import importlib.util
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+from page_format import decode_page, decompress_page
+from page_log import get_page_log_prefix, list_page_log, read_page
+from register import Record
+
+APP_PATH = Path(__file__).parents[2] / "src" / "lambda" / "save_records" / "app.py"
+spec = importlib.util.spec_from_file_location("save_records_app", APP_PATH)
+save_records = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(save_records)
+
+
+def client_error(code: str, operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": code}}, operation)
+
+
+class LocalS3:
+    """An in-memory stand-in for the S3 client, with the same
+    conditional writes as S3; reads are slow so that concurrent
+    saves read the same version of the page."""
+
+    def __init__(self):
+        self.objects: dict[str, tuple[bytes, str]] = {}
+        self.lock = threading.Lock()
+        self.conflicts = 0
+
+    # pylint: disable-next=invalid-name,unused-argument
+    def get_object(self, Bucket, Key):
+        with self.lock:
+            if Key not in self.objects:
+                raise client_error("NoSuchKey", "GetObject")
+            body, etag = self.objects[Key]
+        time.sleep(0.005)
+        return {"Body": io.BytesIO(body), "ETag": etag}
+
+    # pylint: disable-next=invalid-name,unused-argument,too-many-arguments
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **_):
+        with self.lock:
+            current = self.objects.get(Key)
+            if (IfNoneMatch == "*" and current is not None) or (
+                IfMatch is not None and (current is None or current[1] != IfMatch)
+            ):
+                self.conflicts += 1
+                raise client_error("PreconditionFailed", "PutObject")
+
+            etag = f'"{hashlib.md5(Body).hexdigest()}"'
+            self.objects[Key] = (Body, etag)
+            return {"ETag": etag}
+
+    # pylint: disable-next=invalid-name,unused-argument
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+        with self.lock:
+            keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        # list two keys at a time, to test continuation
+        return {
+            "Contents": [{"Key": key} for key in keys[start : start + 2]],
+            "IsTruncated": start + 2 < len(keys),
+            "NextContinuationToken": str(start + 2),
+        }
+
+    # pylint: disable-next=invalid-name,unused-argument
+    def delete_objects(self, Bucket, Delete):
+        with self.lock:
+            for item in Delete["Objects"]:
+                self.objects.pop(item["Key"], None)
+
+    def read_page(self, key: str) -> dict:
+        return decode_page(decompress_page(self.objects[key][0]))
+
+
+def datapoint(value: str, version: int):
+    return {"dataValue": value, "modifiedBy": "dev", "version": str(version)}
+
+
+@pytest.fixture(name="s3")
+def fixture_s3(monkeypatch):
+    s3 = LocalS3()
+    monkeypatch.setattr(save_records, "S3CLIENT", s3)
+    monkeypatch.setattr(save_records, "SAVE_ATTEMPTS", 50)
+    return s3
+
+
+def test_concurrent_saves(s3):
+    def save(index: int):
+        records = {f"rec0|{index}": Record.parse_obj({"Pathogen": datapoint("a", 1)})}
+        return save_records.save_page(
+            "set1/data_0.json", [save_records.get_log_entry(records)]
+        )
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(save, range(16)))
+
+    # every save conflicted with another one, but no record was lost
+    assert s3.conflicts > 0
+    register_dict = s3.read_page("set1/data_0.json")["register"]
+    assert set(register_dict) == {f"rec0|{index}" for index in range(16)}
+
+
+@pytest.mark.parametrize("max_versions", [0, 4])
+def test_concurrent_edits(s3, monkeypatch, max_versions):
+    compact_history = partial(save_records.compact_history, max_versions=max_versions)
+    monkeypatch.setattr(save_records, "compact_history", compact_history)
+
+    def save(version: int):
+        records = {"rec0|0": Record.parse_obj({"Pathogen": datapoint("a", version)})}
+        return save_records.save_page(
+            "set1/data_0.json", [save_records.get_log_entry(records)]
+        )
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(save, range(1, 17)))
+
+    # every edit of the datapoint is merged into its history
+    value = s3.read_page("set1/data_0.json")["register"]["rec0|0"]["Pathogen"]
+    versions = []
+    while value:
+        versions.append(int(value["version"]))
+        value = value.get("previous")
+
+    if max_versions:
+        # or into the history archive
+        archive = s3.read_page("history_archive/set1/data_0.json")["register"]
+        versions += [int(value["version"]) for value in archive["rec0|0"]["Pathogen"]]
+        assert len(versions) > max_versions
+
+    assert versions == list(range(16, 0, -1))
+
+
+def test_save_conflict(s3, monkeypatch):
+    monkeypatch.setattr(save_records, "SAVE_ATTEMPTS", 2)
+    put_object = s3.put_object
+    other_saves = []
+
+    def put_after_other_save(**kwargs):
+        # another save always writes the page first
+        other_saves.append(f'{{"register":{{}},"save":{len(other_saves)}}}')
+        put_object(Bucket="datasets", Key=kwargs["Key"], Body=other_saves[-1].encode())
+        return put_object(**kwargs)
+
+    monkeypatch.setattr(s3, "put_object", put_after_other_save)
+
+    records = {"rec0|0": Record.parse_obj({"Pathogen": datapoint("a", 1)})}
+    with pytest.raises(save_records.SaveConflictError):
+        save_records.save_page(
+            "set1/data_0.json", [save_records.get_log_entry(records)]
+        )
+    assert s3.conflicts == 2
+
+
+def test_page_log(s3, monkeypatch):
+    monkeypatch.setattr(save_records, "PAGE_LOG_COMPACT_ENTRIES", 5)
+    key = "set1/data_0.json"
+
+    def save(version: int):
+        records = {
+            f"rec0|{version % 3}": Record.parse_obj(
+                {"Pathogen": datapoint("a", version)}
+            )
+        }
+        save_records.save_log_entry(key, save_records.get_log_entry(records))
+
+    for version in range(1, 5):
+        save(version)
+
+    # the entries are folded into the page as it is read
+    assert key not in s3.objects
+    assert len(list_page_log(s3, "datasets", key)) == 4
+    page, version = read_page(s3, "datasets", key)
+    register_dict = decode_page(page)["register"]
+    assert set(register_dict) == {"rec0|0", "rec0|1", "rec0|2"}
+    assert register_dict["rec0|1"]["Pathogen"]["version"] == 4
+    assert register_dict["rec0|1"]["Pathogen"]["previous"]["version"] == 1
+
+    # the fifth entry compacts the log into the page
+    save(5)
+    assert not list_page_log(s3, "datasets", key)
+    compacted = s3.read_page(key)["register"]
+    assert compacted["rec0|0"] == register_dict["rec0|0"]
+    assert compacted["rec0|1"] == register_dict["rec0|1"]
+    assert compacted["rec0|2"]["Pathogen"]["version"] == 5
+    assert compacted["rec0|2"]["Pathogen"]["previous"]["version"] == 2
+
+    # a new entry changes the version of the page
+    _, compacted_version = read_page(s3, "datasets", key)
+    save(6)
+    _, next_version = read_page(s3, "datasets", key)
+    assert len({version, compacted_version, next_version}) == 3
+    assert next_version.startswith(compacted_version)
+
+
+def test_page_log_response(s3, monkeypatch):
+    key = "set1/data_0.json"
+    # the first version is in the page, and another record is in the log
+    save_records.save_records_page(
+        key, {"rec0|0": Record.parse_obj({"Pathogen": datapoint("a", 1)})}
+    )
+    monkeypatch.setattr(save_records, "PAGE_LOG", True)
+    save_records.save_records_page(
+        key, {"rec0|1": Record.parse_obj({"Pathogen": datapoint("b", 1)})}
+    )
+
+    status, response = save_records.save_records_page(
+        key, {"rec0|0": Record.parse_obj({"Pathogen": datapoint("a", 2)})}
+    )
+
+    # the saved records are merged with the versions in the page,
+    # as without the log, and the other records are not returned
+    assert status == 200
+    assert len(list_page_log(s3, "datasets", key)) == 2
+    assert set(response) == {"rec0|0"}
+    merged = response["rec0|0"]["Pathogen"]
+    assert merged["version"] == 2
+    assert merged["previous"]["version"] == 1
+
+    page, _ = read_page(s3, "datasets", key, record_ids={"rec0|1"})
+    assert set(json.loads(page)["register"]) == {"rec0|1"}
+
+
+def test_page_log_concurrent_saves(s3, monkeypatch):
+    monkeypatch.setattr(save_records, "PAGE_LOG_COMPACT_ENTRIES", 3)
+    key = "set1/data_0.json"
+
+    def save(index: int):
+        records = {f"rec0|{index}": Record.parse_obj({"Pathogen": datapoint("a", 1)})}
+        save_records.save_log_entry(key, save_records.get_log_entry(records))
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(save, range(20)))
+
+    # entries are compacted while others are saved, but none are lost
+    page, _ = read_page(s3, "datasets", key)
+    assert set(decode_page(page)["register"]) == {f"rec0|{i}" for i in range(20)}
+    assert len(list_page_log(s3, "datasets", key)) < 20
+    assert all(
+        not log_key.startswith(get_page_log_prefix("set1/data_1.json"))
+        for log_key in s3.objects
+    )
+
+
+def test_page_key():
+    assert save_records.get_page_key("set1", "rec12|abc") == "set1/data_12.json"
+    assert save_records.get_page_key("set1", "rec12abc") == "set1/data.json"
+
+
+def test_batched_save(s3, monkeypatch):
+    user = SimpleNamespace(project_ids={"prj1"})
+    monkeypatch.setattr(save_records, "check_auth", lambda *_, **__: user)
+    monkeypatch.setattr(save_records, "check_project_auth", lambda *_: True)
+    # a legacy page which can't be merged into
+    s3.objects["set1/data.json"] = (b'{"register":{"rec1":"not a record"}}', '"1"')
+
+    records = {
+        f"rec{page}|{index}": {"Pathogen": datapoint("a", 1)}
+        for page in range(5)
+        for index in range(3)
+    }
+    event = {
+        "body": json.dumps(
+            {
+                "projectID": "prj1",
+                "datasetID": "set1",
+                "records": {**records, "rec1": {"Pathogen": datapoint("a", 1)}},
+            }
+        )
+    }
+
+    response = save_records.lambda_handler(event, None)
+    assert response["statusCode"] == 207
+
+    body = json.loads(response["body"])
+    assert set(body["register"]) == set(records)
+    results = {result["registerPage"]: result for result in body["pages"]}
+    assert results[None]["statusCode"] == 400
+    assert results[None]["recordIDs"] == ["rec1"]
+    for page in range(5):
+        assert results[str(page)]["statusCode"] == 200
+        register_dict = s3.read_page(f"set1/data_{page}.json")["register"]
+        assert set(register_dict) == {f"rec{page}|{index}" for index in range(3)}
+
+    # records in a single page are saved as before
+    event["body"] = json.dumps(
+        {"projectID": "prj1", "datasetID": "set1", "records": {"rec0|9": {}}}
+    )
+    response = save_records.lambda_handler(event, None)
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"]) == {"register": {"rec0|9": {}}}
@@ -0,0 +1,75 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+# pylint: disable=unused-import
+
+import os
+
+from fixture import ENGINE, map_data, mock_data
+from map_tiles import get_tile
+from published_records import FiltersQueryStringParameters
+from sqlalchemy.orm import Session
+from tile_cache import (
+    UNFILTERED,
+    LocalTileCache,
+    get_filters_hash,
+    get_tile_key,
+    refresh_tile_cache,
+)
+
+
+def test_filters_hash():
+    assert get_filters_hash(None) == UNFILTERED
+    assert get_filters_hash(FiltersQueryStringParameters()) == UNFILTERED
+    assert get_filters_hash(FiltersQueryStringParameters(pathogen=[])) == UNFILTERED
+
+    filters_hash = get_filters_hash(
+        FiltersQueryStringParameters(pathogen=["path1", "path2"])
+    )
+    assert filters_hash != UNFILTERED
+    # the order and repetition of values doesn't matter
+    assert filters_hash == get_filters_hash(
+        FiltersQueryStringParameters(pathogen=["path2", "path1", "path2"])
+    )
+    assert filters_hash != get_filters_hash(
+        FiltersQueryStringParameters(pathogen=["path1"])
+    )
+    assert filters_hash != get_filters_hash(
+        FiltersQueryStringParameters(host_species=["path1", "path2"])
+    )
+
+
+def test_local_tile_cache(tmp_path):
+    cache = LocalTileCache(str(tmp_path))
+    assert cache.get_version() is None
+
+    key = get_tile_key("v1", UNFILTERED, 1, 0, 1)
+    assert cache.read(key) is None
+    cache.write(key, b"tile")
+    assert cache.read(key) == b"tile"
+    # empty tiles are cached too
+    cache.write(key, b"")
+    assert cache.read(key) == b""
+
+    cache.set_version("v1")
+    assert cache.get_version() == "v1"
+
+    cache.delete_prefix("v1/")
+    assert cache.read(key) is None
+    assert cache.get_version() == "v1"
+
+
+def test_refresh_tile_cache(map_data, tmp_path):
+    cache = LocalTileCache(str(tmp_path))
+    old_key = get_tile_key("v1", UNFILTERED, 0, 0, 0)
+    cache.write(old_key, b"old tile")
+    cache.set_version("v1")
+
+    refresh_tile_cache(ENGINE, cache, "v2", max_zoom=1)
+
+    assert cache.get_version() == "v2"
+    assert cache.read(old_key) is None
+    with Session(ENGINE) as session:
+        tile = get_tile(session, 0, 0, 0)
+    assert tile
+    assert cache.read(get_tile_key("v2", UNFILTERED, 0, 0, 0)) == tile
+    assert len(os.listdir(tmp_path / "v2" / UNFILTERED / "1")) == 2